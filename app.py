@@ -1,16 +1,25 @@
+import os
+# Socket.IO แบบ eventlet (REPORT_SOCKETIO_ASYNC_MODE=eventlet) ต้อง monkey_patch ก่อน import โมดูลอื่นทั้งหมด
+if os.environ.get('REPORT_SOCKETIO_ASYNC_MODE') == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
 import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
 import re
 import html
 import json
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape as xml_escape
 from ftfy import fix_text
 import io
 import csv
 import datetime
-import os
 import argparse
 import pandas as pd
-from flask import Flask, request, render_template, jsonify, send_from_directory, send_file, send_from_directory
+import numpy as np
+from flask import Flask, request, render_template, jsonify, send_from_directory, send_file, send_from_directory, Response, stream_with_context
+from flask_socketio import SocketIO, join_room, leave_room
 import tempfile
 import threading
 import uuid
@@ -21,28 +30,130 @@ from reportlab.lib.units import inch
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 import logging
-from queue import Queue
 import zipfile
+import zlib
+import gzip
 import shutil
+import posixpath
+import contextlib
+import itertools
+import functools
+import bisect
+import hashlib
+import sqlite3
+import socket
+from collections import OrderedDict, deque
 import time
+import random
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 # สร้าง Flask application
 app = Flask(__name__)
+# ช่องทาง push ความคืบหน้าและ log ไปยังหน้าเว็บผ่าน WebSocket (หน้าเว็บกลับไปใช้ polling หากเชื่อมต่อไม่ได้)
+# ค่าเริ่มต้นเป็น 'threading' เพราะงานเบื้องหลังใช้ Thread และ ProcessPoolExecutor ปกติ
+# 'eventlet' ใช้ web server ของ eventlet (monkey_patch ไว้ที่ต้นไฟล์แล้ว)
+SOCKETIO_ASYNC_MODE = os.environ.get('REPORT_SOCKETIO_ASYNC_MODE', 'threading')
+# โหมดพัฒนา (REPORT_DEBUG=1): ใช้ Werkzeug พร้อม debugger และรีโหลดอัตโนมัติ ห้ามเปิดบนเซิร์ฟเวอร์จริง
+DEBUG = os.environ.get('REPORT_DEBUG', '0') == '1'
+# host และ port ที่เซิร์ฟเวอร์รอรับการเชื่อมต่อ
+SERVER_HOST = os.environ.get('REPORT_HOST', '0.0.0.0')
+SERVER_PORT = int(os.environ.get('REPORT_PORT', '5050'))
+socketio = SocketIO(app, async_mode=SOCKETIO_ASYNC_MODE)
 
 # --- สถานะการประมวลผลและ Lock สำหรับ Thread-safe ---
-# `processing_status` เก็บสถานะของแต่ละงานที่กำลังประมวลผล โดยใช้ job_id เป็น key
-# ตัวอย่าง:
-# {
-#     'job_id_1': {'total': 100, 'processed': 10, 'completed': False, 'error': None, 'canceled': False, 'results': [], 'temp_dir': '/tmp/report_job_xyz', 'zip_file_path': None, 'timestamp': datetime_obj},
-#     'job_id_2': {...}
-# }
-processing_status = {}
-# `status_lock` ใช้สำหรับควบคุมการเข้าถึง `processing_status` เพื่อป้องกัน Race Condition ใน Multi-threading
+# สถานะของแต่ละงาน (ความคืบหน้า ผลลัพธ์รายแถว และไฟล์ ZIP) เก็บใน `job_store` (SQLite, ดู JobStore)
+# ส่วนด้านล่างเป็นสถานะสดที่มีเฉพาะใน process ที่กำลังประมวลผลงานนั้น (รวมถึง log ของงาน คิวของ JobScheduler และห้องของ Socket.IO)
+# แอปจึงรองรับการรันเป็น process เดียวเท่านั้น: ห้ามรันหลาย worker process (เช่น gunicorn -w N) หลัง load balancer
+# เพราะคำขอ /logs, /stream_report และ Socket.IO ที่ไปถึง process อื่นจะไม่เห็นงานที่กำลังประมวลผล
+# `status_lock` ใช้สำหรับควบคุมการเข้าถึง `active_pipelines`, `active_archives` และ `pushed_progress` เพื่อป้องกัน Race Condition ใน Multi-threading
 status_lock = threading.Lock()
+# `active_pipelines` เก็บ PipelineJob ของงานที่กำลังประมวลผลใน pipeline (ใช้แสดงส่วนแบ่งของ Worker และเวลารอแบบสดใน /status
+# และแจ้งการยกเลิกจาก /cancel ให้ Worker ทันที)
+active_pipelines = {}
+# `active_archives` เก็บ ReportArchive ของงานที่กำลังเขียนไฟล์ ZIP อยู่ (ใช้ส่งไฟล์แบบ streaming ใน /stream_report)
+active_archives = {}
+
+# --- ตั้งค่า Logger และ log ของแต่ละงาน ---
+# จำนวนบรรทัด log สูงสุดที่เก็บต่องาน และความยาวสูงสุดต่อบรรทัด (หน่วยความจำต่องานจึงมีขอบเขตคงที่)
+JOB_LOG_MAX_LINES = int(os.environ.get('REPORT_JOB_LOG_LINES', '2000'))
+JOB_LOG_MAX_LINE_LENGTH = int(os.environ.get('REPORT_JOB_LOG_LINE_LENGTH', '1000'))
+
+class JobLogStore:
+    """
+    log ของแต่ละงานสำหรับแสดงบนหน้าเว็บ เก็บใน ring buffer ขนาด max_lines บรรทัดต่องาน
+    - แต่ละบรรทัดมีหมายเลขลำดับ (seq) ที่เพิ่มขึ้นเรื่อยๆ เริ่มจาก 0 ผู้อ่านเก็บ cursor (seq ถัดไปที่ต้องการ) เอง
+    - การอ่านไม่ลบบรรทัดออก หลาย client จึงอ่าน log ของงานเดียวกันได้โดยไม่แย่งกัน
+    - เมื่อ buffer เต็ม บรรทัดเก่าที่สุดจะถูกทิ้งและนับไว้ใน dropped
+    """
 
-# --- ตั้งค่า Logger และ Log Queue ---
-# `log_queue` ใช้เก็บข้อความ log ที่จะถูกส่งไปยังหน้าเว็บแบบ Real-time
-log_queue = Queue()
+    def __init__(self, max_lines, max_line_length):
+        self.max_lines = max(1, max_lines)
+        self.max_line_length = max_line_length
+        self._cond = threading.Condition()
+        self._jobs = {} # job_id -> {'lines': deque, 'next': seq ถัดไป, 'dropped': จำนวนบรรทัดที่ถูกทิ้ง}
+        self.version = 0 # เพิ่มขึ้นทุกครั้งที่มีบรรทัดใหม่ (ใช้รอ log ใหม่ใน wait_for_change)
+
+    def append(self, job_id, message):
+        if len(message) > self.max_line_length:
+            message = message[:self.max_line_length] + '…'
+        with self._cond:
+            log = self._jobs.get(job_id)
+            if log is None:
+                log = self._jobs[job_id] = {'lines': deque(maxlen=self.max_lines), 'next': 0, 'dropped': 0}
+            if len(log['lines']) == self.max_lines:
+                log['dropped'] += 1
+            log['lines'].append(message)
+            log['next'] += 1
+            self.version += 1
+            self._cond.notify_all()
+
+    def read(self, job_id, since=0):
+        """
+        อ่าน log ของงานตั้งแต่ seq `since`
+        Returns:
+        - dict: {'logs': [ข้อความ], 'first': seq ของบรรทัดแรกที่คืน, 'next': cursor สำหรับอ่านครั้งถัดไป, 'dropped': จำนวนบรรทัดที่ถูกทิ้ง}
+          หาก first > since แปลว่าบรรทัดระหว่างนั้นถูกทิ้งไปแล้ว
+        """
+        with self._cond:
+            log = self._jobs.get(job_id)
+            if log is None:
+                return {'logs': [], 'first': since, 'next': since, 'dropped': 0}
+            oldest = log['next'] - len(log['lines'])
+            first = min(max(since, oldest), log['next'])
+            lines = list(itertools.islice(log['lines'], first - oldest, None))
+            return {'logs': lines, 'first': first, 'next': log['next'], 'dropped': log['dropped']}
+
+    def wait_for_change(self, version, timeout):
+        """รอจนกว่าจะมี log ใหม่หลัง `version` (หรือครบ timeout วินาที) แล้วคืน version ปัจจุบัน"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version, timeout=timeout)
+            return self.version
+
+    def remove(self, job_id):
+        with self._cond:
+            self._jobs.pop(job_id, None)
+
+# `job_logs` เก็บ log ของแต่ละงานที่จะถูกส่งไปยังหน้าเว็บแบบ Real-time
+job_logs = JobLogStore(JOB_LOG_MAX_LINES, JOB_LOG_MAX_LINE_LENGTH)
+# job_id ของงานที่ Thread ปัจจุบันทำงานให้ ใช้ระบุว่า log แต่ละบรรทัดเป็นของงานไหน
+log_context = threading.local()
+
+def bind_log_job(job_id):
+    """ผูก Thread ปัจจุบันกับงาน `job_id` (สำหรับ Thread ที่ทำงานให้งานเดียวตลอดอายุ)"""
+    log_context.job_id = job_id
+
+@contextlib.contextmanager
+def job_log_context(job_id):
+    """ผูก log ที่เกิดขึ้นภายใน block กับงาน `job_id` ชั่วคราว (สำหรับ request handler)"""
+    previous = getattr(log_context, 'job_id', None)
+    log_context.job_id = job_id
+    try:
+        yield
+    finally:
+        log_context.job_id = previous
 
 # ตั้งค่า logger สำหรับการบันทึกข้อความ (เช่น INFO, WARNING, ERROR)
 logger = logging.getLogger(__name__)
@@ -51,33 +162,69 @@ logger.setLevel(logging.INFO) # กำหนดระดับ log ขั้น
 UPLOAD_FOLDER = 'uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# --- ตั้งค่าการประมวลผลแบบขนาน (pipeline: fetch -> transform -> render) ---
+# จำนวน Worker ของแต่ละ stage (ใช้ร่วมกันทุกงาน): fetch = จำนวนคำขอ SOAP ที่ส่งพร้อมกันได้สูงสุด
+FETCH_WORKERS = int(os.environ.get('REPORT_FETCH_WORKERS', '8'))
+TRANSFORM_WORKERS = int(os.environ.get('REPORT_TRANSFORM_WORKERS', '2'))
+RENDER_WORKERS = int(os.environ.get('REPORT_RENDER_WORKERS', '4'))
+# จำนวนวงจรสูงสุดที่แต่ละงานมีค้างอยู่ใน pipeline (ทุก stage รวมกัน) เพื่อควบคุมหน่วยความจำ
+PIPELINE_MAX_IN_FLIGHT = int(os.environ.get('REPORT_PIPELINE_MAX_IN_FLIGHT', '32'))
+# ระยะเวลา (วินาที) ที่ Worker เชื่อสถานะการยกเลิกที่จำไว้ใน PipelineJob ก่อนอ่านจาก job_store ใหม่
+# (/cancel ใน process เดียวกันตั้งค่าให้ทันที ค่านี้มีผลเฉพาะการยกเลิกที่มาทางฐานข้อมูลโดยตรง)
+PIPELINE_CANCEL_CHECK_INTERVAL = float(os.environ.get('REPORT_PIPELINE_CANCEL_CHECK_INTERVAL', '0.5'))
+# จำนวน process สำหรับสร้าง PDF แยกจาก process หลัก (0 = สร้างใน Thread ของ render stage)
+# เมื่อเปิดใช้ ควรตั้ง REPORT_RENDER_WORKERS ให้ไม่น้อยกว่าค่านี้ เพื่อให้ทุก process มีงานทำ
+PDF_PROCESS_WORKERS = int(os.environ.get('REPORT_PDF_PROCESSES', '0'))
+
+# --- ตั้งค่าการบีบอัดไฟล์ใน ZIP ---
+# ระดับการบีบอัด (0-9) ของ CSV และไฟล์ชนิดอื่นที่ไม่ได้ระบุใน ARCHIVE_COMPRESSION_POLICY
+CSV_COMPRESSLEVEL = int(os.environ.get('REPORT_CSV_COMPRESSLEVEL', '6'))
+DEFAULT_COMPRESSLEVEL = 6
+# PDF จาก ReportLab บีบอัด stream ภายในไว้แล้ว จึงเก็บแบบ STORED เป็นค่าเริ่มต้น (0)
+# กำหนดเป็น 1-9 หากต้องการแลก CPU กับขนาดไฟล์ที่ลดลงจากส่วนโครงสร้างของ PDF
+PDF_COMPRESSLEVEL = int(os.environ.get('REPORT_PDF_COMPRESSLEVEL', '0'))
+# วิธีบีบอัดตามนามสกุลไฟล์: (compress_type, compresslevel)
+ARCHIVE_COMPRESSION_POLICY = {
+    '.pdf': (zipfile.ZIP_DEFLATED, PDF_COMPRESSLEVEL) if PDF_COMPRESSLEVEL > 0 else (zipfile.ZIP_STORED, None),
+    '.csv': (zipfile.ZIP_DEFLATED, CSV_COMPRESSLEVEL),
+}
+# บีบอัดใน Thread ของ render stage ก่อนเขียนลง ZIP (zlib ปล่อย GIL จึงบีบอัดหลายไฟล์พร้อมกันได้)
+# ปิดไว้เป็นค่าเริ่มต้น (0) เพราะต้องเขียน entry ผ่าน state ภายในของ zipfile (ดู write_precompressed_entry)
+# ซึ่งไม่ใช่ API สาธารณะและอาจเปลี่ยนใน Python รุ่นใหม่ ค่าเริ่มต้นจึงบีบอัดภายใน lock ของ ZIP ทีละไฟล์ด้วย writestr
+# เปิด (1) ได้เมื่อทดสอบกับ Python ที่ใช้จริงแล้ว (ยังตรวจด้วย precompressed_zip_supported ก่อนใช้ทุกครั้ง)
+ARCHIVE_PARALLEL_COMPRESSION = os.environ.get('REPORT_PARALLEL_COMPRESSION', '0') == '1'
+
 # ล้าง handler เก่าที่อาจมีอยู่ เพื่อป้องกัน log ซ้ำ
 if logger.handlers:
     for handler in list(logger.handlers):
         logger.removeHandler(handler)
 
-# Custom Log Handler ที่ส่งข้อความ log ไปยัง Queue
-class QueueHandler(logging.Handler):
-    def __init__(self, queue):
+# Custom Log Handler ที่ส่งข้อความ log ไปยัง log ของงานที่ Thread ปัจจุบันทำงานให้
+# log ที่ไม่ได้เกิดในงานใด (เช่น การล้างงานเก่า) แสดงเฉพาะใน Console
+class JobLogHandler(logging.Handler):
+    def __init__(self, store):
         super().__init__()
-        self.queue = queue
+        self.store = store
 
     def emit(self, record):
         try:
+            job_id = getattr(log_context, 'job_id', None)
+            if job_id is None:
+                return
             msg = self.format(record) # จัดรูปแบบข้อความ log
 
             # ตรวจสอบและกรองข้อความที่ไม่ต้องการออกไปยังหน้าเว็บ
             if "📁 ลบโฟลเดอร์ CSV/PDF ชั่วคราว" in msg:
-                return # ไม่ใส่ข้อความนี้ลงในคิว
+                return # ไม่เก็บข้อความนี้
 
             # ใช้ Regular Expression เพื่อดึงเฉพาะส่วนข้อความหลักของ log (ไม่เอา timestamp, level, job_id)
             log_pattern = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3} - (INFO|WARNING|ERROR|CRITICAL) - (Job [0-9a-f-]+: )?(.*)")
             match = log_pattern.match(msg)
             if match:
                 clean_msg = match.group(3) # ดึงส่วนข้อความหลัก
-                self.queue.put(clean_msg) # ใส่ข้อความที่กรองแล้วลงในคิว
+                self.store.append(job_id, clean_msg) # เก็บข้อความที่กรองแล้ว
             else:
-                self.queue.put(msg) # ถ้าไม่ตรง pattern ก็ใส่ข้อความเต็มลงไป
+                self.store.append(job_id, msg) # ถ้าไม่ตรง pattern ก็เก็บข้อความเต็ม
 
         except Exception:
             self.handleError(record) # จัดการข้อผิดพลาดที่เกิดขึ้นใน handler นี้
@@ -87,88 +234,1383 @@ console_handler = logging.StreamHandler()
 console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 logger.addHandler(console_handler)
 
-# เพิ่ม QueueHandler เข้าไปใน logger เพื่อให้ log ไปอยู่ใน Queue ด้วย
-queue_handler = QueueHandler(log_queue)
-logger.addHandler(queue_handler)
+# เพิ่ม JobLogHandler เข้าไปใน logger เพื่อให้ log ไปอยู่ใน log ของงานด้วย
+job_log_handler = JobLogHandler(job_logs)
+logger.addHandler(job_log_handler)
+
+# --- Metrics สำหรับ Prometheus (/metrics) ---
+# ขอบเขตของ bucket (วินาที) ของ histogram เวลาที่ใช้ในแต่ละขั้นตอน
+METRICS_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def format_metric_labels(labels):
+    """แปลง dict ของ label เป็นข้อความ {name="value",...} ตาม Prometheus text format"""
+    if not labels:
+        return ''
+    escaped = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+def format_metric_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """ค่าสะสมที่เพิ่มขึ้นอย่างเดียว แยกตามค่าของ label"""
+    type = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {} # tuple ของค่า label -> ค่าสะสม
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in values:
+            yield self.name, dict(zip(self.labelnames, labelvalues)), value
+
+class Histogram:
+    """
+    การกระจายของค่าที่วัดได้ (เช่น เวลาที่ใช้) ใน bucket ที่กำหนดไว้ล่วงหน้า แยกตามค่าของ label
+    observe() เก็บเฉพาะจำนวนต่อ bucket, ผลรวม และจำนวนครั้ง (ไม่เก็บค่าดิบ) หน่วยความจำจึงคงที่
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values = {} # tuple ของค่า label -> [จำนวนต่อ bucket (ช่องสุดท้ายคือ +Inf), ผลรวม]
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(labelvalues, list(counts), total) for labelvalues, (counts, total) in self._values.items()]
+        for labelvalues, counts, total in values:
+            labels = dict(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", dict(labels, le=format_metric_value(bound)), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+class MetricsRegistry:
+    """
+    รวม metric ทั้งหมดของแอปและแปลงเป็น Prometheus text format (version 0.0.4) สำหรับ /metrics
+    การบันทึกค่า (Counter.inc / Histogram.observe) ใช้เพียง lock และการบวกเลข
+    ส่วนค่าที่อ่านจากสถานะปัจจุบัน (gauge เช่น จำนวนงานหรือ Queue) คำนวณผ่าน collector ตอนมีผู้เรียก /metrics เท่านั้น
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=METRICS_LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        """
+        ลงทะเบียนฟังก์ชันที่คืนค่า metric ณ เวลาที่ถูกเรียก (ใช้เป็น decorator ได้)
+        func() ต้องคืน iterable ของ (name, type, help, [(labels dict, value), ...])
+        """
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+
+        def add_family(name, metric_type, help_text, samples):
+            help_text = help_text.replace('\\', '\\\\').replace('\n', '\\n')
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{format_metric_labels(labels)} {format_metric_value(value)}")
+
+        for metric in self._metrics:
+            add_family(metric.name, metric.type, metric.help, metric.samples())
+        for collect in self._collectors:
+            try:
+                for name, metric_type, help_text, values in collect():
+                    add_family(name, metric_type, help_text, ((name, labels, value) for labels, value in values))
+            except Exception as e:
+                logger.warning(f"⚠️ อ่านค่า metric จาก {collect.__name__} ไม่สำเร็จ: {e}")
+        return '\n'.join(lines) + '\n'
+
+metrics_registry = MetricsRegistry()
+operation_seconds = metrics_registry.histogram(
+    'summary_report_operation_seconds', 'Time spent in each processing step.', ['operation'])
+operations_total = metrics_registry.counter(
+    'summary_report_operations_total', 'Processing steps completed, by outcome.', ['operation', 'outcome'])
+rows_total = metrics_registry.counter(
+    'summary_report_rows_total', 'Excel rows processed, by outcome.', ['outcome'])
+archive_bytes_total = metrics_registry.counter(
+    'summary_report_archive_bytes_total', 'Bytes written to report ZIP files, by file extension.', ['extension'])
+pipeline_wait_seconds = metrics_registry.histogram(
+    'summary_report_pipeline_wait_seconds', 'Time circuits waited in a shared pipeline stage queue.', ['stage'])
+
+@contextlib.contextmanager
+def time_operation(operation):
+    """จับเวลาขั้นตอน `operation` ลง operation_seconds และนับผลลัพธ์ (ok/error ตาม exception) ลง operations_total"""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        operation_seconds.observe(time.perf_counter() - started, operation)
+        operations_total.inc(operation, outcome)
+
+def timed(operation, failed=None):
+    """
+    Decorator สำหรับจับเวลาฟังก์ชันด้วย time_operation
+    Parameters:
+    - operation (str): ชื่อขั้นตอน (label 'operation')
+    - failed (callable): ฟังก์ชันตรวจค่าที่คืน หากคืน True จะนับเป็น 'error' (สำหรับฟังก์ชันที่ดักจับ exception เอง)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = func(*args, **kwargs)
+                if failed is None or not failed(result):
+                    outcome = 'ok'
+                return result
+            finally:
+                operation_seconds.observe(time.perf_counter() - started, operation)
+                operations_total.inc(operation, outcome)
+        return wrapper
+    return decorator
 
 # --- ตั้งค่าฟอนต์ภาษาไทยสำหรับ PDF ---
 THAI_FONT_NAME = 'THSarabunNew' # ชื่อฟอนต์ที่จะใช้ใน ReportLab
 THAI_FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'THSarabunNew.ttf') # Path ไปยังไฟล์ฟอนต์
 
-THAI_FONT_REGISTERED = False
-# ตรวจสอบว่าไฟล์ฟอนต์มีอยู่หรือไม่
-if os.path.exists(THAI_FONT_PATH):
-    try:
-        # ลงทะเบียนฟอนต์กับ ReportLab เพื่อให้สามารถใช้งานใน PDF ได้
-        pdfmetrics.registerFont(TTFont(THAI_FONT_NAME, THAI_FONT_PATH))
-        THAI_FONT_REGISTERED = True
-        #logger.info(f"Thai font '{THAI_FONT_NAME}' registered successfully from '{THAI_FONT_PATH}'.")
-    except Exception as e:
-        logger.error(f"ERROR: Could not register Thai font '{THAI_FONT_NAME}'. Error: {e}")
-else:
-    logger.warning(f"WARNING: Thai font file '{THAI_FONT_PATH}' not found. Please ensure the font file is in the same directory as the script.")
+def register_thai_font():
+    """
+    ลงทะเบียนฟอนต์ภาษาไทยกับ ReportLab (เรียกครั้งเดียวต่อ process)
+    Returns:
+    - bool: True หากลงทะเบียนสำเร็จ
+    """
+    # ตรวจสอบว่าไฟล์ฟอนต์มีอยู่หรือไม่
+    if os.path.exists(THAI_FONT_PATH):
+        try:
+            # ลงทะเบียนฟอนต์กับ ReportLab เพื่อให้สามารถใช้งานใน PDF ได้
+            pdfmetrics.registerFont(TTFont(THAI_FONT_NAME, THAI_FONT_PATH))
+            #logger.info(f"Thai font '{THAI_FONT_NAME}' registered successfully from '{THAI_FONT_PATH}'.")
+            return True
+        except Exception as e:
+            logger.error(f"ERROR: Could not register Thai font '{THAI_FONT_NAME}'. Error: {e}")
+    else:
+        logger.warning(f"WARNING: Thai font file '{THAI_FONT_PATH}' not found. Please ensure the font file is in the same directory as the script.")
+    return False
+
+THAI_FONT_REGISTERED = register_thai_font()
+
+# --- SOAP Client สำหรับ SolarWinds API ---
+# URL และ SOAPAction ของ API เวอร์ชัน v2 (กำหนดทับได้ด้วย Environment Variable)
+SOLARWINDS_API_URL = os.environ.get('SOLARWINDS_API_URL', "http://1.179.233.116:8082/api_csoc_02/server_solarwinds_ginv2.php")
+SOLARWINDS_SOAP_ACTION = os.environ.get('SOLARWINDS_SOAP_ACTION', "http://1.179.233.116/api_csoc_02/server_solarwinds_ginv2.php/circuitStatus")
+# จำนวน connection ที่เปิดค้างไว้ใน pool (ควรเท่ากับจำนวน Worker ที่ยิง API พร้อมกัน)
+SOAP_POOL_SIZE = int(os.environ.get('SOAP_POOL_SIZE', str(max(1, FETCH_WORKERS))))
+# Timeout แยกระหว่างการเชื่อมต่อและการรออ่านข้อมูล (วินาที)
+SOAP_CONNECT_TIMEOUT = float(os.environ.get('SOAP_CONNECT_TIMEOUT', '5'))
+SOAP_READ_TIMEOUT = float(os.environ.get('SOAP_READ_TIMEOUT', '10'))
+# การลองใหม่เมื่อเชื่อมต่อไม่ได้/หมดเวลา/HTTP 429 หรือ 5xx: จำนวนครั้งสูงสุดต่อคำขอ (รวมครั้งแรก)
+# และรอแบบ exponential backoff พร้อม jitter ระหว่าง 0 ถึง min(SOAP_BACKOFF_MAX, SOAP_BACKOFF_BASE * 2^(n-1)) วินาที
+SOAP_MAX_ATTEMPTS = int(os.environ.get('SOAP_MAX_ATTEMPTS', '4'))
+SOAP_BACKOFF_BASE = float(os.environ.get('SOAP_BACKOFF_BASE', '0.5'))
+SOAP_BACKOFF_MAX = float(os.environ.get('SOAP_BACKOFF_MAX', '8'))
+# งบการลองใหม่: ลองใหม่ได้ไม่เกินสัดส่วนนี้ของจำนวนคำขอ (สำรองไว้ SOAP_RETRY_BUDGET_RESERVE ครั้ง)
+SOAP_RETRY_BUDGET_RATIO = float(os.environ.get('SOAP_RETRY_BUDGET_RATIO', '0.2'))
+SOAP_RETRY_BUDGET_RESERVE = int(os.environ.get('SOAP_RETRY_BUDGET_RESERVE', '10'))
+# Circuit breaker: เปิด (ล้มเหลวทันทีโดยไม่เรียก API) เมื่อผิดพลาดติดกันครบจำนวนนี้
+# และยอมให้คำขอทดสอบ (half-open) ผ่านไปได้หลังจากเปิดครบ SOAP_BREAKER_RESET_SECONDS วินาที
+SOAP_BREAKER_THRESHOLD = int(os.environ.get('SOAP_BREAKER_THRESHOLD', '5'))
+SOAP_BREAKER_RESET_SECONDS = float(os.environ.get('SOAP_BREAKER_RESET_SECONDS', '30'))
+# จำนวนคำขอที่ส่งพร้อมกันได้ (รวมทุกงาน) ปรับอัตโนมัติแบบ AIMD ระหว่าง SOAP_LIMIT_MIN ถึง SOAP_LIMIT_MAX
+# คำขอที่ช้ากว่า SOAP_LIMIT_LATENCY_TARGET วินาที หรือผิดพลาดชั่วคราว จะลด limit ลงเหลือ SOAP_LIMIT_BACKOFF_RATIO เท่า
+SOAP_LIMIT_INITIAL = int(os.environ.get('SOAP_LIMIT_INITIAL', '4'))
+SOAP_LIMIT_MIN = int(os.environ.get('SOAP_LIMIT_MIN', '1'))
+SOAP_LIMIT_MAX = int(os.environ.get('SOAP_LIMIT_MAX', str(SOAP_POOL_SIZE)))
+SOAP_LIMIT_LATENCY_TARGET = float(os.environ.get('SOAP_LIMIT_LATENCY_TARGET', str(SOAP_READ_TIMEOUT / 2)))
+SOAP_LIMIT_BACKOFF_RATIO = float(os.environ.get('SOAP_LIMIT_BACKOFF_RATIO', '0.75'))
+# ขนาดข้อมูลที่ป้อนให้ XMLPullParser ต่อครั้ง (ไบต์)
+SOAP_PARSE_CHUNK_SIZE = 64 * 1024
+# ใช้ค้นหา SOAP Envelope ในข้อความตอบกลับที่ parse ตรง ๆ ไม่ได้ (เช่น มีข้อความ error ของ Server ปนมา)
+SOAP_ENVELOPE_PATTERN = re.compile(r"(<\?xml.*?</SOAP-ENV:Envelope>)", re.DOTALL)
+# วิธีแก้ข้อความที่เข้ารหัสผิด (mojibake) ในข้อมูลจาก API:
+# - 'targeted': json.loads ก่อน แล้วแก้ด้วย ftfy เฉพาะ string ที่มีอักขระนอก ASCII (จำผลลัพธ์ของค่าที่ซ้ำกันไว้)
+# - 'legacy': unicode_escape + ftfy กับข้อความ JSON ทั้งก้อนก่อน json.loads แบบเดิม
+# - 'compare': ทำทั้งสองแบบ ใช้ผลของ 'targeted' และ log เตือนเมื่อผลลัพธ์ไม่ตรงกัน (สำหรับตรวจสอบก่อนเปลี่ยนวิธี)
+TEXT_REPAIR_MODE = os.environ.get('REPORT_TEXT_REPAIR_MODE', 'targeted')
+# จำนวนข้อความที่แก้แล้วที่จำไว้ (ชื่อหน่วยงานเดียวกันซ้ำทุกชั่วโมง)
+TEXT_REPAIR_CACHE_SIZE = 4096
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """คำขอถูกปฏิเสธทันทีเพราะ circuit breaker ของ host เปิดอยู่"""
+
+class CircuitBreaker:
+    """
+    Circuit breaker ของ host ปลายทาง
+    - closed: ส่งคำขอได้ตามปกติ เปลี่ยนเป็น open เมื่อผิดพลาดติดกันครบ failure_threshold ครั้ง
+    - open: ปฏิเสธคำขอทันที จนกว่าจะครบ reset_timeout วินาที แล้วเปลี่ยนเป็น half_open
+    - half_open: ให้คำขอทดสอบผ่านได้ครั้งละ half_open_max_calls คำขอ สำเร็จ -> closed, ล้มเหลว -> open อีกครั้ง
+    ทุกการเปลี่ยนสถานะถูก log และนับไว้ใน `transitions`
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold, reset_timeout, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probes = 0 # จำนวนคำขอทดสอบที่กำลังทำงานในสถานะ half_open
+        self.transitions = {} # 'closed->open': จำนวนครั้ง
+
+    def _transition(self, new_state):
+        # ต้องถือ self._lock อยู่
+        key = f"{self.state}->{new_state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        if new_state == self.CLOSED:
+            logger.info(f"✅ Circuit breaker ของ {self.name}: {self.state} -> {new_state} (API กลับมาใช้งานได้)")
+        else:
+            logger.warning(f"⚡ Circuit breaker ของ {self.name}: {self.state} -> {new_state}")
+        self.state = new_state
+        self._probes = 0
+        if new_state == self.OPEN:
+            self._opened_at = time.monotonic()
+
+    def allow_request(self):
+        """คืนค่า True หากส่งคำขอได้ (ในสถานะ half_open จะนับเป็นคำขอทดสอบ)"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probes >= self.half_open_max_calls:
+                    return False
+                self._probes += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive_failures = 0
+            if self.state == self.HALF_OPEN:
+                self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._transition(self.OPEN)
+                return
+            self._consecutive_failures += 1
+            if self.state == self.CLOSED and self._consecutive_failures >= self.failure_threshold:
+                self._transition(self.OPEN)
+
+    def snapshot(self):
+        with self._lock:
+            return {'state': self.state, 'transitions': dict(self.transitions)}
+
+class RetryBudget:
+    """
+    จำกัดจำนวนการลองใหม่รวมทุกคำขอ ไม่ให้ Worker ทุกตัวลองใหม่พร้อมกันจนซ้ำเติม API ที่มีปัญหา
+    แต่ละคำขอเติม token `ratio` หน่วย การลองใหม่แต่ละครั้งใช้ 1 token และสะสมได้ไม่เกิน `reserve`
+    (เริ่มต้นมี `reserve` token สำหรับช่วงที่ยังมีคำขอน้อย)
+    """
 
-# --- ฟังก์ชันสำหรับประมวลผลข้อมูล ---
-def get_data_from_api(nod_id, itf_id, job_id):
+    def __init__(self, ratio, reserve):
+        self.ratio = ratio
+        self.reserve = max(1, reserve)
+        self._lock = threading.Lock()
+        self._tokens = float(self.reserve)
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.reserve, self._tokens + self.ratio)
+
+    def withdraw(self):
+        """คืนค่า True หากยังมีงบให้ลองใหม่ได้"""
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+class AdaptiveConcurrencyLimiter:
+    """
+    จำกัดจำนวนคำขอที่ส่งไปยัง API พร้อมกันแบบปรับตัวเอง (AIMD: additive increase, multiplicative decrease)
+    - คำขอสำเร็จภายใน latency_target ขณะที่ใช้ limit อยู่จริง (in-flight อย่างน้อยครึ่งหนึ่งของ limit) -> limit + 1
+    - คำขอที่ผิดพลาดชั่วคราว (หมดเวลา/เชื่อมต่อไม่ได้/HTTP 429, 5xx) หรือช้ากว่า latency_target -> limit * backoff_ratio
+    limit อยู่ระหว่าง min_limit ถึง max_limit และ Thread ที่เกิน limit จะรอจนมีคำขออื่นเสร็จ
+    เก็บ latency ของ `window` คำขอล่าสุดไว้คำนวณ percentile
     """
-    ดึงข้อมูลสถานะวงจรจาก API ภายนอก (SOAP-based) และแปลงเป็น JSON
 
-    Parameters:
-    - nod_id (str): Node ID ของอุปกรณ์
-    - itf_id (str): Interface ID ของ Interface
-    - job_id (str): ID ของงานปัจจุบันสำหรับ logging
+    def __init__(self, initial_limit, min_limit, max_limit, latency_target, backoff_ratio=0.75, window=1000):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self._latencies = deque(maxlen=window)
+        self.increases = 0
+        self.decreases = 0
+
+    def acquire(self):
+        """รอจนกว่าจำนวนคำขอที่กำลังทำงานจะน้อยกว่า limit แล้วจองที่ไว้หนึ่งที่"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    def release(self, latency, dropped=False):
+        """
+        คืนที่ของคำขอที่เสร็จแล้ว และปรับ limit ตามผลลัพธ์
+        Parameters:
+        - latency (float): เวลาที่ใช้ (วินาที)
+        - dropped (bool): True หากคำขอผิดพลาดชั่วคราว
+        """
+        with self._cond:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+            self._latencies.append(latency)
+            previous_limit = int(self.limit)
+            if dropped or latency > self.latency_target:
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                if int(self.limit) < previous_limit:
+                    self.decreases += 1
+                    logger.info(f"📉 ลดจำนวนคำขอ API พร้อมกันเป็น {int(self.limit)} (latency {latency:.2f} วินาที, ผิดพลาด: {dropped})")
+            elif in_flight * 2 >= self.limit and self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1)
+                self.increases += 1
+            self._cond.notify_all()
+
+    def snapshot(self):
+        """limit ปัจจุบันและ percentile ของ latency (มิลลิวินาที) สำหรับใช้ปรับค่าตั้งต้น"""
+        with self._cond:
+            latencies = list(self._latencies)
+            snapshot = {
+                'limit': int(self.limit),
+                'min_limit': self.min_limit,
+                'max_limit': self.max_limit,
+                'in_flight': self.in_flight,
+                'increases': self.increases,
+                'decreases': self.decreases,
+                'samples': len(latencies),
+            }
+        if latencies:
+            p50, p90, p99 = (np.percentile(latencies, [50, 90, 99]) * 1000).tolist()
+            snapshot['latency_ms'] = {'p50': round(p50, 1), 'p90': round(p90, 1), 'p99': round(p99, 1)}
+        return snapshot
 
-    Returns:
-    - dict: ข้อมูล JSON ที่ได้จาก API หรือ None หากเกิดข้อผิดพลาด
+class SolarWindsClient:
+    """
+    SOAP Client สำหรับเรียก circuitStatus ของ SolarWinds API ผ่าน requests.Session ตัวเดียว
+    - ใช้ connection pool แบบ keep-alive (ไม่ต้อง handshake TCP ใหม่ทุกแถว)
+    - สร้าง Headers และส่วนคงที่ของ SOAP Envelope ไว้ครั้งเดียวตอนสร้าง object
+    - ขอ response แบบบีบอัด (gzip/deflate/br) หาก Server รองรับ
+    - ใช้ร่วมกันระหว่าง Worker Thread ได้ เพราะไม่มีการแก้ไขค่าตั้งค่าของ Session หลังสร้างเสร็จ
+      และ pool_block=True จะให้ Thread รอ connection ว่างแทนการเปิด connection ทิ้งขว้าง
+    - ลองใหม่เมื่อเชื่อมต่อไม่ได้/หมดเวลา/HTTP 429 หรือ 5xx ด้วย exponential backoff + jitter ภายใต้ RetryBudget
+      และล้มเหลวทันทีเมื่อ CircuitBreaker ของ host เปิดอยู่ (แทนการวนลองใหม่ 100 วินาทีต่อแถวแบบเดิม)
+    - จำกัดจำนวนคำขอพร้อมกันด้วย AdaptiveConcurrencyLimiter (ใช้ร่วมกันทุกงาน)
     """
-     # 1. เปลี่ยน URL ของ API เป็นเวอร์ชัน v2
-    url = "http://1.179.233.116:8082/api_csoc_02/server_solarwinds_ginv2.php"
 
-    headers = {
-        # 2. เปลี่ยน SOAPAction ให้ตรงกับ URL ใหม่
-        "SOAPAction": "http://1.179.233.116/api_csoc_02/server_solarwinds_ginv2.php/circuitStatus",
-        "Content-Type": "text/xml; charset=utf-8",
-    }
-    # 3. เปลี่ยน Namespace (xmlns) ใน SOAP Body เป็นเวอร์ชัน v2
-    body = f"""<?xml version="1.0" encoding="utf-8"?>
+    def __init__(self, url, soap_action, pool_size=10, connect_timeout=5, read_timeout=10,
+                 max_attempts=4, backoff_base=0.5, backoff_max=8.0,
+                 retry_budget_ratio=0.2, retry_budget_reserve=10,
+                 breaker_threshold=5, breaker_reset_seconds=30.0, limiter=None):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_budget = RetryBudget(retry_budget_ratio, retry_budget_reserve)
+        self.breaker = CircuitBreaker(urlparse(url).netloc or url, breaker_threshold, breaker_reset_seconds)
+        self.limiter = limiter or AdaptiveConcurrencyLimiter(pool_size, 1, pool_size, read_timeout)
+        self._stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'retry_budget_exhausted': 0, 'rejected_by_breaker': 0}
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            "SOAPAction": soap_action,
+            "Content-Type": "text/xml; charset=utf-8",
+            "Accept-Encoding": requests.utils.DEFAULT_ACCEPT_ENCODING,
+            "Connection": "keep-alive",
+        })
+
+        # ส่วนคงที่ของ SOAP Body (Namespace เวอร์ชัน v2) เหลือเพียงเติม nodID/itfID ในแต่ละคำขอ
+        self._envelope_head = """<?xml version="1.0" encoding="utf-8"?>
 <soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"
                xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
                xmlns:xsd="http://www.w3.org/2001/XMLSchema">
   <soap:Body>
     <circuitStatus xmlns="http://1.179.233.116/soap/#Service_Solarwinds_ginv2">
-      <nodID>{nod_id}</nodID>
-      <itfID>{itf_id}</itfID>
+      <nodID>""".encode('utf-8')
+        self._envelope_mid = b"""</nodID>
+      <itfID>"""
+        self._envelope_tail = b"""</itfID>
     </circuitStatus>
   </soap:Body>
 </soap:Envelope>"""
 
-    # -------------------- END: ส่วนที่แก้ไข --------------------
+    def build_envelope(self, nod_id, itf_id):
+        """สร้าง SOAP Envelope (bytes) สำหรับ nodID/itfID ที่ระบุ"""
+        return b''.join((
+            self._envelope_head,
+            xml_escape(str(nod_id)).encode('utf-8'),
+            self._envelope_mid,
+            xml_escape(str(itf_id)).encode('utf-8'),
+            self._envelope_tail,
+        ))
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    @staticmethod
+    def is_retryable(error):
+        """ข้อผิดพลาดชั่วคราวที่ควรลองใหม่ (และนับเป็นความล้มเหลวของ host)"""
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        response = getattr(error, 'response', None)
+        return response is not None and (response.status_code == 429 or response.status_code >= 500)
+
+    def backoff_delay(self, retry_number):
+        """เวลารอก่อนลองใหม่ครั้งที่ retry_number (เริ่มที่ 1) แบบ full jitter"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (retry_number - 1))))
+
+    def circuit_status(self, nod_id, itf_id):
+        """
+        ส่งคำขอ circuitStatus และคืนค่า requests.Response (raise requests.exceptions.RequestException หากล้มเหลว)
+        ลองใหม่สูงสุด max_attempts ครั้งสำหรับข้อผิดพลาดชั่วคราว และ raise CircuitOpenError ทันทีหาก breaker เปิดอยู่
+        """
+        body = self.build_envelope(nod_id, itf_id)
+        self._count('requests')
+        self.retry_budget.deposit()
+        attempt = 1
+        while True:
+            if not self.breaker.allow_request():
+                self._count('rejected_by_breaker')
+                raise CircuitOpenError(f"SolarWinds API ({self.breaker.name}) ไม่พร้อมใช้งาน: circuit breaker เปิดอยู่")
+            self.limiter.acquire()
+            started = time.monotonic()
+            try:
+                resp = self.session.post(self.url, data=body, timeout=self.timeout)
+                resp.raise_for_status() # ตรวจสอบว่า Request สำเร็จหรือไม่ (HTTP 2xx)
+            except requests.exceptions.RequestException as e:
+                self.limiter.release(time.monotonic() - started, dropped=self.is_retryable(e))
+                if not self.is_retryable(e):
+                    self.breaker.record_success() # Server ตอบกลับแล้ว (เช่น HTTP 4xx) จึงไม่นับเป็นความล้มเหลวของ host
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.max_attempts or self.breaker.state == CircuitBreaker.OPEN:
+                    raise # ครบจำนวนครั้ง หรือ breaker เพิ่งเปิด (ไม่ต้องรอลองใหม่)
+                if not self.retry_budget.withdraw():
+                    self._count('retry_budget_exhausted')
+                    raise
+                delay = self.backoff_delay(attempt)
+                logger.warning(f"🔄 เรียก API สำหรับ NodeID: {nod_id}, Interface ID: {itf_id} ไม่สำเร็จ ({e}) จะลองใหม่ครั้งที่ {attempt} ใน {delay:.1f} วินาที")
+                self._count('retries')
+                time.sleep(delay)
+                attempt += 1
+            except BaseException:
+                self.limiter.release(time.monotonic() - started, dropped=True)
+                self.breaker.record_failure()
+                raise
+            else:
+                self.limiter.release(time.monotonic() - started)
+                self.breaker.record_success()
+                return resp
+
+    def snapshot(self):
+        """สถิติการเรียก API สถานะ circuit breaker และ concurrency limit สำหรับแสดงใน /status"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['breaker'] = self.breaker.snapshot()
+        stats['limiter'] = self.limiter.snapshot()
+        return stats
+
+    def close(self):
+        self.session.close()
+
+# Client ตัวเดียวที่ใช้ร่วมกันทุกงานและทุก Worker Thread
+solarwinds_client = SolarWindsClient(
+    SOLARWINDS_API_URL,
+    SOLARWINDS_SOAP_ACTION,
+    pool_size=SOAP_POOL_SIZE,
+    connect_timeout=SOAP_CONNECT_TIMEOUT,
+    read_timeout=SOAP_READ_TIMEOUT,
+    max_attempts=SOAP_MAX_ATTEMPTS,
+    backoff_base=SOAP_BACKOFF_BASE,
+    backoff_max=SOAP_BACKOFF_MAX,
+    retry_budget_ratio=SOAP_RETRY_BUDGET_RATIO,
+    retry_budget_reserve=SOAP_RETRY_BUDGET_RESERVE,
+    breaker_threshold=SOAP_BREAKER_THRESHOLD,
+    breaker_reset_seconds=SOAP_BREAKER_RESET_SECONDS,
+    limiter=AdaptiveConcurrencyLimiter(
+        SOAP_LIMIT_INITIAL,
+        SOAP_LIMIT_MIN,
+        SOAP_LIMIT_MAX,
+        latency_target=SOAP_LIMIT_LATENCY_TARGET,
+        backoff_ratio=SOAP_LIMIT_BACKOFF_RATIO,
+    ),
+)
+
+@timed('soap_parse')
+def extract_soap_return(content, chunk_size=SOAP_PARSE_CHUNK_SIZE):
+    """
+    ดึงข้อความใน element 'return' จาก SOAP Response (bytes ดิบ) ด้วย ET.XMLPullParser
+    ป้อนข้อมูลทีละ chunk และหยุดทันทีที่ element 'return' ปิด โดยไม่ต้อง decode ทั้งข้อความเป็น str
+    และไม่ต้องค้นหาด้วย regex ก่อน parse ซ้ำ
+
+    Parameters:
+    - content (bytes): เนื้อหาของ Response
+    - chunk_size (int): ขนาดข้อมูลที่ป้อนให้ parser ต่อครั้ง
+
+    Returns:
+    - str หรือ None: ข้อความใน 'return' (None หากไม่มี element นี้ หรือไม่มีข้อความ)
+
+    Raises:
+    - ET.ParseError: หาก Response ไม่ใช่ XML ที่สมบูรณ์
+    """
+    # ข้ามข้อความที่อาจปนมาก่อน XML declaration
+    start = max(content.find(b'<?xml'), 0)
+    view = memoryview(content)[start:]
+    parser = ET.XMLPullParser(events=('end',))
+    for offset in range(0, len(view), chunk_size):
+        parser.feed(view[offset:offset + chunk_size])
+        for event, element in parser.read_events():
+            if element.tag == 'return' or element.tag.endswith('}return'):
+                return element.text or None
+    parser.close() # raise ET.ParseError หากเอกสารถูกตัดกลางคัน
+    return None
+
+def decode_return_text_legacy(raw_text):
+    """แปลงข้อความใน 'return' เป็น JSON แบบเดิม: แก้ข้อความทั้งก้อนด้วย ftfy ก่อน json.loads"""
+    # Unescape HTML entities (e.g., &quot; becomes ")
+    html_unescaped = html.unescape(raw_text)
+    # Fix encoding issues that might arise from unicode escape sequences
+    fixed_text = fix_text(bytes(html_unescaped, "utf-8").decode("unicode_escape"))
+    return json.loads(fixed_text) # แปลง String JSON เป็น Python Dictionary/List
+
+@functools.lru_cache(maxsize=TEXT_REPAIR_CACHE_SIZE)
+def repair_text(value):
+    """แก้ข้อความที่เข้ารหัสผิดด้วย ftfy (จำผลลัพธ์ไว้ เพราะค่าเดิมซ้ำกันทุกแถว)"""
+    return fix_text(value)
+
+def repair_json_strings(value):
+    """
+    แก้เฉพาะ string ใน JSON ที่มีอักขระนอก ASCII (เช่น Address ภาษาไทย)
+    ค่าตัวเลขและ string ที่เป็น ASCII ล้วน (Timestamp, In/Out_Averagebps) ไม่ต้องผ่าน ftfy
+    """
+    if isinstance(value, str):
+        return value if value.isascii() else repair_text(value)
+    if isinstance(value, dict):
+        return {key: repair_json_strings(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [repair_json_strings(item) for item in value]
+    return value
+
+@timed('json_decode')
+def decode_return_text(raw_text, mode=None):
+    """
+    แปลงข้อความใน element 'return' เป็นข้อมูล JSON ตามวิธีใน TEXT_REPAIR_MODE
+
+    Parameters:
+    - raw_text (str): ข้อความใน 'return'
+    - mode (str): 'targeted', 'legacy' หรือ 'compare' (ค่าเริ่มต้นคือ TEXT_REPAIR_MODE)
+
+    Returns:
+    - list หรือ dict: ข้อมูล JSON (raise json.JSONDecodeError หากแปลงไม่ได้)
+    """
+    mode = mode or TEXT_REPAIR_MODE
+    if mode == 'legacy':
+        return decode_return_text_legacy(raw_text)
 
     try:
-        # ส่ง POST Request ไปยัง API ด้วยข้อมูล SOAP Body และ Headers
-        resp = requests.post(url, data=body, headers=headers, timeout=10)
-        resp.raise_for_status() # ตรวจสอบว่า Request สำเร็จหรือไม่ (HTTP 2xx)
-
-        # ค้นหา XML Response ที่ถูกต้องภายในข้อความตอบกลับ
-        match = re.search(r"(<\?xml.*?</SOAP-ENV:Envelope>)", resp.text, re.DOTALL)
-        if not match:
-            logger.warning(f"ไม่พบ XML Response สำหรับ NodeID: {nod_id}, Interface ID: {itf_id}")
+        parsed_json = repair_json_strings(json.loads(html.unescape(raw_text)))
+    except json.JSONDecodeError:
+        # JSON มี escape ที่ json.loads ไม่รองรับ (แต่ unicode_escape รองรับ): ใช้วิธีเดิม
+        return decode_return_text_legacy(raw_text)
+
+    if mode == 'compare':
+        try:
+            legacy_json = decode_return_text_legacy(raw_text)
+        except json.JSONDecodeError as e:
+            logger.warning(f"⚠️ TEXT_REPAIR_MODE=compare: วิธีเดิมแปลง JSON ไม่ได้ ({e})")
+        else:
+            if legacy_json != parsed_json:
+                logger.warning(f"⚠️ TEXT_REPAIR_MODE=compare: ผลลัพธ์ของวิธี targeted และ legacy ไม่ตรงกัน")
+    return parsed_json
+
+# --- Cache ของข้อมูลจาก SolarWinds API บนดิสก์ ---
+# โฟลเดอร์เก็บ cache (กำหนดเป็นค่าว่างเพื่อปิดการใช้ cache)
+RESPONSE_CACHE_DIR = os.environ.get('REPORT_CACHE_DIR', 'cache')
+# อายุของข้อมูลเดือนที่ยังไม่ปิด (วินาที)
+RESPONSE_CACHE_TTL = int(os.environ.get('REPORT_CACHE_TTL', '3600'))
+# ข้อมูลที่ดึงหลังสิ้นเดือนของรายงานเกินระยะนี้ (ชั่วโมง) ถือว่าไม่เปลี่ยนแปลงแล้ว และไม่หมดอายุ
+RESPONSE_CACHE_GRACE_HOURS = int(os.environ.get('REPORT_CACHE_GRACE_HOURS', '24'))
+# ขนาดรวมสูงสุดของไฟล์ cache (ไบต์) เมื่อเกินจะลบรายการที่ไม่ได้ใช้นานที่สุดก่อน
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('REPORT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+def report_month_for(moment):
+    """เดือนของรายงานที่ API ส่งกลับมา ณ เวลา `moment` (เดือนก่อนหน้า) ในรูปแบบ 'YYYY-MM'"""
+    last_day_of_previous_month = moment.date().replace(day=1) - datetime.timedelta(days=1)
+    return last_day_of_previous_month.strftime('%Y-%m')
+
+class ResponseCache:
+    """
+    Cache ของข้อมูล JSON จาก SolarWinds API บนดิสก์ แยกตาม (nodID, itfID, เดือนของรายงาน)
+    - แต่ละรายการเป็นไฟล์ JSON ที่บีบอัดด้วย zlib ชื่อไฟล์คือ '<เดือน>_<sha1 ของ nodID/itfID>.json.z'
+    - mtime ของไฟล์คือเวลาที่ดึงข้อมูล และ atime คือเวลาที่ใช้ล่าสุด (ใช้เรียงลำดับ LRU ใหม่หลังรีสตาร์ท)
+    - ข้อมูลที่ดึงหลังสิ้นเดือนของรายงาน + grace_hours ไม่หมดอายุ (เดือนปิดแล้ว) ส่วนข้อมูลอื่นหมดอายุตาม ttl
+    - เมื่อขนาดรวมเกิน max_bytes จะลบรายการที่ไม่ได้ใช้นานที่สุดก่อน
+    ใช้ร่วมกันระหว่าง Worker Thread ได้
+    """
+    SUFFIX = '.json.z'
+
+    def __init__(self, directory, ttl, grace_hours, max_bytes):
+        self.directory = directory
+        self.ttl = ttl
+        self.grace = datetime.timedelta(hours=grace_hours)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # ชื่อไฟล์ -> (ขนาด, เวลาที่ดึงข้อมูล) เรียงจากใช้ล่าสุดนานที่สุด
+        self._total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """สร้างรายการ cache จากไฟล์ที่มีอยู่ในโฟลเดอร์ (เรียงตามเวลาที่ใช้ล่าสุด)"""
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            found.append((st.st_atime, name, st.st_size, st.st_mtime))
+        with self._lock:
+            for _, name, size, fetched_at in sorted(found):
+                self._entries[name] = (size, fetched_at)
+                self._total_bytes += size
+            self._evict()
+
+    def _filename(self, nod_id, itf_id, month):
+        digest = hashlib.sha1(f"{nod_id}\0{itf_id}".encode('utf-8')).hexdigest()
+        return f"{month}_{digest}{self.SUFFIX}"
+
+    def _is_fresh(self, month, fetched_at, now):
+        month_start = datetime.datetime.strptime(month, '%Y-%m')
+        month_end = (month_start + datetime.timedelta(days=32)).replace(day=1)
+        if datetime.datetime.fromtimestamp(fetched_at) >= month_end + self.grace:
+            return True # ดึงหลังเดือนปิดแล้ว: ข้อมูลไม่เปลี่ยนอีก
+        return now - fetched_at <= self.ttl
+
+    def _remove(self, name):
+        # ต้องถือ self._lock อยู่
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self._total_bytes -= entry[0]
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def _evict(self):
+        # ต้องถือ self._lock อยู่
+        while self._total_bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def get(self, nod_id, itf_id, month):
+        """
+        Returns:
+        - list หรือ dict: ข้อมูล JSON ที่เก็บไว้ หรือ None หากไม่มี/หมดอายุ/อ่านไม่ได้
+        """
+        name = self._filename(nod_id, itf_id, month)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            fetched_at = entry[1]
+            if not self._is_fresh(month, fetched_at, now):
+                self._remove(name)
+                return None
+            self._entries.move_to_end(name)
+
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as f:
+                data = json.loads(zlib.decompress(f.read()))
+            os.utime(path, (now, fetched_at)) # บันทึกเวลาที่ใช้ล่าสุดไว้ใน atime
+            return data
+        except (OSError, zlib.error, ValueError) as e:
+            logger.warning(f"⚠️ อ่านไฟล์ cache '{name}' ไม่สำเร็จ: {e}")
+            with self._lock:
+                self._remove(name)
             return None
 
-        # Parse XML Response เพื่อดึงข้อมูลส่วน 'return'
-        root = ET.fromstring(match.group(1))
-        return_tag = root.find(".//{*}return")
-        if return_tag is None or not return_tag.text:
+    def put(self, nod_id, itf_id, month, data):
+        """บันทึกข้อมูล JSON ลง cache (เขียนไฟล์ชั่วคราวก่อนแล้วเปลี่ยนชื่อ เพื่อไม่ให้ผู้อ่านเจอไฟล์ที่เขียนไม่เสร็จ)"""
+        name = self._filename(nod_id, itf_id, month)
+        path = os.path.join(self.directory, name)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        payload = zlib.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        now = time.time()
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(payload)
+            os.utime(temp_path, (now, now))
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"⚠️ บันทึกไฟล์ cache '{name}' ไม่สำเร็จ: {e}")
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+            return
+
+        with self._lock:
+            previous = self._entries.pop(name, None)
+            if previous is not None:
+                self._total_bytes -= previous[0]
+            self._entries[name] = (len(payload), now)
+            self._total_bytes += len(payload)
+            self._evict()
+
+# Cache ตัวเดียวที่ใช้ร่วมกันทุกงาน (สร้างเมื่อถูกใช้ครั้งแรก ไม่สแกนโฟลเดอร์ cache ใน process สร้าง PDF ที่ import แอปซ้ำ)
+response_cache = None
+response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """คืนค่า ResponseCache ที่ใช้ร่วมกันทุกงาน (โหลดรายการ cache จากดิสก์ครั้งแรกเมื่อถูกเรียก) หรือ None เมื่อปิดการใช้ cache"""
+    global response_cache
+    with response_cache_lock:
+        if response_cache is None and RESPONSE_CACHE_DIR:
+            response_cache = ResponseCache(
+                RESPONSE_CACHE_DIR,
+                ttl=RESPONSE_CACHE_TTL,
+                grace_hours=RESPONSE_CACHE_GRACE_HOURS,
+                max_bytes=RESPONSE_CACHE_MAX_BYTES,
+            )
+        return response_cache
+
+class SingleFlight:
+    """
+    รวมการเรียกที่ซ้ำกัน (key เดียวกัน) ซึ่งเกิดขึ้นพร้อมกันให้เหลือการเรียกจริงครั้งเดียว
+    Thread แรกของแต่ละ key เป็นผู้เรียก fn ส่วน Thread อื่นที่มาขอ key เดียวกันระหว่างนั้นจะรอและได้ผลลัพธ์ (หรือ exception) เดียวกัน
+    เมื่อการเรียกจบแล้ว key จะถูกลบออก คำขอถัดไปจึงเรียกใหม่ (การเก็บผลลัพธ์ไว้ใช้ซ้ำเป็นหน้าที่ของ response_cache)
+    """
+
+    class _Call:
+        __slots__ = ('done', 'result', 'error')
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Returns:
+        - tuple: (ผลลัพธ์ของ fn, shared) โดย shared เป็น True หากได้ผลลัพธ์จากการเรียกของ Thread อื่น
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = self._Call()
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+# คำขอ circuitStatus ที่กำลังทำงานอยู่ ใช้ร่วมกันทุกงาน (key: (nodID, itfID))
+api_calls_in_flight = SingleFlight()
+
+# --- ที่เก็บสถานะงาน (SQLite) ---
+# ไฟล์ฐานข้อมูลของสถานะงาน ผลลัพธ์รายแถว และตำแหน่งไฟล์ ZIP
+# สถานะจึงไม่หายเมื่อรีสตาร์ท (แอปรันเป็น process เดียว แต่ process สร้าง PDF และเครื่องมืออื่นอ่านไฟล์เดียวกันได้)
+JOB_DB_PATH = os.environ.get('REPORT_JOB_DB', 'jobs.sqlite3')
+# เวลารอสูงสุด (วินาที) เมื่อ process อื่นกำลังเขียนฐานข้อมูลอยู่
+JOB_DB_BUSY_TIMEOUT = float(os.environ.get('REPORT_JOB_DB_BUSY_TIMEOUT', '30'))
+
+def process_start_token(pid):
+    """
+    ค่าที่ระบุการรันหนึ่งครั้งของ process: boot id ของเครื่องกับเวลาที่ process เริ่มทำงาน (อ่านจาก /proc ของ Linux)
+    process ใหม่ที่ได้ PID เดิมหลังรีสตาร์ทจะได้ค่าต่างกันเสมอ
+    Returns:
+    - str หรือ None: None เมื่ออ่านไม่ได้ (ไม่มี /proc หรือไม่มี process นี้แล้ว)
+    """
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            # field ที่ 22 (starttime) นับจากหลังชื่อคำสั่งในวงเล็บ ซึ่งอาจมีช่องว่างได้
+            start_time = f.read().rpartition(b')')[2].split()[19].decode()
+    except (OSError, IndexError):
+        return None
+    try:
+        with open('/proc/sys/kernel/random/boot_id', encoding='ascii') as f:
+            boot_id = f.read().strip()
+    except OSError:
+        boot_id = ''
+    return f"{boot_id}/{start_time}"
+
+class JobStore:
+    """
+    สถานะของงานในฐานข้อมูล SQLite แบบ WAL (ผู้อ่านไม่บล็อกผู้เขียน และหลาย process อ่านพร้อมกันได้)
+    - ตาราง jobs: หนึ่งแถวต่องาน ค้นหาด้วย job_id (primary key) หรือ state (index ร่วมกับ created_at)
+      ค่าที่ไม่ต้องค้นหา (DETAIL_FIELDS เช่น สถิติของ pipeline และ ZIP) เก็บเป็น JSON ในคอลัมน์ details
+    - ตาราง job_results: ผลลัพธ์รายแถว เรียงตาม seq (ตำแหน่งในรายการผลลัพธ์ของงาน)
+    - append_results รวมผลลัพธ์ที่ Worker หลาย Thread ส่งมาพร้อมกันเป็น transaction เดียว (group commit)
+    - get อ่านงานและผลลัพธ์ใน transaction เดียวกัน จึงได้ snapshot ที่สอดคล้องกันเสมอ
+    get คืน dict รูปแบบเดียวกับสถานะงานที่ /status ส่งให้หน้าเว็บ ('timestamp'/'updated_at' เป็น datetime)
+    แต่ละ Thread ใช้ connection ของตัวเอง จึงใช้ร่วมกันระหว่าง Worker Thread ได้
+    """
+    # state ของงาน: queued (รอในคิวของ JobScheduler) -> running -> completed (สำเร็จ) / failed (ผิดพลาด) / canceled (ยกเลิกแล้ว)
+    STATES = ('queued', 'running', 'completed', 'failed', 'canceled')
+    COLUMNS = ('state', 'total', 'processed', 'completed', 'canceled', 'error', 'temp_dir', 'zip_file_path',
+               'download_name', 'upstream_calls_saved', 'cache_hits', 'cache_misses', 'cache_coalesced')
+    DETAIL_FIELDS = ('pipeline', 'archive')
+
+    class _PendingResults:
+        # ผลลัพธ์ชุดหนึ่งที่รอเขียนใน group commit ถัดไป (done ถูกตั้งเมื่อเขียนเสร็จหรือผิดพลาด โดย error คือ exception)
+        __slots__ = ('job_id', 'offset', 'results', 'counters', 'done', 'error')
+
+        def __init__(self, job_id, offset, results, counters):
+            self.job_id = job_id
+            self.offset = offset
+            self.results = results
+            self.counters = counters
+            self.done = threading.Event()
+            self.error = None
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT -1,
+            processed INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            canceled INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            temp_dir TEXT,
+            zip_file_path TEXT,
+            download_name TEXT,
+            upstream_calls_saved INTEGER NOT NULL DEFAULT 0,
+            cache_hits INTEGER NOT NULL DEFAULT 0,
+            cache_misses INTEGER NOT NULL DEFAULT 0,
+            cache_coalesced INTEGER NOT NULL DEFAULT 0,
+            details TEXT NOT NULL DEFAULT '{}',
+            owner TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_state_created ON jobs (state, created_at);
+        CREATE TABLE IF NOT EXISTS job_results (
+            job_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            result TEXT NOT NULL,
+            PRIMARY KEY (job_id, seq)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path, busy_timeout=30.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        # process ที่ประมวลผลงาน (ใช้ตรวจงานที่ค้างหลังรีสตาร์ท): host:pid:token ของการรันครั้งนี้ (ดู process_start_token)
+        token = process_start_token(os.getpid())
+        self.owner = f"{socket.gethostname()}:{os.getpid()}" + (f":{token}" if token else '')
+        self._local = threading.local()
+        self._write_lock = threading.Lock() # Thread ที่ได้ lock นี้เขียนผลลัพธ์ที่รออยู่ทั้งหมด
+        self._pending_lock = threading.Lock()
+        self._pending = [] # _PendingResults ที่รอเขียน เรียงตาม seq
+        self._next_seq = {} # job_id -> seq ถัดไปของงานที่ process นี้ประมวลผล
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(self.SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None: จัดการ transaction เองด้วย BEGIN/COMMIT
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA synchronous=NORMAL') # ใน WAL mode ยังปลอดภัยเมื่อ process ล่ม และไม่ต้อง fsync ทุก commit
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self, write=True):
+        # BEGIN IMMEDIATE จองสิทธิ์เขียนตั้งแต่ต้น (รอ process อื่นตาม busy_timeout แทนการ deadlock ตอน commit)
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _check_columns(self, names):
+        unknown = set(names) - set(self.COLUMNS)
+        if unknown:
+            raise ValueError(f"ไม่รู้จักค่าสถานะงาน: {', '.join(sorted(unknown))}")
+
+    @staticmethod
+    def _job_dict(row):
+        job = {name: row[name] for name in JobStore.COLUMNS}
+        job['completed'] = bool(job['completed'])
+        job['canceled'] = bool(job['canceled'])
+        # จำนวนแถวที่ใช้ข้อมูลจาก response cache / ไม่พบใน cache / ใช้การเรียก API ร่วมกับคำขอที่กำลังทำงานอยู่
+        job['cache'] = {'hits': job.pop('cache_hits'), 'misses': job.pop('cache_misses'), 'coalesced': job.pop('cache_coalesced')}
+        job['timestamp'] = datetime.datetime.fromtimestamp(row['created_at']) # เวลาที่เริ่มงาน
+        job['updated_at'] = datetime.datetime.fromtimestamp(row['updated_at']) # เวลาที่มีความคืบหน้าล่าสุด
+        job.update(json.loads(row['details']))
+        return job
+
+    def create(self, job_id, state='running'):
+        """เพิ่มงานใหม่ในสถานะ `state` (ยังไม่ทราบจำนวนแถวทั้งหมด: total = -1)"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute('INSERT INTO jobs (job_id, state, owner, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+                         (job_id, state, self.owner, now, now))
+        with self._pending_lock:
+            self._next_seq[job_id] = 0
+
+    def update(self, job_id, **fields):
+        """
+        ตั้งค่าสถานะของงาน (ชื่อใน COLUMNS หรือ DETAIL_FIELDS)
+        Returns:
+        - bool: True หากพบงาน
+        """
+        details = {name: fields.pop(name) for name in self.DETAIL_FIELDS if name in fields}
+        self._check_columns(fields)
+        with self._transaction() as conn:
+            if details:
+                row = conn.execute('SELECT details FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+                if row is None:
+                    return False
+                fields['details'] = json.dumps(dict(json.loads(row['details']), **details), ensure_ascii=False)
+            if not fields:
+                return conn.execute('SELECT 1 FROM jobs WHERE job_id = ?', (job_id,)).fetchone() is not None
+            assignments = ', '.join(f"{name} = ?" for name in fields)
+            cursor = conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+            return cursor.rowcount > 0
+
+    def increment(self, job_id, **amounts):
+        """เพิ่มค่าตัวนับของงาน เช่น increment(job_id, cache_hits=1)"""
+        self._check_columns(amounts)
+        assignments = ', '.join(f"{name} = {name} + ?" for name in amounts)
+        with self._transaction() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*amounts.values(), job_id))
+
+    def append_results(self, job_id, results, counters=None):
+        """
+        เพิ่มผลลัพธ์รายแถวต่อท้ายรายการผลลัพธ์ของงาน เพิ่มจำนวน processed และบันทึกเวลาที่มีความคืบหน้าล่าสุด
+        counters (dict) คือค่าที่เพิ่มให้ตัวนับของงานใน transaction เดียวกัน (แบบเดียวกับ increment) เช่น {'cache_hits': 3}
+        ข้อมูลถูกเขียนแล้วเมื่อฟังก์ชันคืนค่า (อาจถูกเขียนโดย Thread อื่นใน transaction เดียวกัน)
+        หากเขียนไม่สำเร็จ ทุก Thread ที่ผลลัพธ์อยู่ใน transaction นั้นจะได้ exception เดียวกัน (ผลลัพธ์ชุดนั้นไม่ถูกบันทึก)
+
+        Returns:
+        - int: ตำแหน่ง (seq) ของผลลัพธ์แรกของชุดนี้
+        """
+        counters = {name: amount for name, amount in (counters or {}).items() if amount}
+        self._check_columns(counters)
+        with self._pending_lock:
+            offset = self._next_seq.get(job_id)
+            if offset is None:
+                offset = self._connection().execute('SELECT processed FROM jobs WHERE job_id = ?', (job_id,)).fetchone()[0]
+            self._next_seq[job_id] = offset + len(results)
+            entry = self._PendingResults(job_id, offset, results, counters)
+            self._pending.append(entry)
+        # group commit: ผลลัพธ์ที่ Thread อื่นส่งมาระหว่างรอ lock ถูกเขียนไปพร้อมกัน
+        # (รายการที่รอเรียงตาม seq และถูกเขียนทั้งหมดทุกครั้ง ผลลัพธ์ที่เขียนแล้วจึงไม่มีช่องว่าง)
+        with self._write_lock:
+            if not entry.done.is_set():
+                with self._pending_lock:
+                    batch, self._pending = self._pending, []
+                self._write_batch(batch)
+        if entry.error is not None:
+            raise entry.error
+        return offset
+
+    def _write_batch(self, batch):
+        # เรียกขณะถือ _write_lock: เขียน batch และแจ้งผลให้ทุกรายการ
+        try:
+            self._write_results(batch)
+        except BaseException as e:
+            with self._pending_lock:
+                # transaction ถูก rollback: ผลลัพธ์ที่รออยู่ของงานเดียวกันมี seq ต่อจากชุดที่หายไป จึงล้มเหลวไปด้วย
+                # และ seq ถัดไปของงานเหล่านี้จะอ่านใหม่จาก processed ในฐานข้อมูล (ไม่เกิดช่องว่างใน seq)
+                failed_jobs = {item.job_id for item in batch}
+                batch = batch + [item for item in self._pending if item.job_id in failed_jobs]
+                self._pending = [item for item in self._pending if item.job_id not in failed_jobs]
+                for job_id in failed_jobs:
+                    self._next_seq.pop(job_id, None)
+            for item in batch:
+                item.error = e
+        for item in batch:
+            item.done.set()
+
+    def _write_results(self, batch):
+        amounts = {} # job_id -> {ชื่อคอลัมน์: ค่าที่เพิ่ม} รวมทุกรายการของงานใน batch
+        for item in batch:
+            job_amounts = amounts.setdefault(item.job_id, {'processed': 0})
+            job_amounts['processed'] += len(item.results)
+            for name, amount in item.counters.items():
+                job_amounts[name] = job_amounts.get(name, 0) + amount
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany('INSERT INTO job_results (job_id, seq, result) VALUES (?, ?, ?)', [
+                (item.job_id, item.offset + i, json.dumps(result, ensure_ascii=False))
+                for item in batch
+                for i, result in enumerate(item.results)
+            ])
+            for job_id, job_amounts in amounts.items():
+                assignments = ', '.join(f"{name} = {name} + ?" for name in job_amounts)
+                conn.execute(f"UPDATE jobs SET {assignments}, updated_at = ? WHERE job_id = ?",
+                             (*job_amounts.values(), now, job_id))
+
+    def get(self, job_id, since=0, with_results=True):
+        """
+        snapshot ของงาน
+        Parameters:
+        - since (int): ส่งเฉพาะผลลัพธ์ตั้งแต่ตำแหน่งนี้ใน 'results' (จำนวนผลลัพธ์ทั้งหมดเท่ากับ 'processed')
+        - with_results (bool): False = ไม่อ่านผลลัพธ์รายแถว (ไม่มี key 'results')
+        Returns:
+        - dict หรือ None หากไม่พบงาน ('queue_position' คือลำดับในคิว เริ่มจาก 1 เฉพาะงานที่ยังรออยู่)
+        """
+        queue_position = None
+        with self._transaction(write=False) as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row['state'] == 'queued':
+                # คิวเป็นของ process ที่รับงาน (owner) และเรียงตามเวลาที่รับงาน
+                queue_position = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE state = 'queued' AND owner = ? AND created_at <= ?",
+                    (row['owner'], row['created_at'])).fetchone()[0]
+            if with_results:
+                results = [json.loads(result) for (result,) in conn.execute(
+                    'SELECT result FROM job_results WHERE job_id = ? AND seq >= ? ORDER BY seq', (job_id, since))]
+        job = self._job_dict(row)
+        job['queue_position'] = queue_position
+        if with_results:
+            job['results'] = results
+        return job
+
+    def is_canceled(self, job_id):
+        row = self._connection().execute('SELECT canceled FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return bool(row and row['canceled'])
+
+    def count(self, state):
+        return self._connection().execute('SELECT COUNT(*) FROM jobs WHERE state = ?', (state,)).fetchone()[0]
+
+    def find(self, states, created_before):
+        """
+        งานที่อยู่ใน state ที่ระบุและเริ่มก่อน created_before (datetime)
+        Returns:
+        - dict: job_id -> สถานะของงาน (ไม่รวมผลลัพธ์รายแถว)
+        """
+        placeholders = ', '.join('?' * len(states))
+        rows = self._connection().execute(
+            f"SELECT * FROM jobs WHERE state IN ({placeholders}) AND created_at < ? ORDER BY created_at",
+            (*states, created_before.timestamp())).fetchall()
+        return {row['job_id']: self._job_dict(row) for row in rows}
+
+    def delete(self, job_id):
+        """ลบงานและผลลัพธ์ทั้งหมดของงาน คืนสถานะสุดท้ายของงาน (ไม่รวมผลลัพธ์) หรือ None หากไม่พบ"""
+        with self._transaction() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('DELETE FROM job_results WHERE job_id = ?', (job_id,))
+            conn.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+        with self._pending_lock:
+            self._next_seq.pop(job_id, None)
+        return self._job_dict(row)
+
+    @staticmethod
+    def _owner_alive(owner):
+        # ตรวจได้เฉพาะ process บนเครื่องเดียวกันใน POSIX (ไม่เช่นนั้นถือว่ายังทำงานอยู่)
+        host, _, rest = owner.partition(':')
+        pid, _, token = rest.partition(':')
+        if host != socket.gethostname() or os.name != 'posix':
+            return True
+        if token:
+            # PID อาจถูกนำกลับมาใช้หลังรีสตาร์ท (เช่น PID 1 ใน container หรือ PID ของ process นี้เอง)
+            # จึงถือว่ายังทำงานอยู่เฉพาะเมื่อ process ที่ใช้ PID นั้นคือการรันครั้งเดียวกัน
+            return process_start_token(pid) == token
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except (PermissionError, ValueError):
+            pass
+        return True
+
+    def recover_interrupted(self):
+        """
+        งานที่ยังเป็น 'queued' หรือ 'running' แต่ process ที่รับงานหยุดทำงานไปแล้ว (เช่น เซิร์ฟเวอร์รีสตาร์ท) ไม่มีทางทำต่อจนเสร็จ
+        จึงตั้งเป็น 'failed' พร้อมข้อความแจ้ง (ผลลัพธ์ของแถวที่เสร็จแล้วยังดูได้ทาง /status)
+
+        Returns:
+        - list: job_id ของงานที่ถูกเปลี่ยนสถานะ
+        """
+        message = "งานถูกขัดจังหวะเนื่องจากเซิร์ฟเวอร์หยุดทำงานระหว่างประมวลผล"
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT job_id, owner FROM jobs WHERE state IN ('queued', 'running')").fetchall()
+            interrupted = [row['job_id'] for row in rows if not self._owner_alive(row['owner'])]
+            conn.executemany("UPDATE jobs SET state = 'failed', completed = 1, error = ? WHERE job_id = ?",
+                             [(message, job_id) for job_id in interrupted])
+        return interrupted
+
+# ที่เก็บสถานะงานที่ใช้ร่วมกันทุก Thread ของ process
+# เปิดฐานข้อมูลเมื่อถูกใช้ครั้งแรก process สร้าง PDF ที่ import แอปซ้ำจึงไม่เปิดฐานข้อมูลหรือเขียนสถานะงาน
+job_store = None
+job_store_lock = threading.Lock()
+
+def get_job_store():
+    """
+    คืนค่า JobStore ที่ใช้ร่วมกันทุก Thread (เปิดฐานข้อมูลครั้งแรกเมื่อถูกเรียก)
+    ครั้งแรกยังตั้งสถานะงานที่ถูกขัดจังหวะจากการรันครั้งก่อนเป็นผิดพลาด (ดู JobStore.recover_interrupted)
+    """
+    global job_store
+    if job_store is not None:
+        return job_store
+    with job_store_lock:
+        if job_store is None:
+            store = JobStore(JOB_DB_PATH, busy_timeout=JOB_DB_BUSY_TIMEOUT)
+            interrupted_jobs = store.recover_interrupted()
+            if interrupted_jobs:
+                logger.warning(f"⚠️ พบงานที่ถูกขัดจังหวะจากการรันครั้งก่อน {len(interrupted_jobs)} งาน ตั้งสถานะเป็นผิดพลาดแล้ว")
+            job_store = store
+        return job_store
+
+# --- จำกัดจำนวนงานที่ประมวลผลพร้อมกัน (admission control) ---
+# จำนวนงานสูงสุดที่ประมวลผลพร้อมกันในแต่ละ process งานที่เกินจะรอในคิวตามลำดับที่อัปโหลด
+# ทุกงานที่เริ่มแล้วป้อนวงจรเข้า ReportPipeline ที่ใช้ร่วมกัน ซึ่งจำกัด Worker (API/CPU) และสลับงานอย่างเป็นธรรมอยู่แล้ว
+# ค่านี้จึงจำกัดเฉพาะหน่วยความจำ (DataFrame, ไฟล์ ZIP ที่เปิดอยู่ และวงจรค้างใน pipeline ไม่เกิน
+# MAX_RUNNING_JOBS * PIPELINE_MAX_IN_FLIGHT) ควรตั้งให้สูงพอที่งานเล็กไม่ต้องรอคิวหลังงานใหญ่
+MAX_RUNNING_JOBS = int(os.environ.get('REPORT_MAX_RUNNING_JOBS', '16'))
+# จำนวนงานสูงสุดที่รอในคิว เมื่อคิวเต็มจะปฏิเสธการอัปโหลดใหม่ทันที (HTTP 503)
+MAX_QUEUED_JOBS = int(os.environ.get('REPORT_MAX_QUEUED_JOBS', '10'))
+# เวลาที่แนะนำให้ client ลองใหม่ (วินาที, header Retry-After) เมื่อคิวเต็ม
+JOB_QUEUE_RETRY_AFTER = int(os.environ.get('REPORT_JOB_QUEUE_RETRY_AFTER', '60'))
+
+class JobScheduler:
+    """
+    ตัวจัดลำดับงาน: ประมวลผลพร้อมกันได้ไม่เกิน max_running งาน ที่เหลือรอในคิว FIFO ได้ไม่เกิน max_queued งาน
+    - submit สร้างงานใน store ('running' หรือ 'queued') หรือปฏิเสธทันทีเมื่อคิวเต็ม
+    - เมื่องานหนึ่งจบ งานแรกในคิวจะเริ่มทำงานใน Thread ใหม่ (ข้ามงานที่ถูกยกเลิกระหว่างรอ)
+    - notify(job_id) ถูกเรียกกับงานที่สถานะหรือลำดับในคิวเปลี่ยน (ใช้ push ความคืบหน้าให้หน้าเว็บ)
+    """
+    def __init__(self, store, max_running, max_queued, notify=None):
+        self.store = store
+        self.max_running = max(1, max_running)
+        self.max_queued = max(0, max_queued)
+        self.notify = notify
+        self._lock = threading.Lock()
+        self._queue = deque() # (job_id, target, args) ที่รอเริ่ม
+        self._running = set()
+        self.rejected = 0 # จำนวนงานที่ถูกปฏิเสธเพราะคิวเต็ม
+
+    def reject_if_full(self):
+        """ตรวจก่อนรับไฟล์: คืน True (และนับเป็นงานที่ถูกปฏิเสธ) หากงานที่ทำอยู่และคิวเต็มทั้งคู่"""
+        with self._lock:
+            full = len(self._running) >= self.max_running and len(self._queue) >= self.max_queued
+            if full:
+                self.rejected += 1
+            return full
+
+    def submit(self, job_id, target, *args):
+        """
+        รับงานใหม่: เริ่ม target(*args) ใน Thread ใหม่ทันทีหากยังไม่เต็ม max_running มิฉะนั้นเข้าคิว
+        Returns:
+        - bool: False หากคิวเต็ม (ไม่ได้สร้างงาน)
+        """
+        with self._lock:
+            start = len(self._running) < self.max_running
+            if not start and len(self._queue) >= self.max_queued:
+                self.rejected += 1
+                return False
+            # สร้างงานขณะถือ lock ลำดับของเวลาที่รับงาน (queue_position) จึงตรงกับลำดับในคิว
+            self.store.create(job_id, state='running' if start else 'queued')
+            if start:
+                self._running.add(job_id)
+            else:
+                self._queue.append((job_id, target, args))
+        if start:
+            self._start(job_id, target, args)
+        return True
+
+    def discard(self, job_id):
+        """นำงานที่ยังรออยู่ออกจากคิว (ยกเลิกก่อนเริ่ม) คืน True หากพบงานในคิว"""
+        with self._lock:
+            entry = next((entry for entry in self._queue if entry[0] == job_id), None)
+            if entry is None:
+                return False
+            self._queue.remove(entry)
+            waiting = [queued[0] for queued in self._queue]
+        self.store.update(job_id, state='canceled')
+        self._notify(waiting)
+        return True
+
+    def _start(self, job_id, target, args):
+        thread = threading.Thread(target=self._run, args=(job_id, target, args), name=f"job_{job_id[:8]}")
+        thread.daemon = True # ทำให้ Thread สิ้นสุดลงเมื่อโปรแกรมหลักจบ
+        thread.start()
+
+    def _run(self, job_id, target, args):
+        try:
+            target(*args)
+        finally:
+            self._finish(job_id)
+
+    def _finish(self, job_id):
+        started = []
+        with self._lock:
+            self._running.discard(job_id)
+            while self._queue and len(self._running) < self.max_running:
+                entry = self._queue.popleft()
+                if self.store.is_canceled(entry[0]):
+                    # ถูกยกเลิกระหว่างรอ (เช่น ยกเลิกผ่าน process อื่น)
+                    self.store.update(entry[0], state='canceled')
+                    continue
+                self.store.update(entry[0], state='running')
+                self._running.add(entry[0])
+                started.append(entry)
+            waiting = [queued[0] for queued in self._queue]
+        for entry in started:
+            self._start(*entry)
+        self._notify([entry[0] for entry in started] + waiting)
+
+    def _notify(self, job_ids):
+        if self.notify is None:
+            return
+        for job_id in job_ids:
+            try:
+                self.notify(job_id)
+            except Exception as e:
+                logger.warning(f"⚠️ แจ้งสถานะคิวของงานไม่สำเร็จ: {e}")
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'running': len(self._running),
+                'queued': len(self._queue),
+                'max_running': self.max_running,
+                'max_queued': self.max_queued,
+                'rejected': self.rejected,
+            }
+
+# ตัวจัดลำดับงานของ process นี้ (สร้างเมื่อมีการใช้ครั้งแรก พร้อมกับ job_store)
+job_scheduler = None
+job_scheduler_lock = threading.Lock()
+
+def get_job_scheduler():
+    """คืนค่า JobScheduler ของ process นี้ (สร้างครั้งแรกเมื่อถูกเรียก)"""
+    global job_scheduler
+    with job_scheduler_lock:
+        if job_scheduler is None:
+            job_scheduler = JobScheduler(get_job_store(), MAX_RUNNING_JOBS, MAX_QUEUED_JOBS, notify=push_job_progress)
+        return job_scheduler
+
+# --- ฟังก์ชันสำหรับประมวลผลข้อมูล ---
+@timed('api_call', failed=lambda data: data is None)
+def get_data_from_api(nod_id, itf_id, job_id):
+    """
+    ดึงข้อมูลสถานะวงจรจาก API ภายนอก (SOAP-based) และแปลงเป็น JSON
+    โดยใช้ solarwinds_client ที่มี connection pool ร่วมกัน
+
+    Parameters:
+    - nod_id (str): Node ID ของอุปกรณ์
+    - itf_id (str): Interface ID ของ Interface
+    - job_id (str): ID ของงานปัจจุบันสำหรับ logging
+
+    Returns:
+    - dict: ข้อมูล JSON ที่ได้จาก API หรือ None หากเกิดข้อผิดพลาด
+    """
+    try:
+        # ส่ง POST Request ไปยัง API ผ่าน Session ที่ใช้ connection ร่วมกัน
+        resp = solarwinds_client.circuit_status(nod_id, itf_id)
+
+        # Parse XML Response จาก bytes ดิบเพื่อดึงข้อมูลส่วน 'return'
+        try:
+            raw_text = extract_soap_return(resp.content)
+        except ET.ParseError as parse_e:
+            logger.warning(f"⚠️ XML Response ของ NodeID: {nod_id}, Interface ID: {itf_id} ไม่สมบูรณ์ ({parse_e}) จะค้นหา SOAP Envelope ในข้อความแทน")
+            # ค้นหา XML Response ที่ถูกต้องภายในข้อความตอบกลับ
+            match = SOAP_ENVELOPE_PATTERN.search(resp.text)
+            if not match:
+                logger.warning(f"ไม่พบ XML Response สำหรับ NodeID: {nod_id}, Interface ID: {itf_id}")
+                return None
+            return_tag = ET.fromstring(match.group(1)).find(".//{*}return")
+            raw_text = return_tag.text if return_tag is not None else None
+
+        if not raw_text:
             logger.warning(f"API ไม่มีข้อมูลตอบกลับสำหรับ NodeID: {nod_id}, Interface ID: {itf_id}")
             return None
 
-        raw_text = return_tag.text
-        # Unescape HTML entities (e.g., &quot; becomes ")
-        html_unescaped = html.unescape(raw_text)
-        # Fix encoding issues that might arise from unicode escape sequences
-        fixed_text = fix_text(bytes(html_unescaped, "utf-8").decode("unicode_escape"))
-        parsed_json = json.loads(fixed_text) # แปลง String JSON เป็น Python Dictionary/List
-        return parsed_json
+        return decode_return_text(raw_text) # แปลง String JSON เป็น Python Dictionary/List
     except requests.exceptions.RequestException as req_e:
         logger.error(f"❌ ดึงข้อมูล NodeID: {nod_id}, Interface ID: {itf_id} ล้มเหลว: {req_e}")
         return None
@@ -182,12 +1624,197 @@ def get_data_from_api(nod_id, itf_id, job_id):
         logger.error(f"❌ ข้อผิดพลาดไม่คาดคิดสำหรับ NodeID: {nod_id}, Interface ID: {itf_id}: {e}")
         return None
 
+def fetch_circuit_data(nod_id, itf_id, job):
+    """
+    ดึงข้อมูลของวงจรจาก response_cache หากมี มิฉะนั้นเรียก API แล้วเก็บผลลัพธ์ที่สำเร็จลง cache
+    คำขอของวงจรเดียวกันที่เกิดขึ้นพร้อมกัน (จากงานเดียวกันหรือต่างงาน) ใช้การเรียก API ครั้งเดียวร่วมกันผ่าน api_calls_in_flight
+    และนับจำนวน hit/miss/coalesced ไว้ใน PipelineJob ของงาน (บันทึกลง job_store พร้อมผลลัพธ์ชุดถัดไป)
+    ผลลัพธ์อาจถูกใช้ร่วมกับงานอื่น ผู้เรียกจึงต้องไม่แก้ไขข้อมูลที่ได้รับ
+    Parameters และค่าที่คืนเหมือน get_data_from_api (ยกเว้น job ซึ่งเป็น PipelineJob ของงาน)
+    """
+    job_id = job.job_id
+    month = report_month_for(datetime.datetime.now())
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        data = response_cache.get(nod_id, itf_id, month)
+        job.count('cache_hits' if data is not None else 'cache_misses')
+        if data is not None:
+            logger.info(f"💾 ใช้ข้อมูลจาก cache สำหรับ NodeID: {nod_id}, Interface ID: {itf_id}")
+            return data
+
+    def call_api():
+        data = get_data_from_api(nod_id, itf_id, job_id)
+        if data and response_cache is not None:
+            response_cache.put(nod_id, itf_id, month, data)
+        return data
+
+    data, shared = api_calls_in_flight.do((nod_id, itf_id), call_api)
+    if shared:
+        job.count('cache_coalesced')
+        logger.info(f"🔗 ใช้ผลลัพธ์ร่วมกับคำขอที่กำลังทำงานอยู่สำหรับ NodeID: {nod_id}, Interface ID: {itf_id}")
+    return data
+
+def format_bandwidth(bandwidth_raw):
+    """
+    แปลงค่า Bandwidth จาก API เป็นข้อความสำหรับแสดงผล เช่น '100M' -> '100 Mbps.' (วงจร FTTx แสดงเป็น '20 Mbps.')
+    หากไม่พบตัวเลข จะคืนค่าดิบเป็น string
+    """
+    if "FTTx" in str(bandwidth_raw):
+        return "20 Mbps."
+    try:
+        numeric_value_match = re.search(r'[\d.]+', str(bandwidth_raw))
+        if numeric_value_match:
+            numeric_value = float(numeric_value_match.group())
+            return f"{int(numeric_value)} Mbps."
+        return str(bandwidth_raw)
+    except (ValueError, TypeError, AttributeError):
+        return str(bandwidth_raw)
+
+def parse_bps_values(values):
+    """
+    แปลงค่า In_Averagebps/Out_Averagebps จาก API ทั้งชุดเป็นจำนวนเต็ม (ตัดทศนิยม) ด้วย NumPy
+
+    Returns:
+    - tuple: (raw, invalid)
+        - raw (np.ndarray[int64]): ค่าจำนวนเต็ม (ค่าที่แปลงไม่ได้เป็น 0)
+        - invalid (dict): {index: ค่าดิบแบบ string} ของค่าที่แปลงไม่ได้ (ใช้แสดงแทนตัวเลข)
+    """
+    values = np.asarray(values, dtype=object)
+    try:
+        numbers = values.astype(np.float64) # เรียก float() กับทุกค่าในครั้งเดียว
+    except (ValueError, TypeError):
+        # มีบางค่าที่ไม่ใช่ตัวเลข: แปลงทีละค่าเพื่อแยกค่าที่แปลงไม่ได้ออก
+        numbers = np.empty(len(values), dtype=np.float64)
+        for i, value in enumerate(values):
+            try:
+                numbers[i] = float(value)
+            except (ValueError, TypeError):
+                numbers[i] = np.nan
+    valid = np.isfinite(numbers)
+    raw = np.where(valid, np.trunc(np.where(valid, numbers, 0)), 0).astype(np.int64)
+    invalid = {int(i): str(values[i]) for i in np.flatnonzero(~valid)}
+    return raw, invalid
+
+def latest_per_hour(hour_positions, mask):
+    """
+    หา index ของรายการสุดท้าย (ตามลำดับที่ API ส่งมา) ในแต่ละชั่วโมง เฉพาะรายการที่ mask เป็น True
+    ให้ผลเหมือนการเขียนทับค่าทีละรายการตามลำดับ
+
+    Returns:
+    - tuple: (hours, indexes) ตำแหน่งชั่วโมงในตาราง และ index ของรายการที่ใช้
+    """
+    candidates = np.flatnonzero(mask)[::-1] # เรียงย้อนหลัง เพื่อให้รายการสุดท้ายถูกพบก่อน
+    hours, first_in_reversed = np.unique(hour_positions[candidates], return_index=True)
+    return hours, candidates[first_in_reversed]
+
+class CircuitReport:
+    """
+    รายงานรายชั่วโมงของวงจรหนึ่งวงจร (ผลลัพธ์ของ process_json_data) ที่ exporter ทุกตัวใช้ร่วมกัน
+    ข้อมูลเก็บเป็น array เรียงตามชั่วโมง ครบ 24 ชั่วโมงต่อวัน โดยยังไม่จัดรูปแบบ
+    การจัดรูปแบบข้อความ (ตัวคั่นหลักพัน, หน่วย 'Mbps.', วันที่และเวลา) ทำตอน render ผ่าน rows() และ grand_total_row()
+
+    Attributes:
+    - headers (list): รายชื่อหัวข้อคอลัมน์ภาษาไทยที่ใช้ใน CSV/PDF
+    - timestamps (np.ndarray[int64]): เวลาเริ่มต้นของแต่ละชั่วโมง (วินาทีนับจาก 1970-01-01)
+    - customer_ids, addresses (np.ndarray[object]): รหัสและชื่อหน่วยงานของแต่ละชั่วโมง
+    - bandwidths (np.ndarray[object]): ค่า Bandwidth ดิบจาก API ของแต่ละชั่วโมง
+    - incoming, outcoming (np.ndarray[int64]): ค่า In_Averagebps/Out_Averagebps เป็นจำนวนเต็ม
+    - invalid_incoming, invalid_outcoming (dict): {ตำแหน่งชั่วโมง: ค่าดิบ} ของค่าที่แปลงเป็นตัวเลขไม่ได้
+    """
+    EPOCH = datetime.date(1970, 1, 1)
+
+    def __init__(self, headers, timestamps, customer_ids, addresses, bandwidths, incoming, outcoming,
+                 invalid_incoming=None, invalid_outcoming=None):
+        self.headers = headers
+        self.timestamps = timestamps
+        self.customer_ids = customer_ids
+        self.addresses = addresses
+        self.bandwidths = bandwidths
+        self.incoming = incoming
+        self.outcoming = outcoming
+        self.invalid_incoming = invalid_incoming or {}
+        self.invalid_outcoming = invalid_outcoming or {}
+
+    @classmethod
+    def empty(cls, headers):
+        """รายงานที่ไม่มีข้อมูล (API ไม่ส่งข้อมูลกลับมา)"""
+        no_objects = np.empty(0, dtype=object)
+        no_numbers = np.empty(0, dtype=np.int64)
+        return cls(headers, no_numbers, no_objects, no_objects, no_objects, no_numbers, no_numbers)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def day_groups(self):
+        """
+        แบ่งแถวตามวัน
+        Returns:
+        - list: [(วันที่ 'YYYY-MM-DD', start, stop), ...] ช่วงตำแหน่งแถวของแต่ละวัน เรียงตามวันที่
+        """
+        days = self.timestamps // 86400
+        boundaries = (np.flatnonzero(np.diff(days)) + 1).tolist()
+        starts = [0] + boundaries
+        stops = boundaries + [len(days)]
+        return [
+            ((self.EPOCH + datetime.timedelta(days=int(days[start]))).isoformat(), start, stop)
+            for start, stop in zip(starts, stops)
+            if stop > start
+        ]
+
+    def rows(self, start=0, stop=None):
+        """
+        Generator ของแถวข้อมูลที่จัดรูปแบบแล้วในช่วง [start, stop) เป็น tuple ตามลำดับ headers
+        (ไม่รวมแถว Grand Total)
+        """
+        stop = len(self) if stop is None else stop
+        day_labels = {}
+        bandwidth_labels = {} # ค่า Bandwidth ซ้ำกันเกือบทุกชั่วโมง จึงจัดรูปแบบครั้งเดียวต่อค่า
+        columns = zip(
+            range(start, stop),
+            self.timestamps[start:stop].tolist(),
+            self.customer_ids[start:stop].tolist(),
+            self.addresses[start:stop].tolist(),
+            self.bandwidths[start:stop].tolist(),
+            self.incoming[start:stop].tolist(),
+            self.outcoming[start:stop].tolist(),
+        )
+        for index, timestamp, customer_id, address, bandwidth, incoming, outcoming in columns:
+            day, seconds = divmod(timestamp, 86400)
+            if day not in day_labels:
+                day_labels[day] = (self.EPOCH + datetime.timedelta(days=day)).isoformat()
+            bandwidth_text = str(bandwidth)
+            if bandwidth_text not in bandwidth_labels:
+                bandwidth_labels[bandwidth_text] = format_bandwidth(bandwidth_text)
+            yield (
+                customer_id,
+                address,
+                f"{day_labels[day]} {seconds // 3600:02d}.{seconds % 3600 // 60:02d}.{seconds % 60:02d}",
+                bandwidth_labels[bandwidth_text],
+                self.invalid_incoming[index] if index in self.invalid_incoming else f"{incoming:,}",
+                self.invalid_outcoming[index] if index in self.invalid_outcoming else f"{outcoming:,}",
+            )
+
+    def grand_total_row(self):
+        """
+        แถว Grand Total (ค่าเฉลี่ยของ In_Averagebps และ Out_Averagebps ทุกชั่วโมง) เป็น tuple ตามลำดับ headers
+        คืนค่า None หากไม่มีข้อมูล
+        """
+        hour_count = len(self)
+        if hour_count == 0:
+            return None
+        average_incoming = round(int(self.incoming.sum()) / hour_count)
+        average_outcoming = round(int(self.outcoming.sum()) / hour_count)
+        return ("Grand Total", "", "", "", f"{average_incoming:,}", f"{average_outcoming:,}")
+
+@timed('process_json')
 def process_json_data(raw_json_data, job_id, excel_node_id, excel_agency_name):
     """
     ประมวลผลข้อมูล JSON ที่ได้จาก API เพื่อเตรียมสำหรับสร้างไฟล์ CSV/PDF
     - เติมข้อมูลให้ครบ 24 ชั่วโมงในแต่ละวันของช่วงเวลาที่มีข้อมูล
-    - คำนวณค่าเฉลี่ยรวม (Grand Total Average) ของ In_Averagebps และ Out_Averagebps
-    - จัดรูปแบบ Bandwidth และปริมาณการใช้งาน
+    - แปลงปริมาณการใช้งานเป็นจำนวนเต็ม (การจัดรูปแบบและ Grand Total ทำตอน render ใน CircuitReport)
+
+    ตารางรายชั่วโมงสร้างด้วย pandas.date_range (เริ่มต้นวันที่ 1 ของเดือนแรก ถึงวันสุดท้ายของเดือนสุดท้าย)
+    แล้ววางข้อมูลจาก API ลงตามตำแหน่งชั่วโมงด้วย NumPy แทนการวนลูปและ strftime ทีละชั่วโมง
 
     Parameters:
     - raw_json_data (list or dict): ข้อมูล JSON ดิบจาก API
@@ -196,10 +1823,7 @@ def process_json_data(raw_json_data, job_id, excel_node_id, excel_agency_name):
     - excel_agency_name (str): ชื่อหน่วยงานจากไฟล์ Excel (ใช้เป็นค่าเริ่มต้นหาก API ไม่มี Address)
 
     Returns:
-    - tuple: (headers, processed_data, grand_total_row)
-        - headers (list): รายชื่อหัวข้อคอลัมน์ภาษาไทยที่ใช้ใน CSV/PDF
-        - processed_data (list): ข้อมูลที่ประมวลผลแล้วพร้อมสำหรับตาราง (รวม 24 ชั่วโมง)
-        - grand_total_row (dict): แถว Grand Total (Average)
+    - CircuitReport: รายงานรายชั่วโมงของวงจร (ว่างเปล่าหากไม่มีข้อมูล)
     """
     # ------------------- START: ส่วนที่แก้ไข -------------------
 
@@ -218,192 +1842,92 @@ def process_json_data(raw_json_data, job_id, excel_node_id, excel_agency_name):
 
     if raw_json_data is None or (isinstance(raw_json_data, list) and not raw_json_data):
         logger.warning(f"ไม่มีข้อมูล JSON ให้ประมวลผลสำหรับ Job {job_id}")
-        return desired_headers_th, [], {}
+        return CircuitReport.empty(desired_headers_th)
 
     data_to_process = raw_json_data if isinstance(raw_json_data, list) else [raw_json_data]
 
-    api_customer_circuit_id = excel_node_id
-    address_to_use = excel_agency_name
-    bandwidth_to_use = ''
-
     first_item = data_to_process[0]
 
     api_customer_circuit_id = first_item.get(column_mapping["รหัสหน่วยงาน"]) or excel_node_id
     api_address = first_item.get(column_mapping["ชื่อหน่วยงาน"]) or excel_agency_name
-    bandwidth_raw_from_api = first_item.get(column_mapping["ขนาดBandwidth (หน่วย Mbps)"]) or ''
-
-    if "FTTx" in str(bandwidth_raw_from_api):
-        bandwidth_to_use = "20 Mbps."
-    else:
-        try:
-            numeric_value_match = re.search(r'[\d.]+', str(bandwidth_raw_from_api))
-            if numeric_value_match:
-                numeric_value = float(numeric_value_match.group())
-                bandwidth_to_use = f"{int(numeric_value)} Mbps."
-            else:
-                bandwidth_to_use = str(bandwidth_raw_from_api)
-        except (ValueError, TypeError, AttributeError):
-            bandwidth_to_use = str(bandwidth_raw_from_api)
-
-    min_date_from_api = None
-    max_date_from_api = None
-
-    # ------------------- START: ส่วนที่แก้ไข -------------------
-    # 2. ปรับ logic การอ่านค่าเวลาให้รับค่าจาก 'Timestamp' ที่เป็น string โดยตรง
-    for item in data_to_process:
-        timestamp_str = item.get('Timestamp')
+    bandwidth_to_use = first_item.get(column_mapping["ขนาดBandwidth (หน่วย Mbps)"]) or ''
+
+    # 2. แปลงค่าเวลาจาก 'Timestamp' (รูปแบบ '%d/%m/%Y %H') ของทุกรายการในครั้งเดียว ค่าที่แปลงไม่ได้จะเป็น NaT
+    timestamp_values = [item.get('Timestamp') for item in data_to_process]
+    parsed_timestamps = pd.to_datetime(
+        pd.Series([value if isinstance(value, str) else None for value in timestamp_values], dtype=object),
+        format='%d/%m/%Y %H',
+        errors='coerce'
+    )
+    valid_timestamps = parsed_timestamps.notna().to_numpy()
+    for timestamp_str, is_valid in zip(timestamp_values, valid_timestamps):
         # ตรวจสอบว่า Timestamp ไม่ใช่ค่าว่าง
-        if timestamp_str:
-            try:
-                # ลองแปลงค่าเวลาโดยคาดว่ามีรูปแบบเป็น 'YYYY-MM-DD HH:MM:SS'
-                # หาก API ส่งรูปแบบอื่นมา อาจจะต้องปรับ format string ('%d/%m/%Y %H') ตรงนี้
-                dt_obj_from_api = datetime.datetime.strptime(timestamp_str, '%d/%m/%Y %H')
-                if min_date_from_api is None or dt_obj_from_api.date() < min_date_from_api:
-                    min_date_from_api = dt_obj_from_api.date()
-                if max_date_from_api is None or dt_obj_from_api.date() > max_date_from_api:
-                    max_date_from_api = dt_obj_from_api.date()
-            except (ValueError, TypeError):
-                logger.warning(f"Job {job_id}: ไม่สามารถแปลงวันที่จาก Timestamp ได้: '{timestamp_str}'")
-                continue
-    # -------------------- END: ส่วนที่แก้ไข --------------------
+        if timestamp_str and not is_valid:
+            logger.warning(f"Job {job_id}: ไม่สามารถแปลงวันที่จาก Timestamp ได้: '{timestamp_str}'")
 
-    if min_date_from_api is None or max_date_from_api is None:
+    if not valid_timestamps.any():
         logger.warning(f"Job {job_id}: ไม่พบข้อมูลเวลาที่ถูกต้องจาก API เลย จะใช้เดือนปัจจุบันเป็นค่าเริ่มต้น")
         today = datetime.date.today()
         first_day_of_current_month = today.replace(day=1)
         report_end_date = first_day_of_current_month - datetime.timedelta(days=1)
         report_start_date = report_end_date.replace(day=1)
     else:
+        min_date_from_api = parsed_timestamps[valid_timestamps].min().date()
+        max_date_from_api = parsed_timestamps[valid_timestamps].max().date()
         report_start_date = min_date_from_api.replace(day=1)
         next_month_start_for_max = (max_date_from_api.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
         report_end_date = next_month_start_for_max - datetime.timedelta(days=1)
 
-    full_data_structure = {}
-    current_date = report_start_date
-    while current_date <= report_end_date:
-        for hour in range(24):
-            dt_obj = datetime.datetime.combine(current_date, datetime.time(hour, 0, 0))
-            formatted_date_time = dt_obj.strftime('%Y-%m-%d %H.%M.%S')
-            date_key = current_date.strftime('%Y-%m-%d')
-
-            if date_key not in full_data_structure:
-                full_data_structure[date_key] = {}
-
-            full_data_structure[date_key][formatted_date_time] = {
-                "รหัสหน่วยงาน": api_customer_circuit_id,
-                "ชื่อหน่วยงาน": api_address,
-                "วันที่และเวลา": formatted_date_time,
-                "ขนาดBandwidth (หน่วย Mbps)": bandwidth_to_use,
-                "In_Averagebps": "0",
-                "Out_Averagebps": "0",
-                "_raw_incoming": 0,
-                "_raw_outcoming": 0
-            }
-        current_date += datetime.timedelta(days=1)
-
-    # ------------------- START: ส่วนที่แก้ไข -------------------
-    # 3. ปรับ logic การอัปเดตข้อมูลให้ดึงค่าเวลาจาก 'Timestamp' เช่นกัน
-    for item in data_to_process:
-        dt_obj_from_api = None
-        timestamp_str = item.get('Timestamp')
-        if timestamp_str:
-            try:
-                dt_obj_from_api = datetime.datetime.strptime(timestamp_str, '%d/%m/%Y %H')
-            except (ValueError, TypeError):
-                continue
-
-        if dt_obj_from_api:
-            # ใช้ dt_obj_from_api ที่ได้มาในการอัปเดตข้อมูลต่อไป...
-            # (โค้ดส่วนที่เหลือในลูปนี้เหมือนเดิม ไม่ต้องแก้ไข)
-    # -------------------- END: ส่วนที่แก้ไข --------------------
-            date_key = dt_obj_from_api.strftime('%Y-%m-%d')
-            # ปรับ format ของเวลาให้เป็น H.M.S เพื่อให้ตรงกับ key ที่สร้างไว้
-            formatted_time_from_api = dt_obj_from_api.strftime('%Y-%m-%d %H.%M.%S')
-
-
-            if date_key in full_data_structure and formatted_time_from_api in full_data_structure[date_key]:
-                item_customer_id = item.get(column_mapping["รหัสหน่วยงาน"])
-                item_address = item.get(column_mapping["ชื่อหน่วยงาน"])
-
-                if item_customer_id:
-                    full_data_structure[date_key][formatted_time_from_api]["รหัสหน่วยงาน"] = item_customer_id
-
-                if item_address:
-                    full_data_structure[date_key][formatted_time_from_api]["ชื่อหน่วยงาน"] = item_address
-
-                in_avg_bps = item.get('In_Averagebps', '0')
-                out_avg_bps = item.get('Out_Averagebps', '0')
-
-                try:
-                    in_avg_bps_float = float(in_avg_bps)
-                    full_data_structure[date_key][formatted_time_from_api]["_raw_incoming"] = int(in_avg_bps_float)
-                    full_data_structure[date_key][formatted_time_from_api]["In_Averagebps"] = f"{int(in_avg_bps_float):,}"
-                except (ValueError, TypeError):
-                    full_data_structure[date_key][formatted_time_from_api]["_raw_incoming"] = 0
-                    full_data_structure[date_key][formatted_time_from_api]["In_Averagebps"] = str(in_avg_bps)
-
-                try:
-                    out_avg_bps_float = float(out_avg_bps)
-                    full_data_structure[date_key][formatted_time_from_api]["_raw_outcoming"] = int(out_avg_bps_float)
-                    full_data_structure[date_key][formatted_time_from_api]["Out_Averagebps"] = f"{int(out_avg_bps_float):,}"
-                except (ValueError, TypeError):
-                    full_data_structure[date_key][formatted_time_from_api]["_raw_outcoming"] = 0
-                    full_data_structure[date_key][formatted_time_from_api]["Out_Averagebps"] = str(out_avg_bps)
-
-                item_bandwidth_raw = item.get(column_mapping["ขนาดBandwidth (หน่วย Mbps)"])
-                if item_bandwidth_raw:
-                    if "FTTx" in str(item_bandwidth_raw):
-                        full_data_structure[date_key][formatted_time_from_api]["ขนาดBandwidth (หน่วย Mbps)"] = "20 Mbps."
-                    else:
-                        try:
-                            numeric_value_match = re.search(r'[\d.]+', str(item_bandwidth_raw))
-                            if numeric_value_match:
-                                numeric_value = float(numeric_value_match.group())
-                                full_data_structure[date_key][formatted_time_from_api]["ขนาดBandwidth (หน่วย Mbps)"] = f"{int(numeric_value)} Mbps."
-                            else:
-                                full_data_structure[date_key][formatted_time_from_api]["ขนาดBandwidth (หน่วย Mbps)"] = str(item_bandwidth_raw)
-                        except (ValueError, TypeError, AttributeError):
-                            full_data_structure[date_key][formatted_time_from_api]["ขนาดBandwidth (หน่วย Mbps)"] = str(item_bandwidth_raw)
-
-    processed_data = []
-    total_incoming_sum = 0
-    total_outcoming_sum = 0
-    data_points_count = 0
-
-    for date_key in sorted(full_data_structure.keys()):
-        for time_key in sorted(full_data_structure[date_key].keys()):
-            row = full_data_structure[date_key][time_key]
-            processed_data.append(row)
-            total_incoming_sum += row.get("_raw_incoming", 0)
-            total_outcoming_sum += row.get("_raw_outcoming", 0)
-            data_points_count += 1
-
-    average_incoming = 0
-    average_outcoming = 0
-    if data_points_count > 0:
-        average_incoming = round(total_incoming_sum / data_points_count)
-        average_outcoming = round(total_outcoming_sum / data_points_count)
-
-    grand_total_row = {
-        "รหัสหน่วยงาน": "Grand Total",
-        "ชื่อหน่วยงาน": "",
-        "วันที่และเวลา": "",
-        "ขนาดBandwidth (หน่วย Mbps)": "",
-        "In_Averagebps": f"{average_incoming:,}",
-        "Out_Averagebps": f"{average_outcoming:,}"
-    }
-
-    return desired_headers_th, processed_data, grand_total_row
-
-
-
-def export_to_csv(headers, data, filename, job_id, node_name):
+    # 3. สร้างตารางรายชั่วโมงของทุกวันในช่วงรายงาน พร้อมค่าเริ่มต้น
+    hours_index = pd.date_range(start=report_start_date, periods=((report_end_date - report_start_date).days + 1) * 24, freq='h')
+    hour_count = len(hours_index)
+    customer_ids = np.full(hour_count, api_customer_circuit_id, dtype=object)
+    addresses = np.full(hour_count, api_address, dtype=object)
+    bandwidths = np.full(hour_count, bandwidth_to_use, dtype=object)
+    raw_incoming = np.zeros(hour_count, dtype=np.int64)
+    raw_outcoming = np.zeros(hour_count, dtype=np.int64)
+    invalid_incoming = {}
+    invalid_outcoming = {}
+
+    # 4. วางข้อมูลจาก API ลงในตารางตามตำแหน่งชั่วโมง (รายการหลังเขียนทับรายการก่อนหน้าในชั่วโมงเดียวกัน)
+    api_items = [item for item, is_valid in zip(data_to_process, valid_timestamps) if is_valid]
+    if api_items:
+        hour_positions = ((parsed_timestamps[valid_timestamps] - hours_index[0]) // pd.Timedelta(hours=1)).to_numpy(dtype=np.int64)
+        all_items = np.ones(len(api_items), dtype=bool)
+
+        item_customer_ids = np.array([item.get(column_mapping["รหัสหน่วยงาน"]) for item in api_items], dtype=object)
+        hours, indexes = latest_per_hour(hour_positions, np.array([bool(value) for value in item_customer_ids]))
+        customer_ids[hours] = item_customer_ids[indexes]
+
+        item_addresses = np.array([item.get(column_mapping["ชื่อหน่วยงาน"]) for item in api_items], dtype=object)
+        hours, indexes = latest_per_hour(hour_positions, np.array([bool(value) for value in item_addresses]))
+        addresses[hours] = item_addresses[indexes]
+
+        item_bandwidths = np.array([item.get(column_mapping["ขนาดBandwidth (หน่วย Mbps)"]) for item in api_items], dtype=object)
+        hours, indexes = latest_per_hour(hour_positions, np.array([bool(value) for value in item_bandwidths]))
+        bandwidths[hours] = item_bandwidths[indexes]
+
+        hours, indexes = latest_per_hour(hour_positions, all_items)
+        hour_list = hours.tolist()
+        raw, invalid = parse_bps_values([api_items[index].get('In_Averagebps', '0') for index in indexes.tolist()])
+        raw_incoming[hours] = raw
+        invalid_incoming = {hour_list[i]: value for i, value in invalid.items()}
+        raw, invalid = parse_bps_values([api_items[index].get('Out_Averagebps', '0') for index in indexes.tolist()])
+        raw_outcoming[hours] = raw
+        invalid_outcoming = {hour_list[i]: value for i, value in invalid.items()}
+
+    # 5. เก็บตารางเป็น CircuitReport (จัดรูปแบบตอน render)
+    timestamps = hours_index.values.astype('datetime64[s]').astype(np.int64)
+    return CircuitReport(desired_headers_th, timestamps, customer_ids, addresses, bandwidths,
+                         raw_incoming, raw_outcoming, invalid_incoming, invalid_outcoming)
+
+@timed('export_csv', failed=lambda result: not result[0])
+def export_to_csv(report, filename, job_id, node_name):
     """
-    สร้างและบันทึกไฟล์ CSV
+    สร้างและบันทึกไฟล์ CSV (ทุกชั่วโมง ตามด้วยแถว Grand Total)
     Parameters:
-    - headers (list): รายชื่อหัวข้อคอลัมน์
-    - data (list): ข้อมูลที่จะเขียนลง CSV (รวม Grand Total แล้ว)
-    - filename (str): ชื่อไฟล์ CSV ที่จะบันทึก
+    - report (CircuitReport): รายงานรายชั่วโมงจาก process_json_data
+    - filename (str or file-like): ชื่อไฟล์ CSV ที่จะบันทึก หรือ text stream (เช่น io.StringIO(newline=''))
     - job_id (str): ID ของงาน (สำหรับ logging)
     - node_name (str): ชื่อ Node (สำหรับ logging)
     Returns:
@@ -411,22 +1935,18 @@ def export_to_csv(headers, data, filename, job_id, node_name):
     """
     try:
         # เปิดไฟล์ในโหมด 'w' (write), 'newline=''' เพื่อป้องกันบรรทัดว่าง, 'utf-8-sig' สำหรับ BOM (Byte Order Mark)
-        # เพื่อให้ Excel เปิดภาษาไทยได้ถูกต้อง
-        with open(filename, 'w', newline='', encoding='utf-8-sig') as f:
+        # เพื่อให้ Excel เปิดภาษาไทยได้ถูกต้อง (กรณี text stream ผู้เรียกต้อง encode เป็น 'utf-8-sig' เอง)
+        if isinstance(filename, (str, os.PathLike)):
+            output = open(filename, 'w', newline='', encoding='utf-8-sig')
+        else:
+            output = contextlib.nullcontext(filename)
+        with output as f:
             cw = csv.writer(f) # สร้าง CSV writer object
-            if headers and data:
-                cw.writerow(headers) # เขียนหัวข้อคอลัมน์
+            if report.headers and len(report):
+                cw.writerow(report.headers) # เขียนหัวข้อคอลัมน์
                 # ไม่จำเป็นต้องเก็บ last_customer_id/name สำหรับ CSV เพราะจะแสดงทุกแถว
-                for row in data:
-                    new_row = [
-                        row.get('รหัสหน่วยงาน', ''),
-                        row.get('ชื่อหน่วยงาน', ''),
-                        row.get('วันที่และเวลา', ''),
-                        row.get('ขนาดBandwidth (หน่วย Mbps)', ''),
-                        row.get('In_Averagebps', ''),
-                        row.get('Out_Averagebps', '')
-                    ]
-                    cw.writerow(new_row) # เขียนข้อมูลแต่ละแถว
+                cw.writerows(report.rows()) # เขียนข้อมูลแต่ละแถว
+                cw.writerow(report.grand_total_row())
             else:
                 cw.writerow(["No Data"]) # กรณีไม่มีข้อมูล
         logger.info(f"✅ สร้าง CSV สำหรับ '{node_name}' สำเร็จแล้ว")
@@ -435,15 +1955,14 @@ def export_to_csv(headers, data, filename, job_id, node_name):
         logger.error(f"❌ สร้าง CSV สำหรับ '{node_name}' ล้มเหลว: {e}")
         return False, str(e)
 
-def export_to_pdf(headers, daily_data, grand_total_row, filename, job_id, node_name):
+@timed('export_pdf', failed=lambda result: not result[0])
+def export_to_pdf(report, filename, job_id, node_name):
     """
     สร้างและบันทึกไฟล์ PDF โดยให้แต่ละวันขึ้นหน้าใหม่, Grand Total อยู่ต่อท้ายวันสุดท้าย
     ข้อมูล "รหัสหน่วยงาน" และ "ชื่อหน่วยงาน" จะแสดงเพียงครั้งเดียวต่อวัน (ถ้าซ้ำ)
     Parameters:
-    - headers (list): รายชื่อหัวข้อคอลัมน์
-    - daily_data (list): ข้อมูลรายวันที่จะเขียนลง PDF (ไม่รวม Grand Total)
-    - grand_total_row (dict): แถว Grand Total (Average)
-    - filename (str): ชื่อไฟล์ PDF ที่จะบันทึก
+    - report (CircuitReport): รายงานรายชั่วโมงจาก process_json_data (แบ่งหน้าตาม report.day_groups())
+    - filename (str or file-like): ชื่อไฟล์ PDF ที่จะบันทึก หรือ buffer (เช่น io.BytesIO)
     - job_id (str): ID ของงาน (สำหรับ logging)
     - node_name (str): ชื่อ Node (สำหรับ logging)
     Returns:
@@ -473,35 +1992,19 @@ def export_to_pdf(headers, daily_data, grand_total_row, filename, job_id, node_n
         cell_paragraph_style.alignment = 1 # จัดกึ่งกลาง (หรือ LEFT/RIGHT ตามต้องการ)
 
 
-        if headers and daily_data:
-            data_by_date = {}
-            for row in daily_data:
-                date_time_str = row.get('วันที่และเวลา', '')
-                try:
-                    date_key = datetime.datetime.strptime(date_time_str, '%Y-%m-%d %H.%M.%S').strftime('%Y-%m-%d')
-                except ValueError:
-                    date_key = 'Uncategorized'
-                    logger.warning(f"Found uncategorized date for PDF: {date_time_str}")
-                if date_key not in data_by_date:
-                    data_by_date[date_key] = []
-                data_by_date[date_key].append(row)
-
-            report_month_str = "ไม่ระบุเดือน"
-            if data_by_date:
-                first_date_str = sorted(data_by_date.keys())[0]
-                try:
-                    first_date_obj = datetime.datetime.strptime(first_date_str, '%Y-%m-%d')
-                    thai_months = {
-                        1: "มกราคม", 2: "กุมภาพันธ์", 3: "มีนาคม", 4: "เมษายน",
-                        5: "พฤษภาคม", 6: "มิถุนายน", 7: "กรกฎาคม", 8: "สิงหาคม",
-                        9: "กันยายน", 10: "ตุลาคม", 11: "พฤศจิกายน", 12: "ธันวาคม"
-                    }
-                    report_month_str = thai_months.get(first_date_obj.month, "ไม่ระบุเดือน")
-                except ValueError:
-                    logger.warning(f"Could not parse first date for month determination: {first_date_str}")
+        if report.headers and len(report):
+            day_groups = report.day_groups()
+            grand_total_row = report.grand_total_row()
+
+            thai_months = {
+                1: "มกราคม", 2: "กุมภาพันธ์", 3: "มีนาคม", 4: "เมษายน",
+                5: "พฤษภาคม", 6: "มิถุนายน", 7: "กรกฎาคม", 8: "สิงหาคม",
+                9: "กันยายน", 10: "ตุลาคม", 11: "พฤศจิกายน", 12: "ธันวาคม"
+            }
+            first_date_obj = datetime.date.fromisoformat(day_groups[0][0])
+            report_month_str = thai_months.get(first_date_obj.month, "ไม่ระบุเดือน")
 
             first_page = True
-            sorted_dates = sorted(data_by_date.keys())
 
             # คำนวณความกว้างที่ใช้ได้สำหรับตาราง
             # letter width = 8.5 inches
@@ -509,8 +2012,8 @@ def export_to_pdf(headers, daily_data, grand_total_row, filename, job_id, node_n
             # letter page: 8.5 * inch
             usable_page_width = letter[0] - (2 * margin_size) # letter[0] คือความกว้างของหน้ากระดาษ
 
-            for i, date_key in enumerate(sorted_dates):
-                group_data = data_by_date[date_key]
+            for i, (date_key, start, stop) in enumerate(day_groups):
+                group_data = list(report.rows(start, stop))
 
                 if not first_page:
                     elements.append(PageBreak())
@@ -586,17 +2089,15 @@ def export_to_pdf(headers, daily_data, grand_total_row, filename, job_id, node_n
                 table_styles_commands = []
 
                 for idx_row, row in enumerate(group_data):
-                    current_customer_id = row.get('รหัสหน่วยงาน', '')
-                    current_customer_name = row.get('ชื่อหน่วยงาน', '')
-                    current_bandwidth = row.get('ขนาดBandwidth (หน่วย Mbps)', '')
+                    current_customer_id, current_customer_name, date_time_str, current_bandwidth, in_value, out_value = row
 
                     cell_data_row = [
                         Paragraph(current_customer_id, cell_paragraph_style),
                         Paragraph(current_customer_name, cell_paragraph_style),
-                        Paragraph(row.get('วันที่และเวลา', ''), cell_paragraph_style),
+                        Paragraph(date_time_str, cell_paragraph_style),
                         Paragraph(str(current_bandwidth), cell_paragraph_style),
-                        Paragraph(str(row.get('In_Averagebps', '')), cell_paragraph_style),
-                        Paragraph(str(row.get('Out_Averagebps', '')), cell_paragraph_style)
+                        Paragraph(str(in_value), cell_paragraph_style),
+                        Paragraph(str(out_value), cell_paragraph_style)
                     ]
                     table_data.append(cell_data_row)
 
@@ -630,15 +2131,8 @@ def export_to_pdf(headers, daily_data, grand_total_row, filename, job_id, node_n
                     table_styles_commands.append(('SPAN', (1, span_data['ชื่อหน่วยงาน']['start_row']), (1, len(group_data))))
 
                 # If it's the last day and there's a Grand Total row, add it to the table data
-                if i == len(sorted_dates) - 1 and grand_total_row:
-                    grand_total_row_data = [
-                        Paragraph(grand_total_row.get('รหัสหน่วยงาน', ''), cell_paragraph_style),
-                        Paragraph(grand_total_row.get('ชื่อหน่วยงาน', ''), cell_paragraph_style),
-                        Paragraph(grand_total_row.get('วันที่และเวลา', ''), cell_paragraph_style),
-                        Paragraph(str(grand_total_row.get('ขนาดBandwidth (หน่วย Mbps)', '')), cell_paragraph_style),
-                        Paragraph(str(grand_total_row.get('In_Averagebps', '')), cell_paragraph_style),
-                        Paragraph(str(grand_total_row.get('Out_Averagebps', '')), cell_paragraph_style)
-                    ]
+                if i == len(day_groups) - 1 and grand_total_row:
+                    grand_total_row_data = [Paragraph(str(value), cell_paragraph_style) for value in grand_total_row]
                     table_data.append(grand_total_row_data)
 
                 table = Table(table_data, colWidths=col_widths)
@@ -662,7 +2156,7 @@ def export_to_pdf(headers, daily_data, grand_total_row, filename, job_id, node_n
 
                 table_style.extend(table_styles_commands)
 
-                if i == len(sorted_dates) - 1 and grand_total_row:
+                if i == len(day_groups) - 1 and grand_total_row:
                     grand_total_row_index = len(table_data) - 1
                     table_style.append(('BACKGROUND', (0, grand_total_row_index), (-1, grand_total_row_index), '#dddddd'))
                     table_style.append(('FONTNAME', (0, grand_total_row_index), (-1, grand_total_row_index), THAI_FONT_NAME if THAI_FONT_REGISTERED else 'Helvetica-Bold'))
@@ -690,24 +2184,804 @@ def export_to_pdf(headers, daily_data, grand_total_row, filename, job_id, node_n
         return False, f"Error generating PDF: {e}"
 
 
+# --- Process Pool สำหรับสร้าง PDF (หลีกเลี่ยง GIL) ---
+pdf_process_pool = None
+pdf_process_pool_lock = threading.Lock()
+
+def init_pdf_worker():
+    """
+    Initializer ของแต่ละ process ใน pdf_process_pool: ลงทะเบียนฟอนต์ไทยครั้งเดียวตอนเริ่ม process
+    และลด log ใน process ลูกเหลือเฉพาะ WARNING ขึ้นไป (process หลักเป็นผู้ log ผลลัพธ์ให้หน้าเว็บ)
+    """
+    global THAI_FONT_REGISTERED
+    logger.setLevel(logging.WARNING)
+    if not THAI_FONT_REGISTERED:
+        THAI_FONT_REGISTERED = register_thai_font()
+
+def pdf_worker_ping():
+    return os.getpid()
+
+def get_pdf_process_pool():
+    """
+    คืนค่า ProcessPoolExecutor ที่ใช้ร่วมกันทุกงาน (สร้างครั้งแรกเมื่อถูกเรียก)
+    และ pre-warm ให้ทุก process เริ่มทำงานและลงทะเบียนฟอนต์เสร็จก่อนรับงานจริง
+    """
+    global pdf_process_pool
+    with pdf_process_pool_lock:
+        if pdf_process_pool is None:
+            # ใช้ 'spawn' แทน fork: process หลักมี Thread ทำงานอยู่หลายตัว การ fork อาจติด lock ที่ถูกถือค้างไว้
+            pdf_process_pool = ProcessPoolExecutor(max_workers=PDF_PROCESS_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                                                   initializer=init_pdf_worker)
+            for future in [pdf_process_pool.submit(pdf_worker_ping) for _ in range(PDF_PROCESS_WORKERS)]:
+                future.result()
+            atexit.register(pdf_process_pool.shutdown, wait=False, cancel_futures=True)
+        return pdf_process_pool
+
+def render_pdf_in_worker(report, node_name):
+    """
+    ทำงานใน process ลูก: สร้าง PDF ลงหน่วยความจำแล้วคืนค่าเป็น bytes
+    report (CircuitReport) ส่งข้าม process เป็น array ที่ยังไม่จัดรูปแบบ จึงมีขนาดเล็ก
+
+    Returns:
+    - tuple: (bool, str, bytes หรือ None)
+    """
+    buffer = io.BytesIO()
+    success, msg = export_to_pdf(report, buffer, None, node_name)
+    return success, msg, buffer.getvalue() if success else None
+
+@timed('export_pdf', failed=lambda result: not result[0])
+def export_to_pdf_in_process(report, filename, job_id, node_name):
+    """
+    สร้างไฟล์ PDF ผ่าน pdf_process_pool แทนการสร้างใน Thread ปัจจุบัน
+    Parameters และค่าที่คืนเหมือน export_to_pdf
+    """
+    global pdf_process_pool
+    try:
+        future = get_pdf_process_pool().submit(render_pdf_in_worker, report, node_name)
+        success, msg, pdf_bytes = future.result()
+        if not success:
+            logger.error(f"❌ สร้าง PDF สำหรับ '{node_name}' ล้มเหลว: {msg}")
+            return False, msg
+        if isinstance(filename, (str, os.PathLike)):
+            with open(filename, 'wb') as f:
+                f.write(pdf_bytes)
+        else:
+            filename.write(pdf_bytes)
+        logger.info(f"✅ สร้าง PDF สำหรับ '{node_name}' สำเร็จแล้ว")
+        return True, "PDF generated successfully."
+    except BrokenProcessPool as e:
+        # process ลูกตายกลางคัน: ทิ้ง pool เดิมเพื่อให้งานถัดไปสร้าง pool ใหม่
+        with pdf_process_pool_lock:
+            pdf_process_pool = None
+        logger.error(f"❌ สร้าง PDF สำหรับ '{node_name}' ล้มเหลว: {e}")
+        return False, f"Error generating PDF: {e}"
+    except Exception as e:
+        logger.error(f"❌ สร้าง PDF สำหรับ '{node_name}' ล้มเหลว: {e}")
+        return False, f"Error generating PDF: {e}"
+
+class AppendOnlyFile:
+    """
+    file object สำหรับเขียนต่อท้ายอย่างเดียว (มี tell แต่ไม่มี seek)
+    zipfile จะมองว่าเป็น stream ที่ seek ไม่ได้ และเขียนแต่ละ entry แบบมี data descriptor
+    ไบต์ที่เขียนลงไฟล์แล้วจึงไม่ถูกแก้ไขย้อนหลัง และอ่านตามไปส่งให้ client ระหว่างที่งานยังไม่เสร็จได้
+    """
+
+    def __init__(self, path):
+        self._f = open(path, 'wb')
+        self._pos = 0
+
+    def write(self, data):
+        n = self._f.write(data)
+        self._pos += n
+        return n
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+def archive_compression_for(arcname):
+    """
+    เลือกวิธีบีบอัดของไฟล์ใน ZIP ตามนามสกุลไฟล์
+    Returns:
+    - tuple: (compress_type, compresslevel)
+    """
+    extension = posixpath.splitext(arcname)[1].lower()
+    return ARCHIVE_COMPRESSION_POLICY.get(extension, (zipfile.ZIP_DEFLATED, DEFAULT_COMPRESSLEVEL))
+
+def write_precompressed_entry(zip_file, fp, arcname, data, compressed):
+    """
+    เขียน entry ที่บีบอัดแบบ raw deflate ไว้แล้วลง `zip_file` ซึ่งเขียนลง `fp` (ผู้เรียกต้องกันไม่ให้เขียนพร้อมกัน)
+    ทำแบบเดียวกับ ZipFile.writestr แต่ใช้ข้อมูลที่บีบอัดแล้ว เนื่องจากรู้ขนาดและ CRC ล่วงหน้า
+    จึงเขียน local header ที่สมบูรณ์ได้ทันทีโดยไม่ต้องมี data descriptor
+    zipfile ไม่มี public API สำหรับเขียนข้อมูลที่บีบอัดแล้ว จึงต้องใช้ state ภายในของ ZipFile
+    ใช้ได้เฉพาะเมื่อ precompressed_zip_supported() เป็น True เท่านั้น
+    """
+    zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime(time.time())[:6])
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.external_attr = 0o600 << 16 # ค่าเดียวกับ ZipFile.writestr
+    zinfo.file_size = len(data)
+    zinfo.compress_size = len(compressed)
+    zinfo.CRC = zlib.crc32(data)
+    zinfo.header_offset = fp.tell()
+
+    zip_file._writecheck(zinfo)
+    zip_file._didModify = True
+    fp.write(zinfo.FileHeader())
+    fp.write(compressed)
+    zip_file.filelist.append(zinfo)
+    zip_file.NameToInfo[zinfo.filename] = zinfo
+    zip_file.start_dir = fp.tell()
+
+@functools.lru_cache(maxsize=None)
+def precompressed_zip_supported():
+    """
+    ตรวจครั้งเดียวต่อ process ว่า write_precompressed_entry ใช้ได้กับ zipfile ของ Python ที่ใช้อยู่
+    โดยเขียน ZIP ทดสอบ (ผสมกับ entry จาก writestr) แล้วเปิดอ่านใหม่ด้วย testzip() และเทียบข้อมูล
+    หาก state ภายในของ ZipFile เปลี่ยนไปจนใช้ไม่ได้ ReportArchive จะกลับไปใช้ writestr ตามปกติ
+    """
+    entries = {'precompressed.csv': 'วันที่,ชั่วโมง\n'.encode('utf-8') * 64, 'writestr.pdf': b'%PDF-1.4' * 64}
+    try:
+        with tempfile.TemporaryDirectory(prefix='zip_check_') as temp_dir:
+            path = os.path.join(temp_dir, 'check.zip')
+            raw = AppendOnlyFile(path)
+            with zipfile.ZipFile(raw, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                data = entries['precompressed.csv']
+                compressor = zlib.compressobj(DEFAULT_COMPRESSLEVEL, zlib.DEFLATED, -15)
+                write_precompressed_entry(zip_file, raw, 'precompressed.csv', data, compressor.compress(data) + compressor.flush())
+                zip_file.writestr('writestr.pdf', entries['writestr.pdf'])
+            raw.close()
+            with zipfile.ZipFile(path) as zip_file:
+                supported = zip_file.testzip() is None and all(zip_file.read(name) == data for name, data in entries.items())
+    except Exception as e:
+        logger.warning(f"⚠️ เขียน ZIP ด้วยข้อมูลที่บีบอัดไว้แล้วไม่ได้ ({e}) จะบีบอัดภายใน lock ด้วย writestr แทน")
+        return False
+    if not supported:
+        logger.warning("⚠️ ZIP ที่เขียนด้วยข้อมูลที่บีบอัดไว้แล้วไม่ผ่าน testzip() จะบีบอัดภายใน lock ด้วย writestr แทน")
+    return supported
+
+class ReportStreamAborted(Exception):
+    """ZIP ที่กำลังส่งแบบ streaming ไม่มีวันสมบูรณ์ (งานถูกยกเลิกหรือผิดพลาด) ต้องตัดการเชื่อมต่อแทนการจบ response ตามปกติ"""
+
+class ReportArchive:
+    """
+    ไฟล์ ZIP ของงานที่เขียนเพิ่มทีละไฟล์ทันทีที่ render stage สร้าง CSV/PDF เสร็จ
+    ข้อมูลมาจาก buffer ในหน่วยความจำโดยตรง จึงไม่ต้องเขียนไฟล์ชั่วคราวลงดิสก์แล้วอ่านกลับมาบีบอัดตอนท้าย
+    ใช้ร่วมกันระหว่าง Worker Thread ได้ (เขียนทีละ entry ภายใต้ lock)
+
+    ไฟล์ถูกเขียนแบบต่อท้ายอย่างเดียว (AppendOnlyFile) และเผยแพร่ขนาดที่เขียนเสร็จแล้วผ่าน `size`
+    เพื่อให้ iter_bytes() ส่งไฟล์ ZIP ให้ client แบบ streaming ได้ตั้งแต่งานยังไม่เสร็จ
+    Central directory จะถูกเขียนตอน close() เท่านั้น
+
+    แต่ละไฟล์ถูกบีบอัดตาม archive_compression_for() และเก็บสถิติแยกตามชนิดไฟล์ไว้ใน summary()
+    """
+
+    def __init__(self, path, parallel_compression=True):
+        self.path = path
+        self._raw = AppendOnlyFile(path)
+        self._zip = zipfile.ZipFile(self._raw, 'w', zipfile.ZIP_DEFLATED)
+        self._lock = threading.Lock()
+        self._names = set()
+        self._cond = threading.Condition() # แจ้งผู้อ่าน (streaming download) เมื่อมีข้อมูลใหม่
+        self.size = 0 # จำนวนไบต์ที่เขียนลงไฟล์เสร็จแล้ว
+        self.closed = False
+        self.aborted = False
+        # บีบอัดนอก lock ได้เฉพาะเมื่อ zipfile ของ Python ที่ใช้อยู่รองรับ write_precompressed_entry
+        self.parallel_compression = parallel_compression and precompressed_zip_supported()
+        self._stats = {} # สถิติการบีบอัดแยกตามนามสกุลไฟล์
+
+    def _publish(self):
+        # flush ลงไฟล์ก่อนแล้วจึงประกาศขนาดใหม่ให้ผู้อ่าน
+        self._raw.flush()
+        with self._cond:
+            self.size = self._raw.tell()
+            self._cond.notify_all()
+
+    @timed('zip_write')
+    def add(self, arcname, data):
+        """
+        เพิ่มไฟล์ (bytes) เข้า ZIP
+        Returns:
+        - bool: False หากมีไฟล์ชื่อเดียวกันอยู่แล้ว (เก็บไฟล์แรกไว้ ไม่เขียนซ้ำ)
+        """
+        compress_type, compresslevel = archive_compression_for(arcname)
+        started = time.perf_counter()
+
+        compressed = None
+        if compress_type == zipfile.ZIP_DEFLATED and self.parallel_compression:
+            # บีบอัดแบบ raw deflate (แบบเดียวกับที่ zipfile ใช้) นอก lock
+            compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+            compressed = compressor.compress(data) + compressor.flush()
+
+        with self._lock:
+            if arcname in self._names:
+                logger.warning(f"⚠️ ข้ามไฟล์ซ้ำใน ZIP: {arcname}")
+                return False
+            self._names.add(arcname)
+            offset = self._raw.tell()
+            if compressed is not None:
+                write_precompressed_entry(self._zip, self._raw, arcname, data, compressed)
+            else:
+                self._zip.writestr(arcname, data, compress_type=compress_type, compresslevel=compresslevel)
+            written = self._raw.tell() - offset
+            self._publish()
+
+        self._record_stats(arcname, compress_type, len(data), written, time.perf_counter() - started)
+        archive_bytes_total.inc(posixpath.splitext(arcname)[1].lower() or '(none)', amount=written)
+        return True
+
+    def _record_stats(self, arcname, compress_type, bytes_in, bytes_out, seconds):
+        extension = posixpath.splitext(arcname)[1].lower() or '(none)'
+        with self._cond:
+            stats = self._stats.setdefault(extension, {
+                'compression': 'deflated' if compress_type == zipfile.ZIP_DEFLATED else 'stored',
+                'entries': 0,
+                'bytes_in': 0,
+                'bytes_out': 0,
+                'seconds': 0.0,
+            })
+            stats['entries'] += 1
+            stats['bytes_in'] += bytes_in
+            stats['bytes_out'] += bytes_out # รวม local header ของแต่ละ entry
+            stats['seconds'] += seconds
+
+    def summary(self):
+        """สรุปเวลาที่ใช้และจำนวนไบต์ที่ประหยัดได้ แยกตามชนิดไฟล์ สำหรับแสดงในสถานะงาน"""
+        with self._cond:
+            return {
+                extension: dict(stats, seconds=round(stats['seconds'], 3), bytes_saved=stats['bytes_in'] - stats['bytes_out'])
+                for extension, stats in self._stats.items()
+            }
+
+    def close(self):
+        """เขียน central directory และปิดไฟล์ ZIP"""
+        with self._lock:
+            self._zip.close()
+            self._publish()
+            self._raw.close()
+            with self._cond:
+                self.closed = True
+                self._cond.notify_all()
+
+    def abort(self):
+        """ปิดไฟล์โดยไม่เขียน central directory (งานถูกยกเลิกหรือผิดพลาด) ผู้อ่านจะหยุดส่งข้อมูลทันที"""
+        with self._lock:
+            self._raw.close()
+            with self._cond:
+                self.closed = True
+                self.aborted = True
+                self._cond.notify_all()
+
+    def iter_bytes(self, chunk_size=64 * 1024, poll_seconds=1.0):
+        """
+        Generator สำหรับส่งไฟล์ ZIP แบบ streaming: ส่งทุกไบต์ที่เขียนเสร็จแล้ว และรอข้อมูลใหม่
+        จนกว่า ZIP จะถูกปิด (ส่ง central directory ปิดท้าย) หรือถูกยกเลิก
+        หาก ZIP ถูกยกเลิก (abort) จะ raise ReportStreamAborted เพื่อให้ server ตัดการเชื่อมต่อโดยไม่ส่ง chunk ปิดท้าย
+        เบราว์เซอร์จึงแสดงว่าดาวน์โหลดล้มเหลว แทนที่จะได้ไฟล์ ZIP ที่ขาด central directory
+        """
+        offset = 0
+        with open(self.path, 'rb') as f:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self.size > offset or self.closed, timeout=poll_seconds)
+                    size, closed, aborted = self.size, self.closed, self.aborted
+                if aborted:
+                    raise ReportStreamAborted(f"ZIP {os.path.basename(self.path)} ถูกยกเลิกระหว่างส่งแบบ streaming")
+                while offset < size:
+                    chunk = f.read(min(chunk_size, size - offset))
+                    if not chunk:
+                        break
+                    offset += len(chunk)
+                    yield chunk
+                if closed and offset >= size:
+                    return
+
+class FairQueue:
+    """
+    Queue ที่ใช้ร่วมกันหลายงาน แยกคิวย่อยตาม key (job_id) และจ่ายงานด้วย Deficit Round Robin (DRR)
+    - งานที่มีของรอผลัดกันได้รับเครดิตรอบละ `quantum` และจ่ายงานได้ตราบที่เครดิตพอกับต้นทุน (cost) ของชิ้นถัดไป
+      ต้นทุนคือจำนวนแถวของ Excel ในชิ้นงาน ทุกงานจึงได้ส่วนแบ่งตามจำนวนแถวเท่าๆ กัน ไม่ว่าจะมีงานค้างมากเท่าไร
+    - งานที่คิวย่อยว่างออกจากรอบและไม่สะสมเครดิตไว้ งานที่เข้ามาใหม่ต่อท้ายรอบพร้อมเครดิตหนึ่งรอบ
+    - งานที่อยู่ในรอบเพียงงานเดียวได้รับงานโดยไม่หักเครดิต (เครดิตเป็น 0) จึงไม่ติดหนี้ไว้จนเสียรอบเมื่อมีงานอื่นเข้ามา
+    คิวย่อยไม่จำกัดขนาด (ผู้ส่งงานจำกัดจำนวนงานค้างเอง ดู PipelineJob) get คืน (key, item, เวลาที่รอในคิวเป็นวินาที)
+    """
+    def __init__(self, quantum=1):
+        self.quantum = quantum
+        self._cond = threading.Condition()
+        self._active = OrderedDict() # key -> deque ของ (cost, item, เวลาที่เข้าคิว) เรียงตามลำดับของรอบ
+        self._deficit = {}
+
+    def put(self, key, item, cost=1):
+        with self._cond:
+            queue = self._active.get(key)
+            if queue is None:
+                queue = self._active[key] = deque()
+                self._deficit[key] = self.quantum
+            queue.append((cost, item, time.perf_counter()))
+            self._cond.notify()
+
+    def get(self):
+        with self._cond:
+            while not self._active:
+                self._cond.wait()
+            while True:
+                key, queue = next(iter(self._active.items()))
+                cost, item, enqueued = queue[0]
+                alone = len(self._active) == 1
+                if alone or self._deficit[key] >= cost:
+                    self._deficit[key] = 0 if alone else self._deficit[key] - cost
+                    queue.popleft()
+                    if not queue:
+                        del self._active[key]
+                        del self._deficit[key]
+                    return key, item, time.perf_counter() - enqueued
+                # เครดิตไม่พอ: ให้งานถัดไปในรอบ และสะสมเครดิตไว้ใช้รอบหน้า
+                self._deficit[key] += self.quantum
+                self._active.move_to_end(key)
+
+    def qsize(self, key=None):
+        with self._cond:
+            if key is not None:
+                return len(self._active.get(key, ()))
+            return sum(len(queue) for queue in self._active.values())
+
+class PipelineJob:
+    """
+    งานหนึ่งงานใน ReportPipeline: ผูก job_id กับ ZIP ของงาน (archive) และปลายทางของผลลัพธ์ (record(results, counters))
+    - จำกัดจำนวนวงจรของงานที่ค้างอยู่ใน pipeline ไว้ที่ max_in_flight (acquire บล็อกผู้ป้อนงานเมื่อครบ) หน่วยความจำต่องานจึงมีขอบเขต
+    - จำสถานะการยกเลิกไว้ (cancel) และอ่านจาก check_canceled ใหม่ไม่บ่อยกว่าทุก PIPELINE_CANCEL_CHECK_INTERVAL วินาที
+      Worker จึงไม่ต้องอ่านฐานข้อมูลทุกวงจร
+    - รวมตัวนับของงาน (count เช่น cache_hits) ไว้ในหน่วยความจำ แล้วส่งไปกับ record ครั้งถัดไป (take_counters)
+    - เก็บสถิติของงานในแต่ละ stage: เวลาที่รอในคิว (wait) และเวลาที่ Worker ใช้กับงานนี้ (busy)
+      share คือสัดส่วน busy_seconds ของงานนี้ต่อ busy_seconds ของ stage ทั้งหมดตั้งแต่งานเริ่ม (ใช้ปรับจำนวน Worker)
+    """
+    def __init__(self, job_id, archive, record, check_canceled, max_in_flight, stages):
+        self.job_id = job_id
+        self.archive = archive
+        self.record = record
+        self._check_canceled = check_canceled
+        self._canceled = False
+        self._canceled_checked_at = None # time.monotonic() ที่อ่าน check_canceled ครั้งล่าสุด
+        self._counters = {}
+        self._slots = threading.Semaphore(max(1, max_in_flight))
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._stage_busy_at_start = {stage.name: stage.busy_seconds for stage in stages}
+        self.stats = {stage.name: {'tasks': 0, 'rows': 0, 'busy': 0, 'busy_seconds': 0.0,
+                                   'wait_seconds': 0.0, 'max_wait_seconds': 0.0} for stage in stages}
+
+    def cancel(self):
+        self._canceled = True
+
+    def is_canceled(self):
+        if self._canceled:
+            return True
+        now = time.monotonic()
+        if self._canceled_checked_at is None or now - self._canceled_checked_at >= PIPELINE_CANCEL_CHECK_INTERVAL:
+            self._canceled_checked_at = now
+            self._canceled = bool(self._check_canceled())
+        return self._canceled
+
+    def count(self, name, amount=1):
+        with self._cond:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def take_counters(self):
+        """คืนตัวนับที่ยังไม่ได้บันทึกและเริ่มนับใหม่"""
+        with self._cond:
+            counters, self._counters = self._counters, {}
+        return counters
+
+    def acquire(self):
+        self._slots.acquire()
+        with self._cond:
+            self._in_flight += 1
+
+    def done(self):
+        """วงจรหนึ่งออกจาก pipeline แล้ว (บันทึกผลลัพธ์แล้วหรือถูกทิ้งเพราะงานถูกยกเลิก)"""
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+        self._slots.release()
+
+    def wait(self):
+        """รอจนทุกวงจรที่ป้อนเข้าไปออกจาก pipeline"""
+        with self._cond:
+            while self._in_flight:
+                self._cond.wait()
+
+    def task_started(self, stage_name, waited):
+        with self._cond:
+            stats = self.stats[stage_name]
+            stats['busy'] += 1
+            stats['wait_seconds'] += waited
+            stats['max_wait_seconds'] = max(stats['max_wait_seconds'], waited)
+
+    def task_finished(self, stage_name, rows, busy_seconds):
+        with self._cond:
+            stats = self.stats[stage_name]
+            stats['busy'] -= 1
+            stats['tasks'] += 1
+            stats['rows'] += rows
+            stats['busy_seconds'] += busy_seconds
+
+    def snapshot(self, stages):
+        with self._cond:
+            stats = {name: dict(values) for name, values in self.stats.items()}
+        for stage in stages:
+            stage_stats = stats[stage.name]
+            stage_busy = stage.busy_seconds - self._stage_busy_at_start[stage.name]
+            stage_stats['queued'] = stage.queue.qsize(self.job_id)
+            stage_stats['share'] = round(stage_stats['busy_seconds'] / stage_busy, 3) if stage_busy > 0 else None
+            stage_stats['avg_wait_seconds'] = round(stage_stats['wait_seconds'] / stage_stats['tasks'], 3) if stage_stats['tasks'] else None
+            for key in ('busy_seconds', 'wait_seconds', 'max_wait_seconds'):
+                stage_stats[key] = round(stage_stats[key], 3)
+        return stats
+
+class PipelineStage:
+    """
+    หนึ่งขั้นตอน (stage) ของ pipeline การสร้างรายงาน ใช้ร่วมกันทุกงานที่กำลังประมวลผล
+    Worker Thread จำนวน `workers` ดึงงานจาก FairQueue (สลับระหว่างงานแบบ DRR ตามจำนวนแถว) ไปประมวลผลด้วย
+    `handler(task, job)` แล้วส่งต่อผ่าน `emit(job, task)` ไปยัง stage ถัดไป
+    งานเล็กที่อัปโหลดทีหลังจึงได้ Worker สลับกับงานใหญ่ ไม่ต้องรอให้งานใหญ่ประมวลผลจนหมดก่อน
+
+    สถิติ (busy, processed, busy_seconds, emit_seconds) ใช้ดูว่า stage ไหนเป็นคอขวด:
+    stage ที่ busy เต็มทุก Worker และมีงานค้างในคิวมาก คือคอขวด
+    """
+    def __init__(self, name, handler, workers, emit):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue = FairQueue()
+        self.emit = emit
+        self._lock = threading.Lock()
+        self._threads = []
+        self.busy = 0 # จำนวน Worker ที่กำลังทำงาน
+        self.processed = 0 # จำนวนงานที่ผ่าน stage นี้แล้ว
+        self.busy_seconds = 0.0 # เวลารวมที่ใช้ใน handler
+        self.emit_seconds = 0.0 # เวลารวมที่ใช้ส่งงานต่อ (stage สุดท้าย: บันทึกผลลัพธ์ลง job_store)
+
+    def start(self, thread_name_prefix):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{thread_name_prefix}_{self.name}_{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, job, task):
+        self.queue.put(job.job_id, (job, task), cost=max(1, len(task['rows'])))
+
+    def _run(self):
+        while True:
+            job_id, (job, task), waited = self.queue.get()
+            bind_log_job(job_id) # log จาก Worker เป็นของงานที่กำลังประมวลผลอยู่
+            pipeline_wait_seconds.observe(waited, self.name)
+            if job.is_canceled():
+                job.done() # งานถูกยกเลิก: ทิ้งงานที่ค้างในคิวโดยไม่ประมวลผล
+                continue
+
+            with self._lock:
+                self.busy += 1
+            job.task_started(self.name, waited)
+            started = time.perf_counter()
+            try:
+                task = self.handler(task, job)
+            except Exception as e:
+                fail_task(task, e) # ข้อผิดพลาดที่ไม่คาดคิดไม่หยุด Worker ที่ใช้ร่วมกันทุกงาน
+            finally:
+                busy_seconds = time.perf_counter() - started
+                job.task_finished(self.name, len(task['rows']), busy_seconds)
+                with self._lock:
+                    self.busy -= 1
+                    self.processed += 1
+                    self.busy_seconds += busy_seconds
+
+            started = time.perf_counter()
+            self.emit(job, task)
+            with self._lock:
+                self.emit_seconds += time.perf_counter() - started
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queued': self.queue.qsize(),
+                'busy': self.busy,
+                'processed': self.processed,
+                'busy_seconds': round(self.busy_seconds, 3),
+                'emit_seconds': round(self.emit_seconds, 3),
+            }
+
+def read_row_task(index, row):
+    """
+    แปลงแถวจาก Excel เป็น dict ของแถว (ปลายทางของไฟล์ CSV/PDF)
+    หาก NodeID หรือ Interface ID ไม่สมบูรณ์ จะใส่ 'result' ไว้เลยเพื่อข้ามการประมวลผล
+    """
+    task = {
+        'index': index,
+        'nod_id': str(row['NodeID']).strip(), # Node ID
+        'itf_id': str(row['Interface ID']).strip(), # Interface ID
+        # ข้อมูลสำหรับสร้างโครงสร้างโฟลเดอร์
+        'folders': [
+            str(row['กระทรวง / สังกัด']).strip(),
+            str(row['กรม / สังกัด']).strip(),
+            str(row['จังหวัด']).strip(),
+            str(row['ชื่อหน่วยงาน']).strip(),
+        ],
+        'node_name': str(row['Node Name']).strip(), # ชื่อ Node สำหรับการ logging และชื่อไฟล์
+        'result': None,
+    }
+    if not task['nod_id'] or not task['itf_id']:
+        error_message = "ข้อมูล NodeID หรือ Interface ID ไม่สมบูรณ์"
+        logger.warning(f"⚠️ ข้ามแถวที่ {index + 1} เนื่องจาก {error_message} (NodeID: '{task['nod_id']}', ITF ID: '{task['itf_id']}')")
+        task['result'] = row_result(task, error_message=error_message)
+    return task
+
+def group_circuit_tasks(df):
+    """
+    อ่านทุกแถวของ DataFrame แล้วรวมแถวที่มี NodeID/Interface ID เดียวกันเป็นงานเดียว (เรียงตามแถวแรกที่พบ)
+    เพื่อให้ดึงข้อมูลจาก API และประมวลผลเพียงครั้งเดียวต่อวงจร แม้วงจรจะอยู่หลายแถวด้วย Node Name หรือโฟลเดอร์ต่างกัน
+
+    Returns:
+    - tuple: (circuit_tasks, skipped_results)
+        - circuit_tasks (list): งานต่อวงจร {'index', 'nod_id', 'itf_id', 'rows', 'results'}
+        - skipped_results (list): ผลลัพธ์ของแถวที่ข้ามไป (ข้อมูลไม่สมบูรณ์หรืออ่านไม่ได้)
+    """
+    circuits = {}
+    skipped_results = []
+    for index, row in df.iterrows():
+        try:
+            row_task = read_row_task(index, row)
+        except Exception as e:
+            row_task = {'index': index, 'node_name': '', 'result': None}
+            row_task['result'] = fail_row(row_task, e)
+        if row_task['result'] is not None:
+            skipped_results.append(row_task['result'])
+            continue
+
+        key = (row_task['nod_id'], row_task['itf_id'])
+        if key not in circuits:
+            circuits[key] = {'index': index, 'nod_id': key[0], 'itf_id': key[1], 'rows': [], 'results': None}
+        circuits[key]['rows'].append(row_task)
+    return list(circuits.values()), skipped_results
+
+def row_result(task, csv_success=False, pdf_success=False, error_message=None):
+    """สร้าง dict ผลลัพธ์ของแถวสำหรับเก็บในผลลัพธ์ของงาน (get_job_store().append_results)"""
+    return {
+        'node_name': task['node_name'],
+        'csv_success': csv_success,
+        'pdf_success': pdf_success,
+        'error_message': error_message
+    }
+
+def fetch_stage(task, job):
+    """Stage 1: ดึงข้อมูลดิบของวงจรจาก API (รอ network เป็นหลัก)"""
+    try:
+        row_numbers = ", ".join(str(row['index'] + 1) for row in task['rows'])
+        logger.info(f"▶ กำลังประมวลผล NodeID: {task['nod_id']}, Interface ID: {task['itf_id']} (แถวที่ {row_numbers})")
+        task['raw_json_data'] = fetch_circuit_data(task['nod_id'], task['itf_id'], job) # ดึงข้อมูลจาก cache หรือ API
+        if not task['raw_json_data']:
+            error_message = f"ไม่สามารถดึงข้อมูลจาก API ได้สำหรับ NodeID: {task['nod_id']}, Interface ID: {task['itf_id']}"
+            logger.error(f"❌ {error_message}")
+            task['results'] = [row_result(row, error_message=error_message) for row in task['rows']]
+    except Exception as e:
+        fail_task(task, e)
+    return task
+
+def transform_stage(task, job_id):
+    """Stage 2: จัดรูปข้อมูล JSON ให้อยู่ในรูปแบบตารางรายชั่วโมง (ใช้ CPU)"""
+    try:
+        raw_json_data = task.pop('raw_json_data')
+        # ชื่อหน่วยงานจาก Excel เป็นค่าเริ่มต้นของคอลัมน์ 'ชื่อหน่วยงาน' จึงสร้างรายงานหนึ่งฉบับต่อชื่อหน่วยงาน
+        task['reports'] = {}
+        for row in task['rows']:
+            agency_name = row['folders'][3]
+            if agency_name not in task['reports']:
+                # ประมวลผลข้อมูล JSON เพื่อให้พร้อมสำหรับ CSV/PDF
+                task['reports'][agency_name] = process_json_data(raw_json_data, job_id, task['nod_id'], agency_name)
+    except Exception as e:
+        fail_task(task, e)
+    return task
+
+def render_report_files(report, job_id, node_name):
+    """
+    สร้างไฟล์ CSV และ PDF ของรายงานในหน่วยความจำ
+    Returns:
+    - tuple: (csv_bytes, pdf_bytes) โดยไฟล์ที่สร้างไม่สำเร็จเป็น None
+    """
+    csv_buffer = io.StringIO(newline='')
+    csv_success, csv_msg = export_to_csv(report, csv_buffer, job_id, node_name)
+
+    pdf_buffer = io.BytesIO()
+    render_pdf = export_to_pdf_in_process if PDF_PROCESS_WORKERS > 0 else export_to_pdf
+    pdf_success, pdf_msg = render_pdf(report, pdf_buffer, job_id, node_name)
+
+    return (
+        csv_buffer.getvalue().encode('utf-8-sig') if csv_success else None,
+        pdf_buffer.getvalue() if pdf_success else None,
+    )
+
+def render_stage(task, job_id, archive):
+    """
+    Stage 3: สร้างไฟล์ CSV และ PDF ของวงจรในหน่วยความจำ แล้วเพิ่มเข้า ZIP ของงานทันที (ใช้ CPU)
+    สร้างไฟล์ครั้งเดียวต่อรายงาน แล้วเพิ่มเข้า ZIP ตามปลายทางของทุกแถวที่ใช้รายงานนั้น
+    """
+    results = []
+    rendered = {} # ชื่อหน่วยงาน -> (csv_bytes, pdf_bytes)
+    for row in task['rows']:
+        csv_success = False # สถานะการสร้าง CSV
+        pdf_success = False # สถานะการสร้าง PDF
+        try:
+            node_name = row['node_name']
+
+            # ทำความสะอาด Node Name เพื่อใช้เป็นชื่อไฟล์ (ลบอักขระที่ไม่ถูกต้องสำหรับชื่อไฟล์)
+            sanitized_node_name = re.sub(r'[\\/:*?"<>|]', '_', node_name)
+            filename_base = f"{sanitized_node_name}"
+
+            # Path ภายใน ZIP ของ CSV และ PDF ของ Node/Interface ปัจจุบัน (CSV/กระทรวง/กรม/จังหวัด/หน่วยงาน/...)
+            csv_arcname = posixpath.join('CSV', *row['folders'], f"{filename_base}.csv")
+            pdf_arcname = posixpath.join('PDF', *row['folders'], f"{filename_base}.pdf")
+
+            agency_name = row['folders'][3]
+            if agency_name in rendered:
+                logger.info(f"♻️ ใช้ไฟล์ CSV/PDF ที่สร้างแล้วของวงจรเดียวกันสำหรับ '{node_name}'")
+            else:
+                rendered[agency_name] = render_report_files(task['reports'][agency_name], job_id, node_name)
+            csv_bytes, pdf_bytes = rendered[agency_name]
+
+            # เพิ่มไฟล์ที่สร้างสำเร็จเข้า ZIP
+            if csv_bytes is not None:
+                csv_success = True
+                archive.add(csv_arcname, csv_bytes)
+            if pdf_bytes is not None:
+                pdf_success = True
+                archive.add(pdf_arcname, pdf_bytes)
+            results.append(row_result(row, csv_success, pdf_success))
+        except Exception as e:
+            results.append(fail_row(row, e, csv_success, pdf_success))
+    task['results'] = results
+    return task
+
+def fail_row(row, e, csv_success=False, pdf_success=False):
+    # ดักจับข้อผิดพลาดที่ไม่คาดคิดในการประมวลผลแต่ละแถว
+    error_message = f"เกิดข้อผิดพลาดที่ไม่คาดคิดในแถวที่ {row['index'] + 1}: {e}"
+    logger.error(f"❌ {error_message}")
+    return row_result(row, csv_success, pdf_success, error_message)
+
+def fail_task(task, e):
+    # ข้อผิดพลาดระหว่างดึงหรือประมวลผลข้อมูลของวงจร: ทุกแถวของวงจรล้มเหลวด้วยข้อผิดพลาดเดียวกัน
+    task['results'] = [fail_row(row, e) for row in task['rows']]
+
+class ReportPipeline:
+    """
+    pipeline 3 stage ที่ใช้ร่วมกันทุกงานใน process: fetch -> transform -> render
+    แต่ละ stage มี Worker ชุดเดียว (FETCH_WORKERS / TRANSFORM_WORKERS / RENDER_WORKERS) ที่สลับทำงานของทุกงานอย่างเป็นธรรม
+    งานที่มี 'results' แล้ว (สำเร็จหรือล้มเหลว) จบที่ stage นั้น ที่เหลือส่งต่อให้ stage ถัดไป
+    """
+    def __init__(self, fetch_workers, transform_workers, render_workers, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.render = PipelineStage('render', lambda task, job: render_stage(task, job.job_id, job.archive),
+                                    render_workers, self._emit_to(None))
+        self.transform = PipelineStage('transform', lambda task, job: transform_stage(task, job.job_id),
+                                       transform_workers, self._emit_to(self.render))
+        self.fetch = PipelineStage('fetch', fetch_stage,
+                                   fetch_workers, self._emit_to(self.transform))
+        self.stages = [self.fetch, self.transform, self.render]
+        for stage in self.stages:
+            stage.start('pipeline')
+
+    @staticmethod
+    def _emit_to(next_stage):
+        def emit(job, task):
+            if task['results'] is None and next_stage is not None:
+                next_stage.put(job, task)
+                return
+            try:
+                job.record(task['results'], job.take_counters())
+            except Exception as e:
+                logger.error(f"❌ บันทึกผลลัพธ์ไม่สำเร็จ: {e}")
+            finally:
+                job.done()
+        return emit
+
+    def register(self, job_id, archive, record, check_canceled):
+        return PipelineJob(job_id, archive, record, check_canceled, self.max_in_flight, self.stages)
+
+    def submit(self, job, task):
+        """ป้อนวงจรเข้า stage แรก (บล็อกเมื่องานมีวงจรค้างใน pipeline ครบ max_in_flight)"""
+        job.acquire()
+        self.fetch.put(job, task)
+
+    def job_snapshot(self, job):
+        """สถิติของงานในแต่ละ stage: tasks, rows, queued, busy, busy_seconds, share และเวลารอในคิว"""
+        return job.snapshot(self.stages)
+
+    def snapshot(self):
+        return {stage.name: stage.snapshot() for stage in self.stages}
+
+report_pipeline = None # ReportPipeline ที่ใช้ร่วมกันทุกงาน (สร้างเมื่อมีงานแรก)
+report_pipeline_lock = threading.Lock()
+
+def get_report_pipeline():
+    """คืนค่า ReportPipeline ที่ใช้ร่วมกันทุกงาน (สร้างและเริ่ม Worker ครั้งแรกเมื่อถูกเรียก)"""
+    global report_pipeline
+    with report_pipeline_lock:
+        if report_pipeline is None:
+            report_pipeline = ReportPipeline(FETCH_WORKERS, TRANSFORM_WORKERS, RENDER_WORKERS, PIPELINE_MAX_IN_FLIGHT)
+        return report_pipeline
+
+def run_report_pipeline(df, job_id, archive):
+    """
+    ประมวลผลทุกแถวของ DataFrame ผ่าน ReportPipeline ที่ใช้ร่วมกันทุกงาน:
+    fetch (FETCH_WORKERS) -> transform (TRANSFORM_WORKERS) -> render (RENDER_WORKERS)
+    Worker ของแต่ละ stage สลับทำงานของทุกงานที่กำลังประมวลผลแบบ DRR (ดู FairQueue) และบันทึกผลลัพธ์ตามลำดับที่ทำเสร็จ
+    งานใน pipeline คือวงจร (แถวที่มี NodeID/Interface ID ซ้ำกันถูกรวมไว้ด้วยกัน) แต่ผลลัพธ์ยังบันทึกแยกทีละแถว
+    ไฟล์ CSV/PDF ของแต่ละแถวถูกเพิ่มเข้า `archive` (ReportArchive) ทันทีที่สร้างเสร็จ
+    """
+    def check_canceled():
+        return get_job_store().is_canceled(job_id)
+
+    def record_results(results, counters=None):
+        # อัปเดตสถานะของแถวที่ประมวลผลไปแล้ว (และตัวนับของ cache ใน transaction เดียวกัน)
+        results_offset = get_job_store().append_results(job_id, results, counters)
+        push_job_progress(job_id, results, results_offset)
+        for result in results:
+            rows_total.inc('failed' if result['error_message'] else 'success')
+
+    # รวมแถวที่ซ้ำวงจรกันก่อนเริ่ม pipeline (จำนวนการเรียก API ที่ประหยัดได้ = จำนวนแถวที่ซ้ำ)
+    circuit_tasks, skipped_results = group_circuit_tasks(df)
+    record_results(skipped_results)
+    upstream_calls_saved = sum(len(task['rows']) - 1 for task in circuit_tasks)
+    get_job_store().update(job_id, upstream_calls_saved=upstream_calls_saved)
+    if upstream_calls_saved:
+        logger.info(f"🔁 พบแถวที่ใช้วงจรซ้ำกัน {upstream_calls_saved} แถว จะดึงข้อมูลวงจรละครั้งเดียว ({len(circuit_tasks)} วงจร)")
+
+    pipeline = get_report_pipeline()
+    job = pipeline.register(job_id, archive, record_results, check_canceled)
+    with status_lock:
+        active_pipelines[job_id] = job
+    try:
+        # ป้อนวงจรเข้า stage แรก (บล็อกเมื่องานมีวงจรค้างใน pipeline ครบ จึงไม่ส่งงานล่วงหน้าเกินจำเป็น)
+        for task in circuit_tasks:
+            if job.is_canceled(): # ตรวจสอบว่างานถูกยกเลิกหรือไม่
+                logger.info(f"⛔ งานถูกยกเลิกโดยผู้ใช้")
+                break # หยุดป้อนงานใหม่ถ้าถูกยกเลิก
+            pipeline.submit(job, task)
+
+        # รอให้วงจรที่ป้อนไปแล้วไหลผ่านจนครบ
+        job.wait()
+    finally:
+        with status_lock:
+            active_pipelines.pop(job_id, None)
+        counters = job.take_counters() # ตัวนับของวงจรที่ถูกทิ้งเพราะงานถูกยกเลิก
+        if counters:
+            get_job_store().increment(job_id, **counters)
+        get_job_store().update(job_id, pipeline=pipeline.job_snapshot(job))
+
 def process_file_in_background(file_stream, job_id):
     """
     ฟังก์ชันนี้จะทำงานในอีก Thread หนึ่ง (background process)
     โดยจะรับ file_stream (ข้อมูลไฟล์ Excel) และ job_id มาประมวลผล
-    อ่านไฟล์ Excel, ดึงข้อมูลจาก API, ประมวลผล, และสร้างไฟล์ CSV/PDF
-    จากนั้นจะ Zip ไฟล์ทั้งหมดและอัปเดตสถานะของงาน
+    อ่านไฟล์ Excel, ดึงข้อมูลจาก API, ประมวลผล, และสร้างไฟล์ CSV/PDF ลงในไฟล์ ZIP ของงาน
+    จากนั้นจะอัปเดตสถานะของงาน
+
+    แต่ละแถวถูกประมวลผลผ่าน run_report_pipeline ซึ่งแยกการดึงข้อมูล, การจัดรูปข้อมูล
+    และการสร้างไฟล์ออกเป็น stage ที่ทำงานซ้อนกัน และบันทึกผลลัพธ์ตามลำดับที่ทำเสร็จ
     """
-    temp_dir = None # ตัวแปรสำหรับเก็บ path ของโฟลเดอร์ชั่วคราว
+    bind_log_job(job_id) # log ทั้งหมดใน Thread นี้เป็นของงานนี้
+    temp_dir = None # ตัวแปรสำหรับเก็บ path ของโฟลเดอร์ชั่วคราว (เก็บเฉพาะไฟล์ ZIP)
     try:
-        df = pd.read_excel(file_stream) # อ่านไฟล์ Excel ด้วย Pandas
+        with time_operation('read_excel'):
+            df = pd.read_excel(file_stream) # อ่านไฟล์ Excel ด้วย Pandas
         total_rows = len(df) # จำนวนแถวทั้งหมดใน Excel
 
-        # อัปเดตสถานะงาน (thread-safe)
-        with status_lock:
-            processing_status[job_id]['total'] = total_rows
-            processing_status[job_id]['results'] = [] # เก็บผลลัพธ์ของแต่ละ Node/Interface
-            temp_dir = tempfile.mkdtemp(prefix=f"report_job_{job_id}_") # สร้างโฟลเดอร์ชั่วคราว
-            processing_status[job_id]['temp_dir'] = temp_dir # เก็บ path โฟลเดอร์ชั่วคราวไว้ในสถานะงาน
+        # อัปเดตสถานะงาน
+        temp_dir = tempfile.mkdtemp(prefix=f"report_job_{job_id}_") # สร้างโฟลเดอร์ชั่วคราว
+        get_job_store().update(job_id, total=total_rows, temp_dir=temp_dir) # เก็บ path โฟลเดอร์ชั่วคราวไว้ในสถานะงาน
+        push_job_progress(job_id)
 
         logger.info(f"📊 เริ่มประมวลผลไฟล์ Excel มีทั้งหมด {total_rows} รายการ")
 
@@ -715,148 +2989,244 @@ def process_file_in_background(file_stream, job_id):
         required_columns = ['NodeID', 'Interface ID', 'กระทรวง / สังกัด', 'กรม / สังกัด', 'จังหวัด', 'ชื่อหน่วยงาน', 'Node Name']
         if not all(col in df.columns for col in required_columns):
             missing_cols = [c for c in required_columns if c not in df.columns]
-            with status_lock:
-                processing_status[job_id]['error'] = f"ไฟล์ Excel ขาดคอลัมน์ที่จำเป็น: {', '.join(missing_cols)}"
-                processing_status[job_id]['completed'] = True # ตั้งสถานะเป็นเสร็จสมบูรณ์แต่มี error
-            logger.error(f"❌ {processing_status[job_id]['error']}")
+            error = f"ไฟล์ Excel ขาดคอลัมน์ที่จำเป็น: {', '.join(missing_cols)}"
+            get_job_store().update(job_id, state='failed', error=error, completed=True) # ตั้งสถานะเป็นเสร็จสมบูรณ์แต่มี error
+            logger.error(f"❌ {error}")
+            push_job_progress(job_id)
             return # หยุดการทำงานของ Thread นี้
 
-        # สร้างโครงสร้างโฟลเดอร์สำหรับเก็บ CSV และ PDF ชั่วคราว
-        csv_root_dir = os.path.join(temp_dir, 'CSV')
-        pdf_root_dir = os.path.join(temp_dir, 'PDF')
-        os.makedirs(csv_root_dir, exist_ok=True) # สร้างถ้ายังไม่มี
-        os.makedirs(pdf_root_dir, exist_ok=True)
+        # กำหนดชื่อไฟล์สำหรับดาวน์โหลด
+        today_date = datetime.datetime.now().strftime('%Y%m%d')
+        download_name = f"{today_date}_SummaryReportbyHour.zip" # แก้ไขการตั้งชื่อไฟล์
+        zip_filename_path = os.path.join(temp_dir, download_name)
 
-        # วนลูปประมวลผลแต่ละแถวใน DataFrame (แต่ละ Node/Interface)
-        for index, row in df.iterrows():
-            with status_lock:
-                if processing_status[job_id].get('canceled'): # ตรวจสอบว่างานถูกยกเลิกหรือไม่
-                    logger.info(f"⛔ งานถูกยกเลิกโดยผู้ใช้")
-                    break # ออกจากลูปถ้าถูกยกเลิก
+        # เปิดไฟล์ ZIP ไว้ตั้งแต่ต้น แล้วเพิ่มไฟล์ CSV/PDF ของแต่ละแถวเข้าไปทันทีที่สร้างเสร็จ
+        # (ลงทะเบียนใน active_archives เพื่อให้ /stream_report ส่งไฟล์ให้ client ได้ระหว่างประมวลผล)
+        archive = ReportArchive(zip_filename_path, parallel_compression=ARCHIVE_PARALLEL_COMPRESSION)
+        with status_lock:
+            active_archives[job_id] = archive
+        get_job_store().update(job_id, download_name=download_name)  # ชื่อไฟล์สำหรับดาวน์โหลด
+        try:
+            # ประมวลผลทุกแถวผ่าน pipeline fetch -> transform -> render
+            run_report_pipeline(df, job_id, archive)
 
-            node_name = '' # ชื่อ Node สำหรับการ logging และชื่อไฟล์
-            csv_success = False # สถานะการสร้าง CSV
-            pdf_success = False # สถานะการสร้าง PDF
-            error_message = None # ข้อความ error หากมี
+            canceled = get_job_store().is_canceled(job_id)
+            if canceled:
+                archive.abort()
+            else:
+                archive.close()
+        except Exception:
+            archive.abort()
+            raise
+        finally:
+            with status_lock:
+                active_archives.pop(job_id, None)
+            get_job_store().update(job_id, archive=archive.summary()) # สถิติการบีบอัดแยกตามชนิดไฟล์
 
+        # หากงานถูกยกเลิก ให้ลบไฟล์ ZIP ที่ยังไม่สมบูรณ์ทิ้ง
+        if canceled:
+            get_job_store().update(job_id, state='canceled')
+            push_job_progress(job_id)
             try:
-                nod_id = str(row['NodeID']).strip() # Node ID
-                itf_id = str(row['Interface ID']).strip() # Interface ID
-
-                # ข้อมูลสำหรับสร้างโครงสร้างโฟลเดอร์
-                folder1 = str(row['กระทรวง / สังกัด']).strip()
-                folder2 = str(row['กรม / สังกัด']).strip()
-                folder3 = str(row['จังหวัด']).strip()
-                folder4 = str(row['ชื่อหน่วยงาน']).strip()
-                node_name = str(row['Node Name']).strip()
-
-                if not nod_id or not itf_id:
-                    error_message = "ข้อมูล NodeID หรือ Interface ID ไม่สมบูรณ์"
-                    logger.warning(f"⚠️ ข้ามแถวที่ {index + 1} เนื่องจาก {error_message} (NodeID: '{nod_id}', ITF ID: '{itf_id}')")
-                    with status_lock:
-                        processing_status[job_id]['processed'] += 1 # เพิ่มจำนวนที่ประมวลผลแล้ว
-                        processing_status[job_id]['results'].append({ # บันทึกผลลัพธ์ของแถวนี้
-                            'node_name': node_name,
-                            'csv_success': False,
-                            'pdf_success': False,
-                            'error_message': error_message
-                        })
-                    continue # ข้ามไปยังแถวถัดไป
-
-                logger.info(f"▶ กำลังประมวลผล NodeID: {nod_id}, Interface ID: {itf_id} (แถวที่ {index + 1})")
-
-                # กำหนด Path ของโฟลเดอร์สำหรับ CSV และ PDF ของ Node/Interface ปัจจุบัน
-                current_csv_dir = os.path.join(csv_root_dir, folder1, folder2, folder3, folder4)
-                current_pdf_dir = os.path.join(pdf_root_dir, folder1, folder2, folder3, folder4)
-
-                os.makedirs(current_csv_dir, exist_ok=True)
-                os.makedirs(current_pdf_dir, exist_ok=True)
-
-                raw_json_data = get_data_from_api(nod_id, itf_id, job_id) # ดึงข้อมูลจาก API
-
-                if raw_json_data:
-                    # ประมวลผลข้อมูล JSON เพื่อให้พร้อมสำหรับ CSV/PDF
-                    headers, processed_daily_data, grand_total_row_data = process_json_data(raw_json_data, job_id, nod_id, folder4)
-
-                    # ทำความสะอาด Node Name เพื่อใช้เป็นชื่อไฟล์ (ลบอักขระที่ไม่ถูกต้องสำหรับชื่อไฟล์)
-                    sanitized_node_name = re.sub(r'[\\/:*?"<>|]', '_', node_name)
-                    filename_base = f"{sanitized_node_name}"
-
-                    csv_filename = os.path.join(current_csv_dir, f"{filename_base}.csv")
-                    pdf_filename = os.path.join(current_pdf_dir, f"{filename_base}.pdf")
-
-                    # สำหรับ CSV: ข้อมูลที่ประมวลผลแล้ว + แถว Grand Total
-                    csv_data_to_write = list(processed_daily_data) # สร้างสำเนา
-                    if grand_total_row_data:
-                        csv_data_to_write.append(grand_total_row_data)
-
-                    # สร้างไฟล์ CSV และ PDF
-                    csv_success, csv_msg = export_to_csv(headers, csv_data_to_write, csv_filename, job_id, node_name)
-                    pdf_success, pdf_msg = export_to_pdf(headers, processed_daily_data, grand_total_row_data, pdf_filename, job_id, node_name)
-                else:
-                    error_message = f"ไม่สามารถดึงข้อมูลจาก API ได้สำหรับ NodeID: {nod_id}, Interface ID: {itf_id}"
-                    logger.error(f"❌ {error_message}")
+                os.remove(zip_filename_path)
+            except OSError as e:
+                logger.warning(f"⚠️ ลบไฟล์ ZIP ของงานที่ถูกยกเลิกไม่สำเร็จ: {e}")
+            return
 
-            except Exception as e:
-                # ดักจับข้อผิดพลาดที่ไม่คาดคิดในการประมวลผลแต่ละแถว
-                error_message = f"เกิดข้อผิดพลาดที่ไม่คาดคิดในแถวที่ {index + 1}: {e}"
-                logger.error(f"❌ {error_message}")
+        if not get_job_store().update(job_id, state='completed', zip_file_path=zip_filename_path, completed=True):
+            logger.error(f"Job {job_id} not found in status list.")
+            return False, "Job not found"
+        push_job_progress(job_id)
 
-            finally:
-                # อัปเดตสถานะของแถวที่ประมวลผลไปแล้ว
-                with status_lock:
-                    processing_status[job_id]['processed'] += 1
-                    processing_status[job_id]['results'].append({
-                        'node_name': node_name,
-                        'csv_success': csv_success,
-                        'pdf_success': pdf_success,
-                        'error_message': error_message
-                    })
-
-        # หากงานไม่ถูกยกเลิกหลังจากประมวลผลทุกแถวแล้ว ให้สร้างไฟล์ ZIP
-        if not processing_status[job_id].get('canceled'):
-            # กำหนดชื่อไฟล์สำหรับดาวน์โหลด
-            today_date = datetime.datetime.now().strftime('%Y%m%d')
-            download_name = f"{today_date}_SummaryReportbyHour.zip" # แก้ไขการตั้งชื่อไฟล์
-            zip_filename_path = os.path.join(temp_dir, download_name)
-
-            if temp_dir and os.path.exists(temp_dir):
-                # สร้างไฟล์ ZIP จากเนื้อหาในโฟลเดอร์ชั่วคราว (CSV และ PDF)
-                with zipfile.ZipFile(zip_filename_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    for root, _, files in os.walk(temp_dir):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            # เพิ่มเงื่อนไขเพื่อไม่ให้บีบอัดไฟล์ ZIP ที่กำลังสร้างอยู่
-                            if file_path != zip_filename_path: 
-                                arcname = os.path.relpath(file_path, temp_dir)
-                                zipf.write(file_path, arcname)
-
-                with status_lock:
-                    status = processing_status.get(job_id)
-                    if status:
-                        status['zip_file_path'] = zip_filename_path
-                        status['download_name'] = download_name  # อัปเดตชื่อไฟล์สำหรับดาวน์โหลด
-                        status['completed'] = True
-                    else:
-                        logger.error(f"Job {job_id} not found in status list.")
-                        return False, "Job not found"
-
-                return True, "รายงานสร้างและบีบอัดสำเร็จแล้ว"
+        return True, "รายงานสร้างและบีบอัดสำเร็จแล้ว"
 
     except Exception as e:
         # ดักจับข้อผิดพลาดระดับสูงที่เกิดขึ้นใน process_file_in_background ทั้งหมด
-        with status_lock:
-            processing_status[job_id]['error'] = f"เกิดข้อผิดพลาดในระหว่างการประมวลผลเบื้องหลัง: {e}"
-            processing_status[job_id]['completed'] = True
-        logger.critical(f"❌ {processing_status[job_id]['error']}")
+        error = f"เกิดข้อผิดพลาดในระหว่างการประมวลผลเบื้องหลัง: {e}"
+        get_job_store().update(job_id, state='failed', error=error, completed=True)
+        logger.critical(f"❌ {error}")
+        push_job_progress(job_id)
+
+
+@metrics_registry.collector
+def collect_job_metrics():
+    """จำนวนงาน, งานที่ค้างใน Queue และ Worker ที่กำลังทำงานของแต่ละ stage (รวมทุกงาน) ณ เวลาที่ถูกเรียก"""
+    active_jobs = get_job_store().count('running')
+    scheduler = get_job_scheduler().snapshot()
+    with status_lock:
+        archive_bytes = sum(archive.size for archive in active_archives.values())
+    stages = report_pipeline.snapshot() if report_pipeline is not None else {}
+    queued = {name: stage['queued'] for name, stage in stages.items()}
+    busy = {name: stage['busy'] for name, stage in stages.items()}
+    return [
+        ('summary_report_active_jobs', 'gauge', 'Jobs that are still running.', [({}, active_jobs)]),
+        ('summary_report_queued_jobs', 'gauge', 'Jobs waiting in the job queue of this process.', [({}, scheduler['queued'])]),
+        ('summary_report_rejected_jobs_total', 'counter', 'Uploads rejected because the job queue was full.', [({}, scheduler['rejected'])]),
+        ('summary_report_pipeline_queued', 'gauge', 'Tasks waiting in each pipeline stage queue.',
+         [({'stage': name}, value) for name, value in queued.items()]),
+        ('summary_report_pipeline_busy_workers', 'gauge', 'Workers currently running in each pipeline stage.',
+         [({'stage': name}, value) for name, value in busy.items()]),
+        ('summary_report_archive_in_progress_bytes', 'gauge', 'Bytes written so far to ZIP files of running jobs.',
+         [({}, archive_bytes)]),
+    ]
+
+@metrics_registry.collector
+def collect_upstream_metrics():
+    """สถิติของ solarwinds_client: จำนวนคำขอ/การลองใหม่, concurrency limit และสถานะ circuit breaker"""
+    snapshot = solarwinds_client.snapshot()
+    limiter = snapshot['limiter']
+    breaker = snapshot['breaker']
+    return [
+        ('summary_report_upstream_requests_total', 'counter', 'SOAP requests sent to SolarWinds, including retries.',
+         [({}, snapshot['requests'])]),
+        ('summary_report_upstream_retries_total', 'counter', 'SOAP requests retried after a transient error.',
+         [({}, snapshot['retries'])]),
+        ('summary_report_upstream_retry_budget_exhausted_total', 'counter', 'Retries skipped because the retry budget was exhausted.',
+         [({}, snapshot['retry_budget_exhausted'])]),
+        ('summary_report_upstream_rejected_by_breaker_total', 'counter', 'SOAP requests rejected by the open circuit breaker.',
+         [({}, snapshot['rejected_by_breaker'])]),
+        ('summary_report_upstream_concurrency_limit', 'gauge', 'Current adaptive concurrency limit.',
+         [({}, limiter['limit'])]),
+        ('summary_report_upstream_in_flight', 'gauge', 'SOAP requests currently in flight.',
+         [({}, limiter['in_flight'])]),
+        ('summary_report_upstream_breaker_state', 'gauge', 'Circuit breaker state (1 for the current state).',
+         [({'state': state}, int(state == breaker['state'])) for state in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)]),
+    ]
+
+
+# --- Socket.IO: push ความคืบหน้า ผลลัพธ์รายแถว และ log ไปยังหน้าเว็บ ---
+# ค่าในสถานะงานที่ส่งให้หน้าเว็บ (push ส่งเฉพาะค่าที่เปลี่ยนจากครั้งก่อน)
+PROGRESS_FIELDS = ('state', 'queue_position', 'total', 'processed', 'completed', 'error', 'canceled', 'zip_file_path')
+# ค่าสรุป (job_progress_summary) ล่าสุดที่ส่งไปแล้วของแต่ละงาน
+pushed_progress = {}
+# cursor ของ log ที่ log_pusher ส่งไปแล้วของแต่ละงาน (เฉพาะงานที่ยังไม่จบและมี client subscribe อยู่)
+pushed_log_cursor = {}
+# สถานะของงานที่จบแล้ว (ไม่มีความคืบหน้าหรือ log ใหม่อีก)
+FINISHED_STATES = ('completed', 'failed', 'canceled')
+# sid ของ client ที่ subscribe อยู่ -> job_id (log_pusher ทำงานเฉพาะเมื่อมี client)
+socket_subscribers = {}
+socket_subscribers_lock = threading.Lock()
+log_pusher_running = False
+
+def job_progress_summary(status):
+    """
+    ค่าสรุปความคืบหน้าของงานจากสถานะใน job_store: ค่าใน PROGRESS_FIELDS
+    อัตราการประมวลผล (rate_per_minute, แถว/นาที) และเวลาที่คาดว่าจะเสร็จ (eta_seconds)
+    คำนวณจากเวลาที่มีความคืบหน้าล่าสุดแทนเวลาปัจจุบัน ค่าจึงไม่เปลี่ยนระหว่างที่ไม่มีแถวใหม่ (ETag ของ /status คงเดิม)
+    """
+    summary = {key: status.get(key) for key in PROGRESS_FIELDS}
+    summary['rate_per_minute'] = None
+    summary['eta_seconds'] = None
+    started = status.get('timestamp')
+    elapsed = (status.get('updated_at', started) - started).total_seconds() if started else 0
+    if status.get('processed') and elapsed > 0:
+        rate = status['processed'] / elapsed
+        summary['rate_per_minute'] = round(rate * 60, 1)
+        if not status.get('completed') and status.get('total', 0) > 0:
+            summary['eta_seconds'] = round(max(0, status['total'] - status['processed']) / rate)
+    return summary
+
+def push_job_progress(job_id, results=None, results_offset=0):
+    """
+    ส่ง event 'progress' ไปยัง room ของงาน: ค่าสรุปที่เปลี่ยนไป และผลลัพธ์ของแถวที่เพิ่งเสร็จ
+    results_offset คือตำแหน่งของผลลัพธ์ชุดนี้ในรายการผลลัพธ์ของงาน
+    (หน้าเว็บใช้วางผลลัพธ์ตามตำแหน่ง จึงไม่ซ้ำแม้จะได้รับชุดเดียวกันจาก snapshot ตอน subscribe ด้วย)
+    """
+    status = get_job_store().get(job_id, with_results=False)
+    if status is None:
+        return
+    progress = job_progress_summary(status)
+    with status_lock:
+        previous = pushed_progress.get(job_id, {})
+        delta = {key: value for key, value in progress.items() if previous.get(key) != value}
+        finished = progress['completed'] or progress['state'] in FINISHED_STATES
+        if finished:
+            pushed_progress.pop(job_id, None)
+        else:
+            pushed_progress[job_id] = progress
+    if delta or results:
+        socketio.emit('progress', dict(delta, job_id=job_id, results=results or [], results_offset=results_offset), to=job_id)
+    if finished:
+        finish_log_push(job_id)
+
+def finish_log_push(job_id):
+    """
+    งานจบแล้ว: ส่ง log ที่เหลือไปยัง room ของงาน แล้วเลิกติดตาม log ของงานนี้
+    (ลบ cursor และนำ client ที่ subscribe งานนี้ออกจาก log_pusher แต่ยังอยู่ใน room ตามเดิม)
+    """
+    with socket_subscribers_lock:
+        sids = [sid for sid, subscribed in socket_subscribers.items() if subscribed == job_id]
+        for sid in sids:
+            del socket_subscribers[sid]
+        cursor = pushed_log_cursor.pop(job_id, 0)
+    if sids:
+        log = job_logs.read(job_id, cursor)
+        if log['logs']:
+            socketio.emit('log', dict(log, job_id=job_id), to=job_id)
+
+def log_pusher():
+    """ส่ง log ใหม่ของแต่ละงานไปยัง room ของงานนั้นทันทีที่มี (หยุดเมื่อไม่มี client)"""
+    global log_pusher_running
+    version = None
+    while True:
+        with socket_subscribers_lock:
+            if not socket_subscribers:
+                log_pusher_running = False
+                pushed_log_cursor.clear()
+                return
+            subscribed_jobs = set(socket_subscribers.values())
+            # งานที่ไม่มี client subscribe แล้ว (unsubscribe/disconnect) ไม่ต้องเก็บ cursor ไว้
+            for job_id in set(pushed_log_cursor) - subscribed_jobs:
+                del pushed_log_cursor[job_id]
+        version = job_logs.wait_for_change(version, timeout=1)
+        for job_id in subscribed_jobs:
+            with socket_subscribers_lock:
+                if job_id not in socket_subscribers.values():
+                    continue # งานจบหรือ client เลิกติดตามระหว่างรอ (finish_log_push ส่ง log ที่เหลือแล้ว)
+                log = job_logs.read(job_id, pushed_log_cursor.get(job_id, 0))
+                pushed_log_cursor[job_id] = log['next']
+            if log['logs']:
+                socketio.emit('log', dict(log, job_id=job_id), to=job_id)
+
+@socketio.on('subscribe')
+def on_subscribe(data):
+    """
+    client ขอติดตามงาน: เข้า room ของงานแล้วตอบ snapshot ของสถานะปัจจุบัน (รวมผลลัพธ์ทุกแถวที่เสร็จแล้วและ log ที่เก็บไว้)
+    หลังจากนี้จะได้รับ event 'progress' และ 'log' เมื่อมีการเปลี่ยนแปลง
+    """
+    global log_pusher_running
+    job_id = str((data or {}).get('job_id', ''))
+    join_room(job_id)
+    status = get_job_store().get(job_id)
+    if status is None:
+        return {'error': 'Job not found'}
+    if not status['completed'] and status['state'] not in FINISHED_STATES:
+        # log_pusher ติดตามเฉพาะงานที่ยังไม่จบ (งานที่จบแล้วได้ log ทั้งหมดไปกับ snapshot)
+        with socket_subscribers_lock:
+            socket_subscribers[request.sid] = job_id
+            start_pusher = not log_pusher_running
+            log_pusher_running = True
+        if start_pusher:
+            socketio.start_background_task(log_pusher)
+
+    snapshot = job_progress_summary(status)
+    snapshot.update(job_id=job_id, results=status['results'], results_offset=0)
+    snapshot['log'] = job_logs.read(job_id)
+    return snapshot
+
+@socketio.on('unsubscribe')
+def on_unsubscribe(data):
+    job_id = str((data or {}).get('job_id', ''))
+    leave_room(job_id)
+    with socket_subscribers_lock:
+        if socket_subscribers.get(request.sid) == job_id:
+            del socket_subscribers[request.sid] # log_pusher เลิกติดตามงานนี้ (และหยุดเมื่อไม่มี client เหลือ)
+
+@socketio.on('disconnect')
+def on_disconnect(*args):
+    with socket_subscribers_lock:
+        socket_subscribers.pop(request.sid, None)
 
-    finally:
-        # แก้ไขให้ลบเฉพาะโฟลเดอร์ย่อย
-        # เพื่อเก็บไฟล์ ZIP ที่อยู่ในโฟลเดอร์หลักไว้
-        if csv_root_dir and os.path.exists(csv_root_dir):
-            shutil.rmtree(csv_root_dir, ignore_errors=True)
-        if pdf_root_dir and os.path.exists(pdf_root_dir):
-            shutil.rmtree(pdf_root_dir, ignore_errors=True)
 
 # --- Flask Routes ---
 @app.route('/')
@@ -864,11 +3234,23 @@ def upload_form():
     """แสดงหน้าฟอร์มสำหรับอัปโหลดไฟล์ Excel (index.html)"""
     return render_template('index.html')
 
+def queue_full_response():
+    """HTTP 503 เมื่อคิวงานเต็ม (client ควรลองใหม่ตาม Retry-After)"""
+    response = jsonify({"error": "มีงานรอประมวลผลเต็มคิวแล้ว กรุณาลองใหม่ภายหลัง"})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(JOB_QUEUE_RETRY_AFTER)
+    return response
+
 @app.route('/generate_report', methods=['POST'])
 def generate_report():
     """
-    รับไฟล์ Excel ที่อัปโหลด และเริ่มการประมวลผลในเบื้องหลัง (new thread)
+    รับไฟล์ Excel ที่อัปโหลด และเริ่มการประมวลผลในเบื้องหลังผ่าน job_scheduler
+    (เริ่มทันทีหรือรอในคิว) หากคิวเต็มจะตอบ HTTP 503 พร้อม Retry-After
     """
+    if get_job_scheduler().reject_if_full():
+        # ปฏิเสธก่อนอ่านไฟล์ที่อัปโหลด
+        return queue_full_response()
+
     if 'excel_file' not in request.files:
         return jsonify({"error": "No file part"}), 400 # HTTP 400 Bad Request
     
@@ -880,53 +3262,89 @@ def generate_report():
         job_id = str(uuid.uuid4()) # สร้าง Unique ID สำหรับงานนี้
         file_stream = io.BytesIO(file.read()) # อ่านไฟล์เป็น BytesIO เพื่อส่งให้ Thread อื่น
 
-        # เริ่มต้นสถานะของงานใหม่ (thread-safe)
-        with status_lock:
-            processing_status[job_id] = {
-                'total': -1, # ยังไม่ทราบจำนวนทั้งหมด
-                'processed': 0, # จำนวนที่ประมวลผลแล้ว
-                'completed': False, # สถานะการเสร็จสมบูรณ์
-                'error': None, # ข้อความ error หากมี
-                'canceled': False, # สถานะการยกเลิก
-                'results': [], # ผลลัพธ์ของแต่ละรายการ
-                'temp_dir': None, # โฟลเดอร์ชั่วคราว
-                'zip_file_path': None, # Path ของไฟล์ ZIP
-                'timestamp': datetime.datetime.now() # เวลาที่เริ่มงาน
-            }
-        logger.info(f"📂 ได้รับไฟล์ excel '{file.filename}' และเริ่มการประมวลผล")
-
-        # สร้างและเริ่ม Thread สำหรับประมวลผลไฟล์ในเบื้องหลัง
-        thread = threading.Thread(target=process_file_in_background, args=(file_stream, job_id))
-        thread.daemon = True # ทำให้ Thread สิ้นสุดลงเมื่อโปรแกรมหลักจบ
-        thread.start()
+        # สร้างงานใหม่และเริ่ม Thread สำหรับประมวลผลไฟล์ในเบื้องหลัง (หรือรอในคิวหากมีงานทำอยู่ครบจำนวนแล้ว)
+        with job_log_context(job_id):
+            if not get_job_scheduler().submit(job_id, process_file_in_background, file_stream, job_id):
+                logger.warning(f"⚠️ ปฏิเสธไฟล์ excel '{file.filename}' เนื่องจากคิวงานเต็ม")
+                return queue_full_response()
+            status = get_job_store().get(job_id, with_results=False)
+            if status['state'] == 'queued':
+                logger.info(f"📂 ได้รับไฟล์ excel '{file.filename}' รอในคิวลำดับที่ {status['queue_position']}")
+            else:
+                logger.info(f"📂 ได้รับไฟล์ excel '{file.filename}' และเริ่มการประมวลผล")
 
         # ส่ง Job ID กลับไปให้ Client เพื่อใช้ติดตามสถานะ
-        return jsonify({"message": "Processing started", "job_id": job_id})
+        return jsonify({"message": "Queued" if status['state'] == 'queued' else "Processing started",
+                        "job_id": job_id, "queue_position": status['queue_position']})
+
+# ขนาดขั้นต่ำ (ไบต์) ของ JSON ที่จะบีบอัดด้วย gzip เมื่อ client รองรับ
+STATUS_GZIP_MIN_BYTES = 1024
+
+def conditional_json_response(payload):
+    """
+    สร้าง JSON Response ที่มี ETag: ตอบ 304 Not Modified หาก If-None-Match ของ client ตรงกับข้อมูลปัจจุบัน
+    และบีบอัดด้วย gzip เมื่อ client รองรับและข้อมูลยาวตั้งแต่ STATUS_GZIP_MIN_BYTES
+    """
+    body = app.json.dumps(payload).encode('utf-8')
+    compress = len(body) >= STATUS_GZIP_MIN_BYTES and request.accept_encodings.quality('gzip') > 0
+    etag = hashlib.sha1(body).hexdigest() + ('-gzip' if compress else '') # แต่ละรูปแบบการเข้ารหัสมี ETag ของตัวเอง
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        if compress:
+            body = gzip.compress(body, compresslevel=6)
+        response = Response(body, mimetype='application/json')
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = True # ให้ browser ตรวจ ETag กับ server ทุกครั้ง
+    return response
 
 @app.route('/status/<job_id>')
 def get_status(job_id):
     """
-    ตรวจสอบสถานะของงานที่กำลังประมวลผลอยู่
-    Client จะเรียก API นี้เป็นระยะๆ เพื่ออัปเดต UI
+    ตรวจสอบสถานะของงานที่กำลังประมวลผลอยู่แบบส่วนเพิ่ม
+    Client จะเรียก API นี้เป็นระยะๆ เพื่ออัปเดต UI โดยส่ง `since` = จำนวนผลลัพธ์ที่มีอยู่แล้ว (ค่าเริ่มต้น 0)
+    - ค่าสถานะของงาน (ยกเว้น results) และค่าสรุปจาก job_progress_summary (อัตราการประมวลผลและ ETA)
+    - state / queue_position: งานที่ยังรอในคิวมี state 'queued' และลำดับในคิว (เริ่มจาก 1)
+    - results: ผลลัพธ์เฉพาะแถวที่เพิ่มหลัง since, results_offset: ตำแหน่งของแถวแรก, results_next: cursor สำหรับครั้งถัดไป
+    - detail=1: เพิ่มสถานะสดของงานใน pipeline, ZIP และ SolarWinds API (เปลี่ยนทุกครั้งที่เรียก จึงแทบไม่ได้ 304)
+    รองรับ ETag/304 และ gzip (conditional_json_response)
     """
+    since = max(0, request.args.get('since', default=0, type=int))
+    detail = request.args.get('detail') == '1'
+    # อ่านเฉพาะผลลัพธ์ส่วนที่เพิ่มจาก snapshot ของงาน จึงไม่ช้าลงตามจำนวนแถวทั้งหมดของงาน
+    status = get_job_store().get(job_id, since=since) or {}
+    if status:
+        status.update(job_progress_summary(status))
+        status['results_offset'] = since
+        status['results_next'] = status['processed'] # จำนวนผลลัพธ์ทั้งหมดเท่ากับจำนวนแถวที่ประมวลผลแล้ว
     with status_lock:
-        status = processing_status.get(job_id, {}) # ดึงสถานะงาน (thread-safe)
-    return jsonify(status)
+        if detail and job_id in active_pipelines:
+            # สถานะของงานในแต่ละ stage ขณะกำลังทำงาน: ส่วนแบ่งของ Worker (share) และเวลารอในคิว
+            status['pipeline'] = report_pipeline.job_snapshot(active_pipelines[job_id])
+        if detail and job_id in active_archives:
+            status['archive'] = active_archives[job_id].summary()
+    if detail:
+        # สถานะของ SolarWinds API (ใช้ร่วมกันทุกงาน): จำนวนการลองใหม่และสถานะ circuit breaker
+        status['upstream'] = solarwinds_client.snapshot()
+    return conditional_json_response(status)
+
+@app.route('/metrics')
+def get_metrics():
+    """ค่า metric ทั้งหมดใน Prometheus text format สำหรับให้ Prometheus scrape"""
+    return Response(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/logs/<job_id>')
 def get_logs(job_id):
     """
-    ดึง log ของงานที่กำลังประมวลผลอยู่จาก Queue
-    Client จะเรียก API นี้เพื่อแสดง log แบบ Real-time
+    ดึง log ของงานตั้งแต่ cursor `since` (ค่าเริ่มต้น 0 = ทุกบรรทัดที่ยังเก็บไว้)
+    Client จะเรียก API นี้เพื่อแสดง log แบบ Real-time โดยส่งค่า 'next' จากครั้งก่อนเป็น since
+    คืนค่า {'logs', 'first', 'next', 'dropped'} ตาม JobLogStore.read
     """
-    logs = []
-    # ดึง log จาก queue จนกว่าจะว่าง
-    while not log_queue.empty():
-        try:
-            logs.append(log_queue.get_nowait()) # get_nowait() จะไม่รอถ้า queue ว่าง
-        except Exception:
-            break
-    return jsonify({"logs": logs})
+    since = request.args.get('since', default=0, type=int)
+    return jsonify(job_logs.read(job_id, max(0, since)))
 
 
 @app.route('/cancel/<job_id>', methods=['POST'])
@@ -934,14 +3352,20 @@ def cancel_job(job_id):
     """
     รับคำสั่งยกเลิกงานที่กำลังประมวลผลอยู่
     """
-    with status_lock:
-        if job_id in processing_status:
-            processing_status[job_id]['canceled'] = True # ตั้งค่า flag 'canceled' เป็น True
+    found = get_job_store().update(job_id, canceled=True) # ตั้งค่า flag 'canceled' เป็น True (Worker ตรวจจาก job_store)
+    if found:
+        get_job_scheduler().discard(job_id) # งานที่ยังรอในคิวถูกนำออกโดยไม่ต้องเริ่ม
+        with status_lock:
+            pipeline_job = active_pipelines.get(job_id)
+        if pipeline_job is not None:
+            pipeline_job.cancel() # Worker เห็นการยกเลิกทันทีโดยไม่ต้องรออ่านจาก job_store
+        with job_log_context(job_id):
             logger.info(f"⛔ ได้รับคำขอยกเลิกงาน")
-            return jsonify({"message": "Job cancellation requested"}), 200
-        else:
-            logger.warning(f"⚠️ พยายามยกเลิกงานที่ไม่พบ")
-            return jsonify({"error": "Job not found"}), 404
+        push_job_progress(job_id)
+        return jsonify({"message": "Job cancellation requested"}), 200
+    else:
+        logger.warning(f"⚠️ พยายามยกเลิกงานที่ไม่พบ")
+        return jsonify({"error": "Job not found"}), 404
 
 @app.route('/')
 def index():
@@ -952,14 +3376,13 @@ def download_converted_excel(job_id):
     """
     จัดการการดาวน์โหลดไฟล์ Excel (CSV) ที่ถูกแปลงแล้ว
     """
-    with status_lock:
-        status = processing_status.get(job_id)
-        if not status:
-            return jsonify({'error': 'Job ID not found'}), 404
+    status = get_job_store().get(job_id, with_results=False)
+    if not status:
+        return jsonify({'error': 'Job ID not found'}), 404
 
-        csv_file_path = status['csv_file_path']
-        if not csv_file_path or not os.path.exists(csv_file_path):
-            return jsonify({'error': 'File not found'}), 404
+    csv_file_path = status['csv_file_path']
+    if not csv_file_path or not os.path.exists(csv_file_path):
+        return jsonify({'error': 'File not found'}), 404
 
     try:
         # ดึงชื่อไฟล์จาก path เพื่อใช้เป็นชื่อไฟล์สำหรับดาวน์โหลด
@@ -974,8 +3397,7 @@ def download_report(job_id):
     """
     ให้ผู้ใช้ดาวน์โหลดไฟล์ ZIP ที่สร้างขึ้นเมื่อการประมวลผลเสร็จสมบูรณ์
     """
-    with status_lock:
-        status_entry = processing_status.get(job_id)
+    status_entry = get_job_store().get(job_id, with_results=False)
 
     if status_entry and status_entry['completed'] and status_entry['zip_file_path']:
         # แยกพาธของโฟลเดอร์และชื่อไฟล์ออกจากกัน
@@ -994,6 +3416,50 @@ def download_report(job_id):
         logger.error(f"❌ ไม่พบไฟล์ ZIP หรือยังสร้างไม่เสร็จ. Path: {status_entry.get('zip_file_path')}")
         return jsonify({"error": "File not found or report not completed."}), 404
 
+@app.route('/stream_report/<job_id>')
+def stream_report(job_id):
+    """
+    ดาวน์โหลดไฟล์ ZIP แบบ streaming ได้ตั้งแต่งานยังไม่เสร็จ
+    ส่งไฟล์ CSV/PDF ที่สร้างเสร็จแล้วทันที และส่งต่อเมื่อแต่ละแถวเสร็จ จนปิดท้ายด้วย central directory เมื่องานจบ
+    หากงานเสร็จไปแล้วจะส่งไฟล์ ZIP จากดิสก์ตามปกติ
+    หากงานถูกยกเลิกหรือผิดพลาดก่อนได้ ZIP ที่สมบูรณ์ จะตัดการเชื่อมต่อ (ReportStreamAborted) เพื่อให้เบราว์เซอร์แสดงว่าดาวน์โหลดล้มเหลว
+    """
+    status_entry = get_job_store().get(job_id, with_results=False)
+    if not status_entry:
+        return jsonify({"error": "Job not found"}), 404
+    download_name = status_entry.get('download_name') or f"{datetime.datetime.now().strftime('%Y%m%d')}_SummaryReportbyHour.zip"
+
+    if status_entry.get('completed') and status_entry.get('zip_file_path'):
+        return download_report(job_id)
+
+    def generate():
+        # รอจนกว่างานจะเปิดไฟล์ ZIP (ระหว่างอ่านไฟล์ Excel) แล้วส่งข้อมูลตามที่เขียนเสร็จ
+        while True:
+            with status_lock:
+                archive = active_archives.get(job_id)
+            status = get_job_store().get(job_id, with_results=False) or {}
+            zip_file_path = status.get('zip_file_path')
+            finished = not status or status.get('completed') or status.get('canceled')
+            if archive is not None:
+                yield from archive.iter_bytes()
+                return
+            if zip_file_path:
+                # งานเสร็จระหว่างรอ: ส่งไฟล์ที่สมบูรณ์แล้วจากดิสก์
+                with open(zip_file_path, 'rb') as f:
+                    while chunk := f.read(64 * 1024):
+                        yield chunk
+                return
+            if finished:
+                # งานจบโดยไม่มีไฟล์ ZIP (ยกเลิกหรือผิดพลาดก่อนเปิด ZIP)
+                raise ReportStreamAborted(f"งาน {job_id} จบโดยไม่มีไฟล์ ZIP")
+            time.sleep(0.5)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{download_name}"'}
+    )
+
 def cleanup_old_jobs():
     """
     ฟังก์ชันสำหรับลบสถานะงานและไฟล์ ZIP เก่าๆ ออกจากระบบ
@@ -1001,28 +3467,21 @@ def cleanup_old_jobs():
     """
     #logger.info("🧹 เริ่มต้นกระบวนการล้างข้อมูลงานเก่า...")
     current_time = datetime.datetime.now()
-    jobs_to_remove = [] # list สำหรับเก็บ job_id ของงานที่จะลบ
 
     retention_hours = 24 # ระยะเวลาเก็บงาน (ในที่นี้คือ 24 ชั่วโมง)
     retention_seconds = retention_hours * 3600
 
-    with status_lock:
-        # วนลูปผ่านงานทั้งหมดใน processing_status
-        for job_id, job_info in list(processing_status.items()): # ใช้ list(items()) เพื่อให้สามารถลบ item ขณะวนลูปได้
-            if job_info.get('completed') and job_info.get('timestamp'):
-                job_timestamp = job_info['timestamp']
-                # ถ้างานเสร็จสมบูรณ์และเกินระยะเวลาที่กำหนด ให้เพิ่มใน jobs_to_remove
-                if (current_time - job_timestamp).total_seconds() > retention_seconds:
-                    jobs_to_remove.append(job_id)
-            # ถ้างานไม่เสร็จสมบูรณ์ และค้างอยู่นานเกิน 1/4 ของระยะเวลา retention ให้ถือว่าค้างและลบออก
-            elif (not job_info.get('completed')) and (current_time - job_info.get('timestamp', current_time)).total_seconds() > (retention_seconds / 4):
-                logger.warning(f"⚠️ พบงานค้างเก่า (ไม่สมบูรณ์)")
-                jobs_to_remove.append(job_id)
-
+    # งานที่จบแล้ว (สำเร็จหรือผิดพลาด) และเกินระยะเวลาที่กำหนด
+    jobs_to_remove = list(get_job_store().find(('completed', 'failed'), current_time - datetime.timedelta(seconds=retention_seconds)))
+    # งานที่ไม่เสร็จสมบูรณ์ (รวมถึงงานที่ถูกยกเลิก) และค้างอยู่นานเกิน 1/4 ของระยะเวลา retention ให้ถือว่าค้างและลบออก
+    for job_id in get_job_store().find(('queued', 'running', 'canceled'), current_time - datetime.timedelta(seconds=retention_seconds / 4)):
+        logger.warning(f"⚠️ พบงานค้างเก่า (ไม่สมบูรณ์)")
+        jobs_to_remove.append(job_id)
 
     for job_id in jobs_to_remove:
-        with status_lock:
-            job_info = processing_status.pop(job_id, None) # ลบงานออกจาก processing_status
+        job_info = get_job_store().delete(job_id) # ลบงานและผลลัพธ์ออกจาก job_store
+        job_logs.remove(job_id)
+        pushed_log_cursor.pop(job_id, None)
         if job_info:
             zip_file_path = job_info.get('zip_file_path')
             # ถ้ามี path ของไฟล์ ZIP และไฟล์มีอยู่จริง ให้ลบไฟล์นั้นด้วย
@@ -1032,6 +3491,10 @@ def cleanup_old_jobs():
                     #logger.info(f"🗑️ ลบไฟล์ ZIP เก่า: {os.path.basename(zip_file_path)} (Job ID: {job_id})")
                 except Exception as e:
                     logger.error(f"❌ ข้อผิดพลาดในการลบไฟล์ ZIP เก่า: {e} ")
+            # ลบโฟลเดอร์ชั่วคราวของงาน (มีเพียงไฟล์ ZIP อยู่ข้างใน)
+            temp_dir = job_info.get('temp_dir')
+            if temp_dir and os.path.isdir(temp_dir):
+                shutil.rmtree(temp_dir, ignore_errors=True)
             logger.info(f"✨ ล้างสถานะงานสำหรับ Job ID: {job_id} แล้ว")
     #logger.info("🧹 กระบวนการล้างข้อมูลงานเก่าเสร็จสมบูรณ์")
     # ตั้งเวลาให้ฟังก์ชันนี้ทำงานอีกครั้งในอนาคต (ทุกครึ่งหนึ่งของระยะเวลา retention)
@@ -1039,12 +3502,20 @@ def cleanup_old_jobs():
 
 # --- Main Execution Block ---
 if __name__ == '__main__':
+    # เปิดฐานข้อมูลสถานะงานตั้งแต่เริ่มเซิร์ฟเวอร์ เพื่อตั้งสถานะงานที่ถูกขัดจังหวะจากการรันครั้งก่อนทันที
+    get_job_store()
+
     # สร้าง Thread สำหรับ cleanup_old_jobs และทำให้เป็น daemon เพื่อให้ Thread จบเมื่อ Main Thread จบ
     cleanup_thread = threading.Thread(target=cleanup_old_jobs)
     cleanup_thread.daemon = True
     cleanup_thread.start()
 
-    # รัน Flask application
-    # debug=True จะทำให้ Server รีโหลดอัตโนมัติเมื่อโค้ดเปลี่ยน และแสดง traceback ที่ละเอียดขึ้น
-    app.run(debug=True,host= '0.0.0.0',port=5050)
+    if SOCKETIO_ASYNC_MODE == 'threading' and not DEBUG:
+        # Werkzeug ไม่เหมาะกับเซิร์ฟเวอร์จริง: ใช้ waitress แทน (Socket.IO ใช้ long-polling เพราะ waitress ไม่รองรับ WebSocket)
+        from waitress import serve
+        serve(app, host=SERVER_HOST, port=SERVER_PORT, threads=16)
+    else:
+        # รัน Flask application ผ่าน Socket.IO (eventlet หรือ Werkzeug ในโหมดพัฒนา)
+        # debug=True จะทำให้ Server รีโหลดอัตโนมัติเมื่อโค้ดเปลี่ยน และแสดง traceback ที่ละเอียดขึ้น
+        socketio.run(app, debug=DEBUG, host=SERVER_HOST, port=SERVER_PORT, allow_unsafe_werkzeug=DEBUG)
 
@@ -0,0 +1,307 @@
+"""
+วัดประสิทธิภาพการสร้างรายงานทั้งกระบวนการ (Excel -> SOAP API -> CSV/PDF -> ZIP) กับเซิร์ฟเวอร์จำลอง (soap_stub.py)
+สร้างไฟล์ Excel ตามจำนวนแถวที่กำหนด แล้วส่งเข้า /generate_report (process_file_in_background) จนงานเสร็จ
+
+แต่ละขนาดรันใน process แยก เพื่อให้ peak RSS และ metric ของแต่ละขนาดไม่ปนกัน
+(ปิด response cache ไว้ เพื่อให้ทุกแถวเรียก API จริง) ผลลัพธ์ต่อขนาด:
+- rows_per_minute, elapsed_seconds
+- stages: busy seconds และเวลารอในคิว (wait) ของงานในแต่ละ stage ของ pipeline
+- operations: เวลารวม (ของทุก Thread รวมกัน จึงอาจมากกว่า elapsed) และจำนวนครั้งของแต่ละขั้นตอน จาก summary_report_operation_seconds
+- peak_rss_bytes (เฉพาะ process หลัก ไม่รวม process สร้าง PDF), archive_bytes
+- archive_ok: เปิดไฟล์ ZIP ที่ได้ด้วย zipfile และตรวจ CRC ทุกไฟล์ (testzip) ไม่ผ่านจะจบด้วย exit code 1
+- canceled_stream: ยกเลิกงานระหว่างดาวน์โหลดแบบ streaming (/stream_report) ผ่าน HTTP server จริง
+  response ต้องถูกตัดโดยไม่มี chunk ปิดท้าย (terminated = false) มิฉะนั้นจะจบด้วย exit code 1
+- concurrent: งานใหญ่ 2 งาน (ขนาดใหญ่สุดใน --rows) กำลังทำงาน แล้วอัปโหลดงานเล็ก (--small-rows) ตามเข้าไป
+  วัดเวลาที่งานเล็กรอคิว (queued_seconds) และเวลาจนเสร็จ เทียบกับงานใหญ่ (ตรวจว่างานเล็กไม่ต้องรองานใหญ่จบก่อน)
+
+วิธีใช้ (รันจากโฟลเดอร์หลักของโปรเจกต์):
+    python bench/bench_end_to_end.py --rows 10 100 1000
+    python bench/bench_end_to_end.py --rows 10000 --circuit-ratio 0.5 --latency lognormal:0.3,0.5 --json --output e2e.json
+ผลลัพธ์แบบ JSON ใช้ diff เทียบระหว่างเวอร์ชันได้ (เรียง key คงที่)
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, BENCH_DIR)
+from soap_stub import add_stub_arguments, start_stub_server, stub_options # noqa: E402
+
+
+def build_excel(rows, circuit_ratio, first_node=1000):
+    """
+    สร้างไฟล์ Excel (BytesIO) ที่มีคอลัมน์ตามที่แอปต้องการ
+    circuit_ratio คือสัดส่วนของวงจรที่ไม่ซ้ำกัน (1.0 = ทุกแถวคนละวงจร)
+    first_node คือ NodeID แรก (ใช้แยกวงจรของแต่ละงานเมื่อรันหลายงานพร้อมกัน)
+    """
+    import pandas as pd
+
+    circuits = max(1, round(rows * circuit_ratio))
+    df = pd.DataFrame({
+        'NodeID': [str(first_node + i % circuits) for i in range(rows)],
+        'Interface ID': [str(i % circuits) for i in range(rows)],
+        'กระทรวง / สังกัด': [f"กระทรวง {i % 5}" for i in range(rows)],
+        'กรม / สังกัด': [f"กรม {i % 17}" for i in range(rows)],
+        'จังหวัด': [f"จังหวัด {i % 77}" for i in range(rows)],
+        'ชื่อหน่วยงาน': [f"หน่วยงาน {i % circuits}" for i in range(rows)],
+        'Node Name': [f"node-{i:05d}" for i in range(rows)],
+    })
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024 # Linux รายงานเป็น KB
+
+
+def run_cancel_stream(rows, circuit_ratio):
+    """
+    ทำงานใน process ลูก: เริ่มดาวน์โหลด /stream_report ผ่าน HTTP server จริง แล้วยกเลิกงานหลังได้ข้อมูลก้อนแรก
+    Returns:
+    - dict: จำนวนไบต์ที่ได้รับ และ terminated (True = response จบด้วย chunk ปิดท้าย เบราว์เซอร์จะถือว่าดาวน์โหลดสำเร็จ)
+    """
+    import threading
+    from werkzeug.serving import make_server
+    import app
+
+    app.logger.removeHandler(app.console_handler)
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = app.app.test_client()
+    resp = client.post('/generate_report', data={'excel_file': (build_excel(rows, circuit_ratio), 'bench.xlsx')},
+                       content_type='multipart/form-data')
+    job_id = resp.get_json()['job_id']
+
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=120)
+    connection.request('GET', f'/stream_report/{job_id}')
+    response = connection.getresponse()
+    received = len(response.read1(64 * 1024)) # รอจน ZIP มีไฟล์แรก
+    client.post(f'/cancel/{job_id}')
+    terminated = False
+    try:
+        while chunk := response.read1(64 * 1024):
+            received += len(chunk)
+        terminated = True
+    except (http.client.IncompleteRead, ConnectionError):
+        pass # server ตัดการเชื่อมต่อก่อนส่ง chunk ปิดท้าย
+    connection.close()
+    server.shutdown()
+    return {'rows': rows, 'status': response.status, 'bytes': received, 'terminated': terminated}
+
+
+def run_one(rows, circuit_ratio):
+    """ทำงานใน process ลูก: สร้างรายงานหนึ่งงานแล้วคืนผลการวัด (dict)"""
+    import app
+
+    app.logger.removeHandler(app.console_handler)
+    excel = build_excel(rows, circuit_ratio)
+    client = app.app.test_client()
+
+    started = time.perf_counter()
+    resp = client.post('/generate_report', data={'excel_file': (excel, 'bench.xlsx')}, content_type='multipart/form-data')
+    job_id = resp.get_json()['job_id']
+    while True:
+        status = app.get_job_store().get(job_id, with_results=False)
+        if status['completed'] or status['error']:
+            break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    status = app.get_job_store().get(job_id)
+
+    operations = {}
+    for name, labels, value in app.operation_seconds.samples():
+        if name.endswith('_sum'):
+            operations.setdefault(labels['operation'], {})['seconds'] = round(value, 3)
+        elif name.endswith('_count'):
+            operations.setdefault(labels['operation'], {})['count'] = value
+
+    zip_path = status.get('zip_file_path')
+    archive_ok = None
+    if zip_path:
+        with zipfile.ZipFile(zip_path) as archive:
+            archive_ok = archive.testzip() is None and len(archive.namelist()) > 0
+    result = {
+        'rows': rows,
+        'circuits': max(1, round(rows * circuit_ratio)),
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_minute': round(rows / elapsed * 60, 1),
+        'failed_rows': sum(1 for r in status['results'] if r['error_message']),
+        'error': status['error'],
+        'stages': {
+            name: {key: stage[key] for key in ('busy_seconds', 'wait_seconds', 'max_wait_seconds')}
+            for name, stage in status.get('pipeline', {}).items()
+        },
+        'operations': operations,
+        'peak_rss_bytes': peak_rss_bytes(),
+        'archive_bytes': os.path.getsize(zip_path) if zip_path else None,
+        'archive_ok': archive_ok,
+        'upstream': {key: value for key, value in app.solarwinds_client.snapshot().items() if key not in ('breaker', 'limiter')},
+    }
+    if status.get('temp_dir'):
+        shutil.rmtree(status['temp_dir'], ignore_errors=True)
+    return result
+
+
+def run_concurrent(big_rows, small_rows, circuit_ratio):
+    """
+    ทำงานใน process ลูก: อัปโหลดงานใหญ่ 2 งาน รอจนทั้งสองงานเริ่มมีความคืบหน้า แล้วอัปโหลดงานเล็กตามเข้าไป
+    Returns:
+    - dict: เวลาที่งานเล็กรอในคิว เวลาจนงานเล็กเสร็จ (นับจากอัปโหลด) และเวลาที่งานใหญ่แต่ละงานเสร็จ
+    """
+    import app
+
+    app.logger.removeHandler(app.console_handler)
+    client = app.app.test_client()
+    store = app.get_job_store()
+
+    def submit(rows, first_node):
+        resp = client.post('/generate_report', data={'excel_file': (build_excel(rows, circuit_ratio, first_node), 'bench.xlsx')},
+                           content_type='multipart/form-data')
+        return resp.get_json()['job_id'], time.perf_counter()
+
+    big_jobs = [submit(big_rows, 100000 * (n + 1)) for n in range(2)]
+    while not all(store.get(job_id, with_results=False)['processed'] for job_id, _ in big_jobs):
+        time.sleep(0.05)
+    small_job, small_started = submit(small_rows, 1000)
+
+    finished = {}
+    queued_seconds = None
+    while len(finished) < len(big_jobs) + 1:
+        for job_id, started in big_jobs + [(small_job, small_started)]:
+            if job_id in finished:
+                continue
+            status = store.get(job_id, with_results=False)
+            if job_id == small_job and queued_seconds is None and status['state'] != 'queued':
+                queued_seconds = round(time.perf_counter() - small_started, 3)
+            if status['completed'] or status['error'] or status['state'] in ('failed', 'canceled'):
+                finished[job_id] = (round(time.perf_counter() - started, 3), status)
+        time.sleep(0.05)
+
+    small_seconds, small_status = finished[small_job]
+    return {
+        'big_rows': big_rows,
+        'small_rows': small_rows,
+        'max_running_jobs': app.MAX_RUNNING_JOBS,
+        'small_queued_seconds': queued_seconds,
+        'small_elapsed_seconds': small_seconds,
+        'small_state': small_status['state'],
+        'small_share': {name: stage['share'] for name, stage in small_status.get('pipeline', {}).items()},
+        'big_elapsed_seconds': [finished[job_id][0] for job_id, _ in big_jobs],
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark การสร้างรายงานทั้งกระบวนการกับ SOAP stub')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10, 100, 1000], help='จำนวนแถวของ Excel ในแต่ละรอบ (10-10000)')
+    parser.add_argument('--circuit-ratio', type=float, default=1.0, help='สัดส่วนวงจรที่ไม่ซ้ำกันต่อจำนวนแถว')
+    parser.add_argument('--small-rows', type=int, default=10, help='จำนวนแถวของงานเล็กที่อัปโหลดระหว่างงานใหญ่ 2 งานกำลังทำงาน')
+    parser.add_argument('--json', action='store_true', help='แสดงผลเป็น JSON')
+    parser.add_argument('--output', help='บันทึกผลลัพธ์ JSON ลงไฟล์')
+    parser.add_argument('--run-one', type=int, help=argparse.SUPPRESS) # ใช้ภายใน: รันหนึ่งขนาดใน process ลูก
+    parser.add_argument('--cancel-stream', type=int, help=argparse.SUPPRESS) # ใช้ภายใน: ทดสอบยกเลิกระหว่าง streaming ใน process ลูก
+    parser.add_argument('--concurrent', type=int, help=argparse.SUPPRESS) # ใช้ภายใน: งานใหญ่ 2 งาน + งานเล็ก ใน process ลูก
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        print(json.dumps(run_one(args.run_one, args.circuit_ratio)))
+        return
+    if args.cancel_stream is not None:
+        print(json.dumps(run_cancel_stream(args.cancel_stream, args.circuit_ratio)))
+        return
+    if args.concurrent is not None:
+        print(json.dumps(run_concurrent(args.concurrent, args.small_rows, args.circuit_ratio)))
+        return
+
+    stub = start_stub_server(**stub_options(args))
+    job_db_dir = tempfile.mkdtemp(prefix='bench_jobs_') # ฐานข้อมูลสถานะงานแยกจากของแอปจริง
+    env = dict(os.environ, SOLARWINDS_API_URL=stub.url, REPORT_CACHE_DIR='', REPORT_JOB_DB=os.path.join(job_db_dir, 'jobs.sqlite3'))
+
+    def run_child(mode, rows):
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), mode, str(rows), '--circuit-ratio', str(args.circuit_ratio),
+             '--small-rows', str(args.small_rows)],
+            cwd=PROJECT_DIR, env=env, capture_output=True, text=True)
+        if child.returncode != 0:
+            return {'rows': rows, 'error': (child.stderr.strip().splitlines() or ['exit code %d' % child.returncode])[-1]}
+        return json.loads(child.stdout.strip().splitlines()[-1])
+
+    results = [run_child('--run-one', rows) for rows in args.rows]
+    canceled_stream = run_child('--cancel-stream', max(args.rows))
+    concurrent = run_child('--concurrent', max(args.rows))
+    stub.shutdown()
+    shutil.rmtree(job_db_dir, ignore_errors=True)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'config': dict(stub_options(args), circuit_ratio=args.circuit_ratio),
+        'stub': stub.stats,
+        'results': results,
+        'canceled_stream': canceled_stream,
+        'concurrent': concurrent,
+    }
+    failed = canceled_stream.get('terminated', True) # ตัดการเชื่อมต่อไม่ได้หรือทดสอบไม่สำเร็จ ถือว่าล้มเหลว
+    broken_archives = [r['rows'] for r in results if r.get('archive_ok') is False]
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, sort_keys=True, ensure_ascii=False)
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True, ensure_ascii=False))
+        sys.exit(1 if failed or broken_archives else 0)
+
+    print(f"{'rows':>6} {'seconds':>9} {'rows/min':>9} {'failed':>7} {'peak RSS MB':>12} {'archive MB':>11}  slowest operations")
+    for r in results:
+        if 'elapsed_seconds' not in r:
+            print(f"{r['rows']:>6} ERROR {r['error']}")
+            continue
+        slowest = sorted(r['operations'].items(), key=lambda item: -item[1]['seconds'])[:3]
+        peak = f"{r['peak_rss_bytes'] / 2**20:.1f}" if r['peak_rss_bytes'] else '-'
+        archive = f"{r['archive_bytes'] / 2**20:.2f}" if r['archive_bytes'] else '-'
+        print(f"{r['rows']:>6} {r['elapsed_seconds']:>9.2f} {r['rows_per_minute']:>9.1f} {r['failed_rows']:>7} {peak:>12} {archive:>11}  "
+              + ", ".join(f"{name} {op['seconds']:.2f}s" for name, op in slowest))
+    if 'small_elapsed_seconds' in concurrent:
+        print(f"concurrent: 2 x {concurrent['big_rows']} + {concurrent['small_rows']} rows: small job queued "
+              f"{concurrent['small_queued_seconds']:.2f}s, done in {concurrent['small_elapsed_seconds']:.2f}s "
+              f"(big jobs: {', '.join(f'{s:.2f}s' for s in concurrent['big_elapsed_seconds'])})")
+    else:
+        print(f"concurrent: ERROR {concurrent.get('error')}")
+    if failed:
+        print(f"❌ ยกเลิกงานระหว่าง streaming แล้ว response ไม่ถูกตัดการเชื่อมต่อ: {canceled_stream}")
+    for rows in broken_archives:
+        print(f"❌ ไฟล์ ZIP ของรอบ {rows} แถวไม่ผ่าน testzip()")
+    sys.exit(1 if failed or broken_archives else 0)
+
+
+if __name__ == '__main__':
+    main()
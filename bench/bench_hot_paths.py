@@ -0,0 +1,170 @@
+"""
+Micro-benchmark ของส่วนที่ใช้ CPU มากที่สุด: process_json_data, export_to_csv และ export_to_pdf
+ป้อนข้อมูลสังเคราะห์ที่คงที่ (seed เดิมทุกครั้ง) ขนาด 1, 3 และ 12 เดือน ที่มีที่อยู่ภาษาไทยยาว
+และรหัสหน่วยงานที่เปลี่ยนกลางวัน (ทดสอบการแสดงรหัส/ชื่อหน่วยงานครั้งเดียวต่อช่วงใน PDF)
+
+วัดเวลาต่ำสุดจาก --repeat รอบ และหน่วยความจำที่จองสูงสุด (tracemalloc) แล้วเทียบกับ baseline ที่บันทึกไว้
+หากช้ากว่า baseline เกิน --max-slowdown เท่า หรือจองหน่วยความจำเกิน --max-alloc-growth เท่า จะจบด้วย exit code 1
+ทำงานแบบ offline ได้ (ไม่เรียก API และไม่เปิด Flask server)
+
+วิธีใช้ (รันจากโฟลเดอร์หลักของโปรเจกต์):
+    python bench/bench_hot_paths.py                      # เทียบกับ bench/hot_paths_baseline.json
+    python bench/bench_hot_paths.py --update-baseline    # บันทึกผลครั้งนี้เป็น baseline ใหม่
+    python bench/bench_hot_paths.py --only export_to_csv --months 1 3 --json
+baseline ขึ้นกับเครื่องที่วัด ควรสร้างใหม่ด้วย --update-baseline เมื่อเปลี่ยนเครื่องที่ใช้ตรวจ
+"""
+import argparse
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, PROJECT_DIR)
+os.chdir(PROJECT_DIR) # ไฟล์ฟอนต์ THSarabunNew.ttf อยู่ในโฟลเดอร์หลัก
+os.environ.setdefault('REPORT_CACHE_DIR', '') # ไม่ต้องใช้ response cache
+from app import export_to_csv, export_to_pdf, logger, process_json_data # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'hot_paths_baseline.json')
+LONG_THAI_ADDRESS = (
+    "องค์การบริหารส่วนตำบลหนองบัวศาลา อาคารศูนย์บริการประชาชนและเครือข่ายคอมพิวเตอร์ ชั้น ๒ ห้อง ๒๐๔ "
+    "หมู่ที่ ๑๑ ถนนมิตรภาพ-หนองคาย ตำบลหนองบัวศาลา อำเภอเมืองนครราชสีมา จังหวัดนครราชสีมา ๓๐๐๐๐"
+)
+
+
+def build_payload(months, seed=0):
+    """
+    สร้างข้อมูล JSON รายชั่วโมงจำนวน `months` เดือน (เริ่ม 1 ม.ค. 2024) ในรูปแบบเดียวกับ API
+    ขาดหายบางชั่วโมง (ให้ process_json_data เติมให้ครบ) และรหัสหน่วยงานเปลี่ยนทุก 36 ชั่วโมง
+    """
+    rng = random.Random(seed)
+    start = datetime.datetime(2024, 1, 1)
+    end_month = start.month + months
+    end = datetime.datetime(start.year + (end_month - 1) // 12, (end_month - 1) % 12 + 1, 1)
+    hours = int((end - start).total_seconds() // 3600)
+    items = []
+    for hour in range(hours):
+        if rng.random() < 0.02:
+            continue
+        items.append({
+            "Customer_Curcuit_ID": f"CIR-{1000 + hour // 36}",
+            "Address": LONG_THAI_ADDRESS,
+            "Timestamp": (start + datetime.timedelta(hours=hour)).strftime('%d/%m/%Y %H'),
+            "Bandwidth": "1000M",
+            "In_Averagebps": str(rng.randint(0, 1_000_000_000)),
+            "Out_Averagebps": f"{rng.uniform(0, 500_000_000):.2f}",
+        })
+    return items
+
+
+def measure(func, repeat):
+    """คืนค่า (เวลาต่ำสุดต่อครั้งเป็นมิลลิวินาที, หน่วยความจำที่จองสูงสุดเป็นไบต์)"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best * 1000, peak
+
+
+def run_benchmarks(months_list, only, repeat):
+    results = {}
+    for months in months_list:
+        payload = build_payload(months)
+        report = process_json_data(payload, 'bench', 'CIR-1000', LONG_THAI_ADDRESS)
+        cases = {
+            'process_json_data': lambda: process_json_data(payload, 'bench', 'CIR-1000', LONG_THAI_ADDRESS),
+            'export_to_csv': lambda: export_to_csv(report, io.StringIO(newline=''), 'bench', 'bench'),
+            'export_to_pdf': lambda: export_to_pdf(report, io.BytesIO(), 'bench', 'bench'),
+        }
+        for name, func in cases.items():
+            if only and name not in only:
+                continue
+            time_ms, peak_bytes = measure(func, repeat)
+            results[f"{name}/{months}m"] = {'time_ms': round(time_ms, 2), 'peak_bytes': peak_bytes}
+    return results
+
+
+def compare(results, baseline, max_slowdown, max_alloc_growth):
+    """
+    เทียบผลกับ baseline
+    Returns:
+    - list: ข้อความของกรณีที่ช้าลงหรือจองหน่วยความจำเพิ่มเกินเกณฑ์
+    """
+    regressions = []
+    for case, current in results.items():
+        previous = baseline.get(case)
+        if previous is None:
+            continue
+        current['time_ratio'] = round(current['time_ms'] / previous['time_ms'], 2)
+        current['alloc_ratio'] = round(current['peak_bytes'] / max(1, previous['peak_bytes']), 2)
+        if current['time_ratio'] > max_slowdown:
+            regressions.append(f"{case}: {current['time_ms']:.1f} ms เทียบกับ baseline {previous['time_ms']:.1f} ms "
+                               f"(x{current['time_ratio']}, เกณฑ์ x{max_slowdown})")
+        if current['alloc_ratio'] > max_alloc_growth:
+            regressions.append(f"{case}: จองหน่วยความจำ {current['peak_bytes']:,} ไบต์ เทียบกับ baseline {previous['peak_bytes']:,} ไบต์ "
+                               f"(x{current['alloc_ratio']}, เกณฑ์ x{max_alloc_growth})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark ของ process_json_data / export_to_csv / export_to_pdf')
+    parser.add_argument('--months', type=int, nargs='+', default=[1, 3, 12], help='ขนาดข้อมูล (จำนวนเดือน)')
+    parser.add_argument('--only', nargs='+', choices=['process_json_data', 'export_to_csv', 'export_to_pdf'], help='วัดเฉพาะฟังก์ชันที่ระบุ')
+    parser.add_argument('--repeat', type=int, default=3, help='จำนวนรอบที่วัดเวลา (ใช้ค่าที่เร็วที่สุด)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='ไฟล์ baseline (JSON)')
+    parser.add_argument('--update-baseline', action='store_true', help='บันทึกผลครั้งนี้เป็น baseline แทนการเทียบ')
+    parser.add_argument('--max-slowdown', type=float, default=1.3, help='อัตราส่วนเวลาสูงสุดที่ยอมรับเทียบกับ baseline')
+    parser.add_argument('--max-alloc-growth', type=float, default=1.2, help='อัตราส่วนหน่วยความจำสูงสุดที่ยอมรับเทียบกับ baseline')
+    parser.add_argument('--json', action='store_true', help='แสดงผลเป็น JSON')
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING) # ไม่แสดง log ความสำเร็จของแต่ละไฟล์
+    results = run_benchmarks(args.months, args.only, args.repeat)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+        baseline['machine'] = {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+        baseline.setdefault('results', {}).update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"บันทึก baseline {len(results)} กรณีลง {args.baseline}")
+        return
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline.get('results', {}), args.max_slowdown, args.max_alloc_growth)
+    else:
+        print(f"ไม่พบ baseline {args.baseline} (สร้างด้วย --update-baseline)", file=sys.stderr)
+
+    if args.json:
+        print(json.dumps({'results': results, 'regressions': regressions}, indent=2, sort_keys=True, ensure_ascii=False))
+    else:
+        print(f"{'case':<24} {'time ms':>10} {'x base':>7} {'peak alloc':>14} {'x base':>7}")
+        for case, r in results.items():
+            print(f"{case:<24} {r['time_ms']:>10.2f} {r.get('time_ratio', '-'):>7} {r['peak_bytes']:>14,} {r.get('alloc_ratio', '-'):>7}")
+        for message in regressions:
+            print(f"❌ {message}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+เปรียบเทียบเวลาและหน่วยความจำในการดึงข้อมูลส่วน 'return' จาก SOAP Response ตามขนาดข้อมูล
+- legacy: decode ทั้งข้อความเป็น str -> ค้นหา Envelope ด้วย regex -> ET.fromstring -> find('return')
+- streaming: extract_soap_return() ป้อน bytes ดิบให้ ET.XMLPullParser ทีละ chunk
+
+วิธีใช้ (รันจากโฟลเดอร์หลักของโปรเจกต์):
+    python bench/bench_soap_parse.py
+    python bench/bench_soap_parse.py --days 1 31 92 --repeat 20 --json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import SOAP_ENVELOPE_PATTERN, extract_soap_return # noqa: E402
+
+
+def build_response(days):
+    """สร้าง SOAP Response (bytes) ที่มีข้อมูลรายชั่วโมงจำนวน `days` วัน ในรูปแบบเดียวกับ API จริง"""
+    items = []
+    for day in range(days):
+        for hour in range(24):
+            items.append({
+                "Customer_Curcuit_ID": "C1001",
+                "Address": "สำนักงานเทศบาล ตำบลบางพลี จังหวัดสมุทรปราการ",
+                "Timestamp": f"{day % 28 + 1:02d}/{day // 28 % 12 + 1:02d}/2025 {hour:02d}",
+                "Bandwidth": "100M",
+                "In_Averagebps": str(1000 * day + 17 * hour),
+                "Out_Averagebps": f"{500.5 * hour + day}",
+            })
+    envelope = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ns1="urn:solarwinds">'
+        '<SOAP-ENV:Body><ns1:circuitStatusResponse><return>'
+        + escape(json.dumps(items))
+        + '</return></ns1:circuitStatusResponse></SOAP-ENV:Body></SOAP-ENV:Envelope>'
+    )
+    return envelope.encode('utf-8')
+
+
+def legacy_extract(content):
+    text = content.decode('utf-8') # เทียบเท่า resp.text
+    match = SOAP_ENVELOPE_PATTERN.search(text)
+    return ET.fromstring(match.group(1)).find('.//{*}return').text
+
+
+def measure(func, content, repeat):
+    """คืนค่า (เวลาต่ำสุดต่อครั้งเป็นมิลลิวินาที, หน่วยความจำสูงสุดที่จองเพิ่มเป็นไบต์)"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(content)
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    func(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best * 1000, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark การดึงข้อมูล 'return' จาก SOAP Response")
+    parser.add_argument('--days', type=int, nargs='+', default=[1, 7, 31, 92], help='จำนวนวันของข้อมูลรายชั่วโมงในแต่ละขนาด')
+    parser.add_argument('--repeat', type=int, default=10, help='จำนวนรอบที่วัดเวลา (ใช้ค่าที่เร็วที่สุด)')
+    parser.add_argument('--json', action='store_true', help='แสดงผลเป็น JSON')
+    args = parser.parse_args()
+
+    results = []
+    for days in args.days:
+        content = build_response(days)
+        assert legacy_extract(content) == extract_soap_return(content)
+        legacy_ms, legacy_peak = measure(legacy_extract, content, args.repeat)
+        streaming_ms, streaming_peak = measure(extract_soap_return, content, args.repeat)
+        results.append({
+            'days': days,
+            'payload_bytes': len(content),
+            'legacy_ms': round(legacy_ms, 3),
+            'streaming_ms': round(streaming_ms, 3),
+            'speedup': round(legacy_ms / streaming_ms, 2),
+            'legacy_peak_bytes': legacy_peak,
+            'streaming_peak_bytes': streaming_peak,
+        })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'days':>5} {'payload':>10} {'legacy ms':>10} {'stream ms':>10} {'speedup':>8} {'legacy peak':>12} {'stream peak':>12}")
+    for r in results:
+        print(f"{r['days']:>5} {r['payload_bytes']:>10,} {r['legacy_ms']:>10.2f} {r['streaming_ms']:>10.2f} {r['speedup']:>7.2f}x "
+              f"{r['legacy_peak_bytes']:>12,} {r['streaming_peak_bytes']:>12,}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+เซิร์ฟเวอร์จำลอง SolarWinds API (circuitStatus) สำหรับทดสอบประสิทธิภาพโดยไม่ต้องใช้ host จริง
+ตอบ SOAP Envelope รูปแบบเดียวกับ API จริง โดยส่วน 'return' เป็น JSON รายชั่วโมงที่สร้างขึ้น (ข้อมูลเดียวกันทุกครั้งสำหรับ nodID/itfID เดิม)
+
+ตั้งค่าได้:
+- ขนาดข้อมูล: จำนวนวันของข้อมูลรายชั่วโมง (--days) และสัดส่วนชั่วโมงที่ขาดหาย (--missing-ratio)
+- เวลาตอบสนอง (--latency): fixed:<วินาที>, uniform:<ต่ำสุด>,<สูงสุด>, exponential:<ค่าเฉลี่ย> หรือ lognormal:<มัธยฐาน>,<sigma>
+- อัตราความผิดพลาด: --error-rate (HTTP 503) และ --malformed-rate (XML ไม่สมบูรณ์)
+
+วิธีใช้ (รันจากโฟลเดอร์หลักของโปรเจกต์):
+    python bench/soap_stub.py --port 8099 --latency lognormal:0.3,0.5 --error-rate 0.02
+    SOLARWINDS_API_URL=http://127.0.0.1:8099/api_csoc_02/server_solarwinds_ginv2.php python app.py
+"""
+import argparse
+import calendar
+import datetime
+import functools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+STUB_PATH = '/api_csoc_02/server_solarwinds_ginv2.php'
+REQUEST_ID_PATTERN = re.compile(rb'<nodID>(.*?)</nodID>.*?<itfID>(.*?)</itfID>', re.DOTALL)
+
+
+def parse_latency(spec):
+    """
+    แปลงข้อความกำหนดเวลาตอบสนองเป็นฟังก์ชันสุ่มเวลา (วินาที)
+    Parameters:
+    - spec (str): เช่น 'fixed:0.2', 'uniform:0.1,0.5', 'exponential:0.3', 'lognormal:0.3,0.5'
+    Returns:
+    - callable: รับ random.Random แล้วคืนเวลาที่ต้องรอ
+    """
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',')] if args else []
+    if kind == 'fixed':
+        return lambda rng: values[0] if values else 0.0
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'exponential':
+        return lambda rng: rng.expovariate(1 / values[0])
+    if kind == 'lognormal':
+        median, sigma = values
+        return lambda rng: median * rng.lognormvariate(0, sigma)
+    raise ValueError(f"รูปแบบ latency ไม่ถูกต้อง: {spec}")
+
+
+def build_items(nod_id, itf_id, days, missing_ratio=0.0, month=None):
+    """
+    สร้างข้อมูลรายชั่วโมง (list ของ dict) ของวงจรในเดือนของรายงาน ในรูปแบบเดียวกับ API จริง
+    ข้อมูลถูกสุ่มจาก seed ของ nodID/itfID จึงได้ผลลัพธ์เดิมทุกครั้ง
+    """
+    rng = random.Random(f"{nod_id}/{itf_id}")
+    if month is None:
+        # API คืนข้อมูลของเดือนก่อนหน้า
+        month = datetime.date.today().replace(day=1) - datetime.timedelta(days=1)
+    days_in_month = calendar.monthrange(month.year, month.month)[1]
+    bandwidth = rng.choice(["100M", "200M", "1G", "FTTx 20M"])
+    items = []
+    for day in range(days):
+        date = month.replace(day=day % days_in_month + 1)
+        for hour in range(24):
+            if rng.random() < missing_ratio:
+                continue
+            items.append({
+                "Customer_Curcuit_ID": f"C{nod_id}-{itf_id}",
+                "Address": "สำนักงานเทศบาล ตำบลบางพลี จังหวัดสมุทรปราการ",
+                "Timestamp": f"{date:%d/%m/%Y} {hour:02d}",
+                "Bandwidth": bandwidth,
+                "In_Averagebps": str(rng.randint(0, 100_000_000)),
+                "Out_Averagebps": f"{rng.uniform(0, 50_000_000):.2f}",
+            })
+    return items
+
+
+def build_envelope(items):
+    """ห่อข้อมูล JSON ด้วย SOAP Envelope แบบเดียวกับ API จริง (bytes)"""
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ns1="urn:solarwinds">'
+        '<SOAP-ENV:Body><ns1:circuitStatusResponse><return>'
+        + escape(json.dumps(items))
+        + '</return></ns1:circuitStatusResponse></SOAP-ENV:Body></SOAP-ENV:Envelope>'
+    ).encode('utf-8')
+
+
+class StubServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer ที่เก็บค่าตั้งค่าของ stub และจำนวนคำขอที่ตอบไปแล้ว"""
+    daemon_threads = True
+
+    def __init__(self, address, days=31, missing_ratio=0.0, latency='fixed:0', error_rate=0.0, malformed_rate=0.0, seed=0):
+        super().__init__(address, StubHandler)
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.envelope_for = functools.lru_cache(maxsize=4096)(
+            lambda nod_id, itf_id: build_envelope(build_items(nod_id, itf_id, days, missing_ratio)))
+        self.stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'malformed': 0, 'bytes_sent': 0}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{STUB_PATH}"
+
+    def count(self, **amounts):
+        with self.stats_lock:
+            for key, amount in amounts.items():
+                self.stats[key] += amount
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive เหมือนการใช้ Session ของแอป
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        match = REQUEST_ID_PATTERN.search(body)
+        if not match:
+            self.reply(400, b'missing nodID/itfID')
+            return
+
+        server = self.server
+        with server.rng_lock:
+            delay = server.latency(server.rng)
+            roll = server.rng.random()
+        time.sleep(max(0.0, delay))
+
+        if roll < server.error_rate:
+            server.count(requests=1, errors=1)
+            self.reply(503, b'Service Unavailable')
+            return
+        envelope = server.envelope_for(match.group(1).decode(), match.group(2).decode())
+        if roll < server.error_rate + server.malformed_rate:
+            # ตัด Envelope ทิ้งครึ่งหนึ่ง: XML ไม่สมบูรณ์
+            server.count(requests=1, malformed=1)
+            envelope = envelope[:len(envelope) // 2]
+        else:
+            server.count(requests=1)
+        self.reply(200, envelope, 'text/xml; charset=utf-8')
+
+    def reply(self, status, payload, content_type='text/plain; charset=utf-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        self.server.count(bytes_sent=len(payload))
+
+    def log_message(self, format, *args):
+        pass # ไม่แสดง access log
+
+
+def start_stub_server(host='127.0.0.1', port=0, **options):
+    """เริ่ม StubServer ใน daemon Thread แล้วคืนค่า server (ใช้ server.url เป็น SOLARWINDS_API_URL)"""
+    server = StubServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name='soap_stub', daemon=True).start()
+    return server
+
+
+def add_stub_arguments(parser):
+    """เพิ่ม argument ของ stub ให้ parser (ใช้ร่วมกับ bench_end_to_end.py)"""
+    parser.add_argument('--days', type=int, default=31, help='จำนวนวันของข้อมูลรายชั่วโมงต่อวงจร')
+    parser.add_argument('--missing-ratio', type=float, default=0.0, help='สัดส่วนชั่วโมงที่ไม่มีข้อมูล (0-1)')
+    parser.add_argument('--latency', default='fixed:0.05', help='การกระจายของเวลาตอบสนอง เช่น lognormal:0.3,0.5')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='สัดส่วนคำขอที่ตอบ HTTP 503')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='สัดส่วนคำขอที่ตอบ XML ไม่สมบูรณ์')
+    parser.add_argument('--seed', type=int, default=0, help='seed ของการสุ่ม latency/error')
+
+
+def stub_options(args):
+    return {
+        'days': args.days,
+        'missing_ratio': args.missing_ratio,
+        'latency': args.latency,
+        'error_rate': args.error_rate,
+        'malformed_rate': args.malformed_rate,
+        'seed': args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='เซิร์ฟเวอร์จำลอง SolarWinds circuitStatus API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), **stub_options(args))
+    print(f"SOAP stub: {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+# ไม่ใช้ response cache และฐานข้อมูลสถานะงานของแอปจริงระหว่างทดสอบ
+os.environ.setdefault('REPORT_CACHE_DIR', '')
+os.environ.setdefault('REPORT_JOB_DB', os.path.join(tempfile.mkdtemp(prefix='report_tests_'), 'jobs.sqlite3'))
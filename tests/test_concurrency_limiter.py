@@ -0,0 +1,65 @@
+import threading
+import time
+
+from app import AdaptiveConcurrencyLimiter
+
+
+def test_acquire_blocks_at_limit_until_release():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=1, max_limit=2, latency_target=1.0)
+    limiter.acquire()
+    limiter.acquire()
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    waiter.start()
+    assert not acquired.wait(0.1)
+    limiter.release(0.01)
+    assert acquired.wait(5)
+    waiter.join(5)
+    assert limiter.in_flight == 2
+
+
+def test_fast_success_under_load_increases_limit_additively():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=1, max_limit=4, latency_target=1.0)
+    limiter.acquire()
+    limiter.acquire()
+    limiter.release(0.01) # in-flight 2 >= ครึ่งหนึ่งของ limit
+    assert limiter.snapshot()['limit'] == 3
+    limiter.release(0.01) # in-flight 1 < 1.5: ไม่ได้ใช้ limit เต็มที่ จึงไม่เพิ่ม
+    assert limiter.snapshot()['limit'] == 3
+
+
+def test_drop_or_slow_response_decreases_limit_multiplicatively():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8, min_limit=2, max_limit=8, latency_target=0.5, backoff_ratio=0.5)
+    limiter.acquire()
+    limiter.release(0.01, dropped=True)
+    assert limiter.snapshot()['limit'] == 4
+    limiter.acquire()
+    limiter.release(0.9) # ช้ากว่า latency_target
+    assert limiter.snapshot()['limit'] == 2
+    limiter.acquire()
+    limiter.release(0.01, dropped=True)
+    snapshot = limiter.snapshot()
+    assert snapshot['limit'] == 2 # ไม่ต่ำกว่า min_limit
+    assert snapshot['decreases'] == 2
+    assert snapshot['samples'] == 3 and set(snapshot['latency_ms']) == {'p50', 'p90', 'p99'}
+
+
+def test_concurrent_callers_never_exceed_limit():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=3, min_limit=3, max_limit=3, latency_target=1.0)
+    lock = threading.Lock()
+    peak = [0]
+
+    def call():
+        limiter.acquire()
+        with lock:
+            peak[0] = max(peak[0], limiter.in_flight)
+        time.sleep(0.01)
+        limiter.release(0.01)
+
+    threads = [threading.Thread(target=call) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert peak[0] <= 3
+    assert limiter.in_flight == 0
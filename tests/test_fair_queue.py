@@ -0,0 +1,46 @@
+import threading
+
+from app import FairQueue
+
+
+def drain(queue, count):
+    return [queue.get()[:2] for _ in range(count)]
+
+
+def test_flow_served_alone_does_not_starve_later():
+    queue = FairQueue()
+    for i in range(5):
+        queue.put('a', f'a{i}')
+    assert drain(queue, 3) == [('a', 'a0'), ('a', 'a1'), ('a', 'a2')]
+
+    # งาน b เข้ามาหลังจาก a ได้รับงานเพียงงานเดียวไปหลายชิ้น: ต้องสลับกัน ไม่ใช่ให้ b ได้ทั้งหมดก่อน
+    for i in range(3):
+        queue.put('b', f'b{i}')
+    assert [item for _, item in drain(queue, 5)] == ['b0', 'a3', 'b1', 'a4', 'b2']
+    assert queue.qsize() == 0
+
+
+def test_share_follows_cost():
+    queue = FairQueue(quantum=2)
+    for i in range(4):
+        queue.put('big', f'big{i}', cost=2)
+    for i in range(8):
+        queue.put('small', f'small{i}', cost=1)
+
+    keys = [key for key, _ in drain(queue, 9)]
+    # รอบละ 2 แถว: big ได้หนึ่งชิ้น (2 แถว) ต่อ small สองชิ้น (1 แถวต่อชิ้น)
+    assert keys == ['big', 'small', 'small'] * 3
+    assert queue.qsize('big') == 1 and queue.qsize('small') == 2
+
+
+def test_get_waits_for_put():
+    queue = FairQueue()
+    got = []
+    consumer = threading.Thread(target=lambda: got.append(queue.get()))
+    consumer.start()
+    queue.put('a', 'item')
+    consumer.join(5)
+
+    key, item, waited = got[0]
+    assert (key, item) == ('a', 'item')
+    assert waited >= 0
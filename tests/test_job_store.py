@@ -0,0 +1,99 @@
+import socket
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from app import JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / 'jobs.sqlite3'))
+
+
+def test_concurrent_appends_have_no_gaps(store):
+    store.create('job')
+    offsets = []
+
+    def worker(n):
+        for i in range(20):
+            offsets.append(store.append_results('job', [{'worker': n, 'row': i}]))
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    job = store.get('job')
+    assert sorted(offsets) == list(range(160))
+    assert job['processed'] == 160
+    assert len(job['results']) == 160
+    # แต่ละ Worker เห็นผลลัพธ์ของตัวเองตามลำดับที่ส่ง
+    for n in range(8):
+        assert [r['row'] for r in job['results'] if r['worker'] == n] == list(range(20))
+
+
+def test_counters_are_written_with_results(store):
+    store.create('job')
+    store.append_results('job', [{'row': 0}], {'cache_hits': 2, 'cache_misses': 1})
+    store.append_results('job', [{'row': 1}], {'cache_hits': 1, 'cache_coalesced': 0})
+
+    job = store.get('job', with_results=False)
+    assert job['processed'] == 2
+    assert job['cache'] == {'hits': 3, 'misses': 1, 'coalesced': 0}
+    with pytest.raises(ValueError):
+        store.append_results('job', [], {'unknown': 1})
+
+
+def test_failed_group_commit_is_raised_in_every_caller(store, monkeypatch):
+    store.create('job')
+    store.append_results('job', [{'row': 0}])
+    errors = []
+
+    def append(row):
+        try:
+            store.append_results('job', [{'row': row}])
+        except sqlite3.OperationalError as e:
+            errors.append(str(e))
+
+    def fail(batch):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    # ถือ lock ไว้ ให้ผลลัพธ์ทั้งสามชุดรวมอยู่ใน group commit เดียวกัน
+    with store._write_lock:
+        threads = [threading.Thread(target=append, args=(row,)) for row in (1, 2, 3)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while len(store._pending) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        monkeypatch.setattr(store, '_write_results', fail)
+    for thread in threads:
+        thread.join(5)
+    monkeypatch.undo()
+
+    assert errors == ['disk I/O error'] * 3
+    # seq ถัดไปต่อจากผลลัพธ์ที่บันทึกแล้วจริง ไม่มีช่องว่าง
+    assert store.append_results('job', [{'row': 4}]) == 1
+    job = store.get('job')
+    assert job['processed'] == 2
+    assert [r['row'] for r in job['results']] == [0, 4]
+
+
+def test_recover_interrupted_fails_jobs_of_dead_owners(store):
+    store.create('alive')
+    store.create('dead')
+    store.create('done')
+    store.update('done', state='completed', completed=True)
+    # PID 1 ที่มี token ไม่ตรงกับการรันจริง: process ที่รับงานไม่อยู่แล้ว
+    store._connection().execute('UPDATE jobs SET owner = ? WHERE job_id IN (?, ?)',
+                                (f"{socket.gethostname()}:1:stale", 'dead', 'done'))
+
+    assert store.recover_interrupted() == ['dead']
+    dead = store.get('dead', with_results=False)
+    assert dead['state'] == 'failed' and dead['completed'] and dead['error']
+    assert store.get('alive', with_results=False)['state'] == 'running'
+    assert store.get('done', with_results=False)['state'] == 'completed'
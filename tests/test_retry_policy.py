@@ -0,0 +1,54 @@
+import time
+
+from app import CircuitBreaker, RetryBudget
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    breaker.record_success() # สำเร็จคั่นกลาง: นับใหม่
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+
+def test_breaker_half_open_allows_limited_probes():
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05, half_open_max_calls=1)
+    breaker.record_failure()
+    assert not breaker.allow_request()
+    time.sleep(0.06)
+    assert breaker.allow_request() # คำขอทดสอบ
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request() # ระหว่างรอผลคำขอทดสอบ
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.snapshot()['transitions'] == {
+        'closed->open': 1, 'open->half_open': 2, 'half_open->open': 1, 'half_open->closed': 1}
+
+
+def test_retry_budget_starts_with_reserve_and_refills_by_ratio():
+    budget = RetryBudget(ratio=0.5, reserve=2)
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw() # 0.5 token ยังไม่พอ
+    budget.deposit()
+    assert budget.withdraw()
+
+
+def test_retry_budget_is_capped_at_reserve():
+    budget = RetryBudget(ratio=1, reserve=2)
+    for _ in range(10):
+        budget.deposit()
+    assert [budget.withdraw() for _ in range(3)] == [True, True, False]
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+from app import SingleFlight
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'data'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', fn)))
+    leader.start()
+    assert started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('key', fn))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    time.sleep(0.2) # ให้ follower เข้าไปรอผลของการเรียกที่กำลังทำงานอยู่
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results) == [('data', False)] + [('data', True)] * 3
+
+
+def test_error_is_raised_in_every_waiter():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fn():
+        started.set()
+        release.wait(5)
+        raise ValueError('upstream failed')
+
+    errors = []
+
+    def call():
+        try:
+            flight.do('key', fn)
+        except ValueError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert errors == ['upstream failed', 'upstream failed']
+
+
+def test_finished_key_is_called_again():
+    flight = SingleFlight()
+    assert flight.do('key', lambda: 1) == (1, False)
+    assert flight.do('key', lambda: 2) == (2, False)
+    with pytest.raises(KeyError):
+        flight.do('key', lambda: {}['missing'])
+    assert flight.do('key', lambda: 3) == (3, False)